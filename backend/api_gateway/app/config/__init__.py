@@ -32,6 +32,10 @@ class Settings(BaseSettings):
     # Security
     jwt_secret_key: str = os.getenv("JWT_SECRET_KEY", "your-secret-key-change-in-production")
     
+    # Metrics scraping: peer networks allowed without a token, and the scrape token
+    metrics_allowed_networks: List[str] = ["127.0.0.1/32", "::1/128"]
+    metrics_token: str = os.getenv("METRICS_TOKEN", "")
+    
     class Config:
         env_file = ".env"
         case_sensitive = False
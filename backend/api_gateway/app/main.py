@@ -2,7 +2,7 @@
 API Gateway main application for A-EMS microservices.
 """
 
-from fastapi import FastAPI, Request, HTTPException
+from fastapi import FastAPI, Request, HTTPException, Response
 from fastapi.middleware.cors import CORSMiddleware
 from contextlib import asynccontextmanager
 import httpx
@@ -13,8 +13,14 @@ import logging
 # Import shared utilities
 import sys
 sys.path.append('..')
+from shared.auth.revocation import check_revocation_feed
+from shared.logging.correlation import inject_correlation_id
 from shared.logging.logger import get_logger
 from shared.logging.middleware import LoggingMiddleware
+from shared.logging.events import shutdown_event_aggregation
+from shared.logging.pipeline import shutdown_logging
+from shared.logging.tracing import end_client_span, shutdown_tracing, start_client_span
+from shared.metrics import CONTENT_TYPE_LATEST, MetricsAccess, registry, render_metrics
 from shared.middleware import add_middleware
 from .routing import setup_routes
 from .config import get_settings
@@ -28,10 +34,20 @@ async def lifespan(app: FastAPI):
     """Application lifespan management."""
     logger.info("API Gateway starting up")
     
+    # Tokens revoked at the auth service must be rejected here too
+    check_revocation_feed(issuer=False)
+    
+    # Drop metric snapshots left by workers that exited without cleaning up
+    registry.remove_dead_snapshots()
+    
     # Initialize HTTP client for service communication
     app.state.http_client = httpx.AsyncClient(
         timeout=httpx.Timeout(30.0),
-        limits=httpx.Limits(max_keepalive_connections=20, max_connections=100)
+        limits=httpx.Limits(max_keepalive_connections=20, max_connections=100),
+        event_hooks={
+            "request": [inject_correlation_id, start_client_span],
+            "response": [end_client_span]
+        }
     )
     
     yield
@@ -39,6 +55,11 @@ async def lifespan(app: FastAPI):
     # Cleanup
     await app.state.http_client.aclose()
     logger.info("API Gateway shutting down")
+    
+    # Flush event rollups, then drain queued spans and log records
+    shutdown_event_aggregation()
+    shutdown_tracing()
+    shutdown_logging()
 
 
 def create_app() -> FastAPI:
@@ -63,10 +84,19 @@ def create_app() -> FastAPI:
         "rate_limit": settings.rate_limit_per_minute,
         "excluded_paths": [
             "/health",
+            "/metrics",
             "/docs",
             "/redoc",
-            "/openapi.json"
-        ]
+            "/openapi.json",
+            "/api/auth/login",
+            "/api/auth/register",
+            "/api/auth/refresh",
+            "/api/auth/mfa/verify"
+        ],
+        # Clients must never be able to supply verified claims themselves
+        "trust_internal_claims": False,
+        # Nor force trace sampling with their traceparent flags
+        "trust_incoming_sampling": False
     })
     
     # Setup routes
@@ -77,6 +107,7 @@ def create_app() -> FastAPI:
 
 # Create app instance
 app = create_app()
+metrics_access = MetricsAccess(get_settings().metrics_allowed_networks, get_settings().metrics_token)
 
 
 @app.get("/health")
@@ -86,4 +117,12 @@ async def health_check():
         "status": "healthy",
         "service": "api-gateway",
         "version": "1.0.0"
-    }
\ No newline at end of file
+    }
+
+
+@app.get("/metrics")
+def metrics(request: Request):
+    """Prometheus metrics endpoint, limited to allowed networks or the scrape token."""
+    if not metrics_access.allows(request):
+        raise HTTPException(status_code=404, detail="Not Found")
+    return Response(content=render_metrics(), media_type=CONTENT_TYPE_LATEST)
\ No newline at end of file
@@ -6,8 +6,14 @@ from fastapi import FastAPI, Request, Response, HTTPException
 import httpx
 from typing import Dict, Any
 import json
+import time
 
+from shared.auth.internal_claims import INTERNAL_CLAIMS_HEADER, internal_claims_handler
+from shared.logging.correlation import get_correlation_id
 from shared.logging.logger import get_logger
+from shared.logging.timing import timed_phase
+from shared.logging.tracing import TRACEPARENT_HEADER, close_client_span, inject_traceparent
+from shared.metrics import upstream_request_duration_seconds, upstream_requests_total
 
 logger = get_logger(__name__)
 
@@ -23,6 +29,9 @@ SERVICE_ENDPOINTS = {
     "ai": "http://ai-service:8007"
 }
 
+# Metric label for each upstream URL
+SERVICE_NAMES = {url: name for name, url in SERVICE_ENDPOINTS.items()}
+
 
 async def proxy_request(
     request: Request,
@@ -40,18 +49,53 @@ async def proxy_request(
     headers.pop("host", None)
     headers.pop("content-length", None)
     
+    # Append the client address; services trust only this rightmost entry
+    if request.client:
+        forwarded_for = headers.get("x-forwarded-for")
+        headers["x-forwarded-for"] = f"{forwarded_for}, {request.client.host}" if forwarded_for else request.client.host
+    
+    # Forward the validated (or gateway-generated) correlation ID, replacing
+    # whatever the client sent
+    correlation_id = get_correlation_id()
+    if correlation_id:
+        headers["x-correlation-id"] = correlation_id
+    
+    # Continue the trace upstream instead of passing the client's traceparent
+    headers.pop(TRACEPARENT_HEADER, None)
+    inject_traceparent(headers)
+    
+    # Forward the user verified by AuthenticationMiddleware as signed claims
+    # so services skip decoding the JWT; drop any client-supplied value
+    headers.pop(INTERNAL_CLAIMS_HEADER.lower(), None)
+    user = getattr(request.state, "user", None)
+    if user and internal_claims_handler.enabled:
+        headers[INTERNAL_CLAIMS_HEADER] = internal_claims_handler.sign(
+            user, getattr(request.state, "token_expires_at", None)
+        )
+    
+    service = SERVICE_NAMES.get(service_url, "unknown")
+    
     try:
         # Read request body
-        body = await request.body()
+        with timed_phase("proxy_body"):
+            body = await request.body()
         
         # Make request to microservice
-        response = await http_client.request(
-            method=request.method,
-            url=target_url,
-            headers=headers,
-            content=body,
-            params=dict(request.query_params)
-        )
+        started = time.perf_counter()
+        with timed_phase("upstream"):
+            upstream = http_client.build_request(
+                method=request.method,
+                url=target_url,
+                headers=headers,
+                content=body,
+                params=dict(request.query_params)
+            )
+            try:
+                response = await http_client.send(upstream)
+            finally:
+                close_client_span(upstream)
+                upstream_request_duration_seconds.observe(time.perf_counter() - started, (service,))
+        upstream_requests_total.inc((service, f"{response.status_code // 100}xx"))
         
         # Create response
         return Response(
@@ -62,6 +106,7 @@ async def proxy_request(
         )
         
     except httpx.TimeoutException:
+        upstream_requests_total.inc((service, "timeout"))
         logger.error(f"Timeout calling service: {target_url}")
         raise HTTPException(
             status_code=504,
@@ -72,6 +117,7 @@ async def proxy_request(
         )
     
     except httpx.ConnectError:
+        upstream_requests_total.inc((service, "connect_error"))
         logger.error(f"Failed to connect to service: {target_url}")
         raise HTTPException(
             status_code=503,
@@ -82,6 +128,7 @@ async def proxy_request(
         )
     
     except Exception as e:
+        upstream_requests_total.inc((service, "error"))
         logger.error(f"Error proxying request to {target_url}: {str(e)}")
         raise HTTPException(
             status_code=502,
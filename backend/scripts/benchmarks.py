@@ -0,0 +1,273 @@
+#!/usr/bin/env python3
+"""
+Microbenchmarks for A-EMS shared backend components.
+"""
+
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+
+# Make shared modules importable when run from the backend directory
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+
+def report(name, count, elapsed, target=None):
+    """Print throughput for a benchmark run."""
+    per_second = count / elapsed if elapsed else float("inf")
+    line = f"{name:<40} {per_second:>14,.0f} ops/s  {elapsed / count * 1e6:>8.2f} us/op"
+    if target:
+        line += "  PASS" if per_second >= target else f"  FAIL (target {target:,}/s)"
+    print(line)
+    return per_second
+
+
+def make_log_records(count):
+    """Build log records shaped like those emitted by AEMSLogger."""
+    records = []
+    for i in range(count):
+        record = logging.LogRecord(
+            name="shared.logging.middleware",
+            level=logging.INFO,
+            pathname=__file__,
+            lineno=42,
+            msg="GET /api/sales/overview - 200 (0.012s)",
+            args=None,
+            exc_info=None,
+            func="dispatch"
+        )
+        record.correlation_id = f"c0ffee00-0000-4000-8000-{i:012d}"
+        record.user_id = "user_456"
+        record.tenant_id = None
+        record.extra_data = {
+            "method": "GET",
+            "path": "/api/sales/overview",
+            "status_code": 200,
+            "duration_ms": 12.3,
+            "type": "api_request"
+        }
+        records.append(record)
+    return records
+
+
+class LegacyJSONFormatter(logging.Formatter):
+    """Dict-and-dumps formatter used before the fast JSONFormatter (reference only)."""
+    
+    def format(self, record):
+        log_entry = {
+            "timestamp": datetime.utcfromtimestamp(record.created).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "module": record.module,
+            "function": record.funcName,
+            "line": record.lineno,
+        }
+        for field in ("correlation_id", "user_id", "tenant_id"):
+            if hasattr(record, field):
+                log_entry[field] = getattr(record, field)
+        log_entry["service"] = os.getenv("SERVICE_NAME", "unknown")
+        log_entry["version"] = os.getenv("SERVICE_VERSION", "dev")
+        if record.exc_info:
+            log_entry["exception"] = self.formatException(record.exc_info)
+        if hasattr(record, "extra_data"):
+            log_entry["extra"] = record.extra_data
+        return json.dumps(log_entry)
+
+
+def bench_formatter(args):
+    """Benchmark JSONFormatter throughput against the legacy formatter."""
+    from shared.logging.logger import JSONFormatter
+    
+    target = args.target or 100_000
+    records = make_log_records(args.count)
+    legacy = LegacyJSONFormatter()
+    fast = JSONFormatter(backend="json")
+    
+    # Output must stay byte-compatible with the legacy schema
+    mismatches = sum(1 for record in records if fast.format(record) != legacy.format(record))
+    print(f"Byte-compatibility: {'OK' if not mismatches else f'{mismatches} mismatches'}")
+    
+    for name, formatter, run_target in [
+        ("legacy JSONFormatter", legacy, None),
+        ("JSONFormatter (json)", fast, target),
+        ("JSONFormatter (orjson)", JSONFormatter(backend="orjson"), target),
+    ]:
+        start = time.perf_counter()
+        for record in records:
+            formatter.format(record)
+        report(name, len(records), time.perf_counter() - start, run_target)
+
+
+def bench_jwt(args):
+    """Benchmark per-request token verification with and without the verified-token cache."""
+    from shared.auth.jwt_handler import JWTHandler
+    
+    target = args.target or 200_000
+    uncached = JWTHandler(cache_enabled=False)
+    cached = JWTHandler(cache_enabled=True)
+    
+    # A realistic working set: many sessions, each sending several requests
+    tokens = [
+        uncached.create_access_token({"sub": f"user_{i}", "email": f"user{i}@example.com",
+                                      "role": "user", "tenant_id": "tenant_1"})
+        for i in range(1000)
+    ]
+    requests = [tokens[i % len(tokens)] for i in range(args.count)]
+    invalid = [token[:-4] + "AAAA" for token in tokens[:100]]
+    
+    for name, handler, run_target in [
+        ("verify_access_token (no cache)", uncached, None),
+        ("verify_access_token (cache)", cached, target),
+    ]:
+        start = time.perf_counter()
+        for token in requests:
+            handler.verify_access_token(token)
+        report(name, len(requests), time.perf_counter() - start, run_target)
+    
+    # Invalid-token flood, served from the negative cache after the first miss
+    logging.getLogger("shared.auth.jwt_handler").setLevel(logging.ERROR)
+    flood = [invalid[i % len(invalid)] for i in range(args.count // 10)]
+    for name, handler in [("invalid token (no cache)", uncached), ("invalid token (cache)", cached)]:
+        start = time.perf_counter()
+        for token in flood:
+            handler.verify_access_token(token)
+        report(name, len(flood), time.perf_counter() - start)
+    
+    print(f"Cache stats: {cached.cache.stats()}")
+    
+    # Asymmetric verification cost per algorithm (local key ring, no cache)
+    from shared.auth.keys import ASYMMETRIC_ALGORITHMS, KeyRing, SigningKey
+    
+    for algorithm in ASYMMETRIC_ALGORITHMS:
+        handler = JWTHandler(cache_enabled=False, algorithm=algorithm,
+                             keys=KeyRing(SigningKey.generate(algorithm)))
+        token = handler.create_access_token({"sub": "user_1", "role": "user", "tenant_id": "tenant_1"})
+        count = args.count // 10
+        start = time.perf_counter()
+        for _ in range(count):
+            handler.verify_access_token(token)
+        report(f"verify_access_token ({algorithm}, no cache)", count, time.perf_counter() - start)
+
+
+def bench_bcrypt(args):
+    """Benchmark bcrypt hashes per second per core at each cost, and the calibrated cost."""
+    from concurrent.futures import ThreadPoolExecutor
+    import bcrypt
+    from shared.auth.password_utils import BCRYPT_TARGET_MS, calibrate_bcrypt_rounds
+    
+    cores = os.cpu_count() or 1
+    password = b"Benchmark-Password-123!"
+    
+    # Spend about a second per cost; each extra round halves throughput
+    for rounds in range(10, 14):
+        salt = bcrypt.gensalt(rounds=rounds)
+        count = max(2, int(2 ** (14 - rounds)))
+        start = time.perf_counter()
+        for _ in range(count):
+            bcrypt.hashpw(password, salt)
+        report(f"hashpw cost {rounds} (1 thread)", count, time.perf_counter() - start)
+        
+        # bcrypt releases the GIL, so a thread per core should scale
+        with ThreadPoolExecutor(max_workers=cores) as executor:
+            start = time.perf_counter()
+            list(executor.map(lambda _: bcrypt.hashpw(password, salt), range(count * cores)))
+            elapsed = time.perf_counter() - start
+        per_second = report(f"hashpw cost {rounds} ({cores} worker threads)", count * cores, elapsed)
+        print(f"{'':<40} {per_second / cores:>14,.1f} hashes/s/core")
+    
+    rounds = calibrate_bcrypt_rounds()
+    print(f"Calibrated cost for a {BCRYPT_TARGET_MS:.0f} ms target: {rounds} (set BCRYPT_ROUNDS={rounds} or auto)")
+
+
+def bench_rbac(args):
+    """Benchmark compiled permission checks against the per-call enum/set lookup they replace."""
+    import asyncio
+    from types import SimpleNamespace
+    from shared.auth.rbac import Permission, Role, rbac_manager, requires
+    
+    target = args.target or 2_000_000
+    roles = [role.value for role in Role]
+    checks = [(roles[i % len(roles)], "sales", "manage") for i in range(args.count)]
+    
+    # Previous implementation: enum construction and map rebuild per call
+    def legacy_check(role, resource, action):
+        permission_map = {"sales": {"view": Permission.VIEW_SALES, "manage": Permission.MANAGE_SALES}}
+        permission = permission_map.get(resource, {}).get(action)
+        try:
+            return permission in rbac_manager.role_permissions.get(Role(role.lower()), set())
+        except ValueError:
+            return False
+    
+    for name, check, run_target in [
+        ("legacy enum/set check", legacy_check, None),
+        ("can_access_resource (bitmask)", rbac_manager.can_access_resource, target),
+    ]:
+        start = time.perf_counter()
+        for role, resource, action in checks:
+            check(role, resource, action)
+        report(name, len(checks), time.perf_counter() - start, run_target)
+    
+    # Tenant role with inherited parents, flattened to one mask when loaded
+    from shared.auth.rbac import PERMISSION_BITS
+    from shared.auth.tenant_roles import TenantRoleStore
+    
+    class StaticRoleLoader:
+        def load(self, tenant_id, db=None):
+            return 1, {"analyst": (["view_sales"], ["viewer"]), "lead": (["manage_sales"], ["analyst"])}
+    
+    store = TenantRoleStore(rbac_manager.role_masks, {p.value: bit for p, bit in PERMISSION_BITS.items()},
+                            StaticRoleLoader())
+    bit = PERMISSION_BITS[Permission.MANAGE_SALES]
+    for name, role in [("role_mask (built-in role)", "manager"), ("role_mask (tenant role, 2 levels)", "lead")]:
+        start = time.perf_counter()
+        for _ in range(args.count):
+            store.role_mask("tenant_1", role, 1) & bit
+        report(name, args.count, time.perf_counter() - start)
+    
+    # Full dependency call on already-verified claims, as FastAPI runs it
+    dependency = requires("sales:view", "reports:view")
+    request = SimpleNamespace(state=SimpleNamespace(user={"id": "1", "role": "manager"}), headers={})
+    
+    async def run(count):
+        for _ in range(count):
+            await dependency(request)
+    
+    count = args.count // 10
+    start = time.perf_counter()
+    asyncio.run(run(count))
+    report("requires() dependency", count, time.perf_counter() - start)
+
+
+BENCHMARKS = {
+    "bcrypt": bench_bcrypt,
+    "formatter": bench_formatter,
+    "jwt": bench_jwt,
+    "rbac": bench_rbac,
+}
+
+
+def main():
+    """Main benchmark entry point."""
+    parser = argparse.ArgumentParser(description="Run A-EMS backend microbenchmarks")
+    parser.add_argument("benchmark", choices=sorted(BENCHMARKS) + ["all"], help="Benchmark to run")
+    parser.add_argument("--count", type=int, default=100_000, help="Operations per run")
+    parser.add_argument("--target", type=int, help="Override the benchmark's target operations per second")
+    
+    args = parser.parse_args()
+    
+    print("A-EMS Backend Microbenchmarks")
+    print("=" * 30)
+    
+    selected = sorted(BENCHMARKS) if args.benchmark == "all" else [args.benchmark]
+    for name in selected:
+        print(f"\n[{name}]")
+        BENCHMARKS[name](args)
+
+
+if __name__ == "__main__":
+    main()
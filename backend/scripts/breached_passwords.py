@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+Build and query the offline breached-password index.
+"""
+
+import argparse
+import getpass
+import gzip
+import sys
+import time
+from pathlib import Path
+
+# Make shared modules importable when run from the backend directory
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from shared.auth.breached_passwords import (
+    BREACHED_PASSWORDS_INDEX_PATH,
+    BreachedPasswordIndex,
+    build_index,
+    password_key,
+    sha1_hex_key
+)
+
+
+def read_keys(dump_path, dump_format, min_count):
+    """Yield index keys from a dump file (optionally gzipped)."""
+    opener = gzip.open if dump_path.endswith(".gz") else open
+    with opener(dump_path, "rt", encoding="utf-8", errors="replace") as dump_file:
+        for line in dump_file:
+            line = line.rstrip("\r\n")
+            if not line:
+                continue
+            if dump_format == "plaintext":
+                yield password_key(line)
+                continue
+            
+            # "SHA1HEX" or HIBP "SHA1HEX:COUNT"
+            sha1_hex, _, count = line.partition(":")
+            if min_count and count and int(count) < min_count:
+                continue
+            yield sha1_hex_key(sha1_hex)
+
+
+def command_build(args):
+    """Build the index from a dump."""
+    started = time.perf_counter()
+    count = build_index(read_keys(args.dump, args.format, args.min_count), args.index)
+    print(
+        f"Indexed {count:,} passwords into {args.index} "
+        f"({Path(args.index).stat().st_size / 1e6:.1f} MB) in {time.perf_counter() - started:.1f} s",
+        file=sys.stderr
+    )
+
+
+def command_check(args):
+    """Check passwords against the index."""
+    index = BreachedPasswordIndex(args.index)
+    try:
+        passwords = args.passwords or [getpass.getpass("Password: ")]
+        for password in passwords:
+            started = time.perf_counter()
+            breached = index.contains(password)
+            elapsed_us = (time.perf_counter() - started) * 1e6
+            print(f"{'BREACHED' if breached else 'not found'} ({elapsed_us:.1f} us)")
+    finally:
+        index.close()
+
+
+def main():
+    """Main entry point."""
+    parser = argparse.ArgumentParser(description="Build and query the breached-password index")
+    parser.add_argument("--index", default=BREACHED_PASSWORDS_INDEX_PATH or "breached_passwords.idx",
+                        help="Index file (default: BREACHED_PASSWORDS_INDEX_PATH)")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    
+    build_parser = subparsers.add_parser("build", help="Build the index from a dump file")
+    build_parser.add_argument("dump", help="Dump file, optionally .gz")
+    build_parser.add_argument("--format", choices=["sha1", "plaintext"], default="sha1",
+                              help="sha1: SHA-1 hex per line, HIBP \"HASH:COUNT\" accepted; plaintext: one password per line")
+    build_parser.add_argument("--min-count", type=int, default=0, help="Skip HIBP entries seen fewer times")
+    build_parser.set_defaults(handler=command_build)
+    
+    check_parser = subparsers.add_parser("check", help="Check passwords (prompts if none given)")
+    check_parser.add_argument("passwords", nargs="*")
+    check_parser.set_defaults(handler=command_check)
+    
+    args = parser.parse_args()
+    args.handler(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""
+Index and search A-EMS JSON log files by correlation ID, user, tenant or time.
+"""
+
+import argparse
+import json
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+
+# Make shared modules importable when run from the backend directory
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from shared.logging.handlers import LOG_FILE_PATH
+from shared.logging.indexer import LOG_INDEX_DIR, LogIndex
+
+
+def print_entries(entries, started):
+    """Print matching log entries as JSON lines followed by a summary."""
+    for entry in entries:
+        print(json.dumps(entry))
+    print(f"{len(entries)} entries in {(time.perf_counter() - started) * 1000:.1f} ms", file=sys.stderr)
+
+
+def command_index(index, args):
+    """Index new log data, optionally repeating as logs are appended."""
+    while True:
+        started = time.perf_counter()
+        stats = index.update()
+        print(
+            f"Indexed {stats['lines']} lines ({stats['postings']} postings, {stats['runs']} runs) "
+            f"in {(time.perf_counter() - started) * 1000:.1f} ms",
+            file=sys.stderr
+        )
+        if not args.watch:
+            return
+        time.sleep(args.watch)
+
+
+def command_lookup(index, args):
+    """Find entries by an indexed field."""
+    if not args.no_update:
+        index.update()
+    started = time.perf_counter()
+    print_entries(index.lookup(args.field, args.value, args.limit), started)
+
+
+def command_range(index, args):
+    """Find entries in a time range."""
+    if not args.no_update:
+        index.update()
+    started = time.perf_counter()
+    since = datetime.fromisoformat(args.since)
+    until = datetime.fromisoformat(args.until) if args.until else datetime.utcnow()
+    print_entries(index.time_range(since, until, args.limit), started)
+
+
+def main():
+    """Main entry point."""
+    parser = argparse.ArgumentParser(description="Index and search A-EMS JSON logs")
+    parser.add_argument("--log-file", default=LOG_FILE_PATH, help="Active log file (rotated segments are found next to it)")
+    parser.add_argument("--index-dir", default=LOG_INDEX_DIR, help="Directory holding the index")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    
+    index_parser = subparsers.add_parser("index", help="Index newly appended log data")
+    index_parser.add_argument("--watch", type=float, help="Keep indexing every N seconds")
+    index_parser.set_defaults(handler=command_index)
+    
+    for field in ("correlation-id", "user-id", "tenant-id"):
+        lookup_parser = subparsers.add_parser(field, help=f"Find entries by {field.replace('-', ' ')}")
+        lookup_parser.add_argument("value")
+        lookup_parser.set_defaults(handler=command_lookup, field=field.replace("-", "_"))
+    
+    range_parser = subparsers.add_parser("range", help="Find entries by UTC time range")
+    range_parser.add_argument("since", help="Start time, e.g. 2024-01-31T12:00")
+    range_parser.add_argument("until", nargs="?", help="End time (default: now)")
+    range_parser.set_defaults(handler=command_range)
+    
+    for subparser in subparsers.choices.values():
+        if subparser is not index_parser:
+            subparser.add_argument("--limit", type=int, default=1000, help="Maximum entries to return")
+            subparser.add_argument("--no-update", action="store_true", help="Skip indexing new data first")
+    
+    args = parser.parse_args()
+    
+    index = LogIndex(args.log_file, args.index_dir)
+    try:
+        args.handler(index, args)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        index.close()
+
+
+if __name__ == "__main__":
+    main()
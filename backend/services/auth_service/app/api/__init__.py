@@ -2,33 +2,59 @@
 Authentication API endpoints.
 """
 
-from fastapi import APIRouter, Depends, HTTPException, status
+from datetime import datetime
+from typing import Optional
+from fastapi import APIRouter, Depends, HTTPException, Request, status
+from fastapi.security import HTTPAuthorizationCredentials
 from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
 import sys
 sys.path.append('../../../')
 
+from shared.auth.jwt_handler import jwt_handler
+from shared.auth.login_guard import client_ip, login_guard
+from shared.auth.rbac import tenant_roles
+from shared.auth.session_store import is_session_id, session_store
 from shared.database.base import get_database
+from shared.exceptions import ServiceOverloadedError
+from shared.logging.indexer import LogIndex
 from shared.schemas import (
     LoginRequestSchema,
     TokenResponseSchema,
     UserCreateSchema,
     UserResponseSchema,
     PasswordChangeSchema,
-    MFAVerificationSchema
+    MFAVerificationSchema,
+    TenantRoleSchema
 )
 from ..services.auth_service import AuthService
-from ..core.dependencies import get_current_user
+from ..core.dependencies import get_current_user, require_admin_role, security
 
 auth_router = APIRouter()
 
+# Log index over this service's log files (opened on first search)
+_log_index: Optional[LogIndex] = None
+
 
 @auth_router.post("/login", response_model=TokenResponseSchema)
 async def login(
     request: LoginRequestSchema,
+    http_request: Request,
     db: Session = Depends(get_database)
 ):
     """User login endpoint."""
     auth_service = AuthService(db)
+    ip = client_ip(http_request)
+    
+    # Refuse locked-out accounts, IPs and subnets before any password check
+    if login_guard is not None:
+        block = login_guard.check(request.email, ip)
+        if block is not None:
+            raise HTTPException(
+                status_code=status.HTTP_423_LOCKED if block.scope == "account" else status.HTTP_429_TOO_MANY_REQUESTS,
+                detail={"error": "Too many failed login attempts", "message": "Try again later"},
+                headers={"Retry-After": str(block.retry_after)}
+            )
     
     try:
         tokens = await auth_service.login(
@@ -36,8 +62,15 @@ async def login(
             password=request.password,
             remember_me=request.remember_me
         )
+        if login_guard is not None:
+            login_guard.record_success(request.email)
         return tokens
+    except ServiceOverloadedError:
+        # Password hashing pool is full; answered with 503
+        raise
     except Exception as e:
+        if login_guard is not None:
+            login_guard.record_failure(request.email, ip)
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail={"error": "Authentication failed", "message": str(e)}
@@ -55,6 +88,9 @@ async def register(
     try:
         user = await auth_service.register(request)
         return user
+    except ServiceOverloadedError:
+        # Password hashing pool is full; answered with 503
+        raise
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -70,6 +106,15 @@ async def refresh_token(
     """Refresh access token."""
     auth_service = AuthService(db)
     
+    # A revoked or expired session cannot mint new tokens
+    payload = jwt_handler.verify_refresh_token(refresh_token)
+    session_id = payload.get("sid") if payload else None
+    if is_session_id(session_id) and await session_store.validate_async(session_id) is None:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail={"error": "Token refresh failed", "message": "Session has expired or was revoked"}
+        )
+    
     try:
         tokens = await auth_service.refresh_token(refresh_token)
         return tokens
@@ -83,12 +128,19 @@ async def refresh_token(
 @auth_router.post("/logout")
 async def logout(
     current_user: dict = Depends(get_current_user),
+    credentials: Optional[HTTPAuthorizationCredentials] = Depends(security),
     db: Session = Depends(get_database)
 ):
     """User logout endpoint."""
     auth_service = AuthService(db)
     
     try:
+        # Reject this session's tokens everywhere from now on
+        # Both commit to the database (db feed, sessions): keep them off the event loop
+        if credentials is not None:
+            await run_in_threadpool(jwt_handler.revoke_token, credentials.credentials)
+        if is_session_id(current_user.get("session_id")):
+            await run_in_threadpool(session_store.revoke, current_user["session_id"])
         await auth_service.logout(current_user["id"])
         return {"message": "Logged out successfully"}
     except Exception as e:
@@ -132,6 +184,8 @@ async def change_password(
             new_password=request.new_password
         )
         return {"message": "Password changed successfully"}
+    except ServiceOverloadedError:
+        raise
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -139,6 +193,24 @@ async def change_password(
         )
 
 
+@auth_router.get("/sessions")
+def list_sessions(current_user: dict = Depends(get_current_user)):
+    """List the current user's active sessions (served from the session cache)."""
+    sessions = session_store.list_user_sessions(current_user["id"])
+    return {"sessions": [session.to_dict() for session in sessions]}
+
+
+@auth_router.delete("/sessions/{session_id}")
+def revoke_session(session_id: str, current_user: dict = Depends(get_current_user)):
+    """End one of the current user's sessions; its tokens stop working everywhere."""
+    if not session_store.revoke_session(current_user["id"], session_id):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail={"error": "Session not found", "message": "No active session with that ID"}
+        )
+    return {"message": "Session revoked"}
+
+
 @auth_router.post("/mfa/verify", response_model=TokenResponseSchema)
 async def verify_mfa(
     request: MFAVerificationSchema,
@@ -175,4 +247,92 @@ async def setup_mfa(
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail={"error": "MFA setup failed", "message": str(e)}
-        )
\ No newline at end of file
+        )
+
+
+@auth_router.get("/admin/logs/search")
+def search_logs(
+    correlation_id: Optional[str] = None,
+    user_id: Optional[str] = None,
+    tenant_id: Optional[str] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    limit: int = 200,
+    current_user: dict = Depends(require_admin_role)
+):
+    """Search indexed service logs of the caller's tenant (admin only)."""
+    global _log_index
+    
+    # Tenant admins only ever see their own tenant's entries
+    own_tenant = str(current_user.get("tenant_id") or "")
+    if not own_tenant or (tenant_id and tenant_id != own_tenant):
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail={"error": "Insufficient permissions", "message": "Logs of other tenants are not accessible"}
+        )
+    
+    if _log_index is None:
+        # New lines are indexed in the background, never on the request path
+        _log_index = LogIndex()
+        _log_index.start_updates()
+    
+    limit = max(1, min(limit, 1000))
+    if correlation_id:
+        entries = _log_index.lookup("correlation_id", correlation_id, limit, tenant_id=own_tenant)
+    elif user_id:
+        entries = _log_index.lookup("user_id", user_id, limit, tenant_id=own_tenant)
+    elif since:
+        entries = _log_index.time_range(since, until or datetime.utcnow(), limit, tenant_id=own_tenant)
+    elif tenant_id:
+        entries = _log_index.lookup("tenant_id", own_tenant, limit)
+    else:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail={"error": "Missing filter", "message": "Provide correlation_id, user_id, tenant_id or since"}
+        )
+    
+    return {"entries": entries, "count": len(entries)}
+
+
+@auth_router.get("/admin/roles")
+def list_tenant_roles(
+    current_user: dict = Depends(require_admin_role),
+    db: Session = Depends(get_database)
+):
+    """List the caller's tenant's custom roles (admin only)."""
+    return {"roles": tenant_roles.list_roles(current_user["tenant_id"], db)}
+
+
+@auth_router.put("/admin/roles/{name}")
+def save_tenant_role(
+    name: str,
+    role: TenantRoleSchema,
+    current_user: dict = Depends(require_admin_role),
+    db: Session = Depends(get_database)
+):
+    """Create or replace a custom role in the caller's tenant (admin only)."""
+    try:
+        version = tenant_roles.save_role(db, current_user["tenant_id"], name, role.permissions, role.inherits)
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail={"error": "Invalid role", "message": str(e)}
+        )
+    return {"name": name.strip().lower(), "roles_version": version}
+
+
+@auth_router.delete("/admin/roles/{name}")
+def delete_tenant_role(
+    name: str,
+    current_user: dict = Depends(require_admin_role),
+    db: Session = Depends(get_database)
+):
+    """Delete a custom role from the caller's tenant (admin only)."""
+    try:
+        version = tenant_roles.delete_role(db, current_user["tenant_id"], name)
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail={"error": "Invalid role", "message": str(e)}
+        )
+    return {"name": name.strip().lower(), "roles_version": version}
\ No newline at end of file
@@ -24,7 +24,7 @@ class Settings(BaseSettings):
     
     # JWT settings
     jwt_secret_key: str = os.getenv("JWT_SECRET_KEY", "your-secret-key-change-in-production")
-    jwt_algorithm: str = "HS256"
+    jwt_algorithm: str = os.getenv("JWT_ALGORITHM", "HS256")
     access_token_expire_minutes: int = 30
     refresh_token_expire_days: int = 7
     
@@ -2,25 +2,42 @@
 FastAPI dependencies for authentication service.
 """
 
-from fastapi import Depends, HTTPException, status
+from fastapi import Depends, HTTPException, Request, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from typing import Optional
 import sys
 sys.path.append('../../../../')
 
+from shared.auth.internal_claims import INTERNAL_CLAIMS_HEADER, internal_claims_handler
 from shared.auth.jwt_handler import jwt_handler
-from shared.database.base import get_database
-from sqlalchemy.orm import Session
 
 # Initialize security scheme
-security = HTTPBearer()
+security = HTTPBearer(auto_error=False)
 
 
 async def get_current_user(
-    credentials: HTTPAuthorizationCredentials = Depends(security),
-    db: Session = Depends(get_database)
+    request: Request,
+    credentials: Optional[HTTPAuthorizationCredentials] = Depends(security)
 ) -> dict:
     """Get current authenticated user from token."""
     
+    # Already authenticated by middleware
+    user = getattr(request.state, "user", None)
+    if user:
+        return user
+    
+    # Claims signed by the API gateway
+    user = internal_claims_handler.verify(request.headers.get(INTERNAL_CLAIMS_HEADER))
+    if user:
+        return user
+    
+    if credentials is None:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail={"error": "Not authenticated", "message": "Valid authorization token required"},
+            headers={"WWW-Authenticate": "Bearer"}
+        )
+    
     # Verify token
     payload = jwt_handler.verify_access_token(credentials.credentials)
     
@@ -44,7 +61,9 @@ async def get_current_user(
         "id": user_id,
         "email": payload.get("email"),
         "role": payload.get("role"),
-        "tenant_id": payload.get("tenant_id")
+        "tenant_id": payload.get("tenant_id"),
+        "roles_version": payload.get("roles_version"),
+        "session_id": payload.get("sid")
     }
 
 
@@ -2,15 +2,24 @@
 Authentication service main application.
 """
 
-from fastapi import FastAPI
+from fastapi import FastAPI, Query, Response
+from fastapi.responses import JSONResponse
 from contextlib import asynccontextmanager
 import sys
 import os
 
 # Add parent directory to path for shared imports
 sys.path.append('../../')
+from shared.auth.jwt_handler import jwt_handler
+from shared.auth.keys import JWT_JWKS_MIN_REFETCH_SECONDS
+from shared.auth.password_utils import check_backup_code_key
+from shared.auth.revocation import REVOCATION_FEED_BATCH_SIZE, check_revocation_feed, token_revocations
 from shared.logging.logger import get_logger
 from shared.logging.middleware import LoggingMiddleware
+from shared.logging.events import shutdown_event_aggregation
+from shared.logging.pipeline import shutdown_logging
+from shared.logging.tracing import shutdown_tracing
+from shared.metrics import CONTENT_TYPE_LATEST, registry, render_metrics
 from shared.middleware import add_middleware
 from shared.database.base import DatabaseBase
 from .api import auth_router
@@ -24,6 +33,15 @@ async def lifespan(app: FastAPI):
     """Application lifespan management."""
     logger.info("Auth Service starting up")
     
+    # Backup-code lookup tags are keyed; never run with a guessable key
+    check_backup_code_key()
+    
+    # Logouts must reach every worker and service
+    check_revocation_feed(issuer=True)
+    
+    # Drop metric snapshots left by workers that exited without cleaning up
+    registry.remove_dead_snapshots()
+    
     # Initialize database
     db_manager = DatabaseBase()
     try:
@@ -36,6 +54,11 @@ async def lifespan(app: FastAPI):
     yield
     
     logger.info("Auth Service shutting down")
+    
+    # Flush event rollups, then drain queued spans and log records
+    shutdown_event_aggregation()
+    shutdown_tracing()
+    shutdown_logging()
 
 
 def create_app() -> FastAPI:
@@ -56,7 +79,21 @@ def create_app() -> FastAPI:
     
     # Add shared middleware
     add_middleware(app, {
-        "excluded_paths": ["/health", "/docs", "/redoc", "/openapi.json"]
+        "excluded_paths": [
+            "/health",
+            "/metrics",
+            "/docs",
+            "/redoc",
+            "/openapi.json",
+            "/.well-known/jwks.json",
+            "/internal/revocations",
+            "/api/auth/login",
+            "/api/auth/register",
+            "/api/auth/refresh",
+            "/api/auth/mfa/verify"
+        ],
+        # Sessions live in this service's database
+        "validate_sessions": True
     })
     
     # Include API routes
@@ -76,4 +113,28 @@ async def health_check():
         "status": "healthy",
         "service": "auth-service",
         "version": "1.0.0"
-    }
\ No newline at end of file
+    }
+
+
+@app.get("/.well-known/jwks.json")
+def jwks():
+    """Public keys for verifying access tokens."""
+    return JSONResponse(
+        content=jwt_handler.jwks(),
+        headers={"Cache-Control": f"public, max-age={JWT_JWKS_MIN_REFETCH_SECONDS}"}
+    )
+
+
+@app.get("/internal/revocations")
+def revocations(
+    since: int = 0,
+    limit: int = Query(REVOCATION_FEED_BATCH_SIZE, ge=1, le=REVOCATION_FEED_BATCH_SIZE)
+):
+    """Revoked token and session IDs after a feed sequence number."""
+    return {"entries": token_revocations.changes_since(since, limit)}
+
+
+@app.get("/metrics")
+def metrics():
+    """Prometheus metrics endpoint."""
+    return Response(content=render_metrics(), media_type=CONTENT_TYPE_LATEST)
\ No newline at end of file
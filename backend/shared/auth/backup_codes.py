@@ -0,0 +1,107 @@
+"""
+Storage and verification of MFA backup codes.
+"""
+
+import json
+import logging
+from typing import List
+
+from sqlalchemy.orm import Session
+
+from ..database.models import MFABackupCode, User
+from .password_utils import TOTPUtils, password_hash_pool
+
+logger = logging.getLogger(__name__)
+
+
+async def replace_backup_codes(db: Session, user_id, codes: List[str]) -> None:
+    """Store a new set of backup codes, invalidating any previous ones."""
+    records = await password_hash_pool.run("hash", TOTPUtils.hash_backup_codes, str(user_id), codes)
+    
+    db.query(MFABackupCode).filter(MFABackupCode.user_id == user_id).delete(synchronize_session=False)
+    db.query(User).filter(User.id == user_id).update({User.mfa_backup_codes: None}, synchronize_session=False)
+    db.add_all(
+        MFABackupCode(user_id=user_id, lookup_tag=lookup_tag, code_hash=code_hash)
+        for lookup_tag, code_hash in records
+    )
+    db.commit()
+
+
+async def consume_backup_code(db: Session, user_id, code: str) -> bool:
+    """Verify a backup code and delete it so it cannot be used again.
+    
+    The lookup tag finds the single candidate record through its unique
+    index; only that record's hash is checked. The delete is conditional
+    on the row still existing, so two concurrent uses of the same code
+    cannot both succeed.
+    """
+    lookup_tag = TOTPUtils.backup_code_tag(str(user_id), code)
+    record = db.query(MFABackupCode).filter(MFABackupCode.lookup_tag == lookup_tag).first()
+    if record is None or str(record.user_id) != str(user_id):
+        return await _consume_legacy_backup_code(db, user_id, code)
+    
+    verified = await password_hash_pool.run("verify", TOTPUtils.verify_backup_code, code, record.code_hash)
+    if not verified:
+        return False
+    
+    deleted = (
+        db.query(MFABackupCode)
+        .filter(MFABackupCode.id == record.id)
+        .delete(synchronize_session=False)
+    )
+    db.commit()
+    if deleted != 1:
+        logger.warning("Backup code was consumed concurrently")
+        return False
+    return True
+
+
+async def _consume_legacy_backup_code(db: Session, user_id, code: str) -> bool:
+    """Verify a code against the pre-lookup-tag list on the user row.
+    
+    Codes issued before lookup tags existed stay usable once each: the
+    matching hash is removed from the list with an update conditional on
+    the list being unchanged, and the column is cleared when it empties.
+    Regenerating codes replaces the list with tagged records.
+    """
+    stored = db.query(User.mfa_backup_codes).filter(User.id == user_id).scalar()
+    if not stored:
+        return False
+    try:
+        code_hashes = json.loads(stored)
+    except ValueError:
+        logger.error(f"Unreadable legacy backup codes for user {user_id}")
+        return False
+    
+    index = await password_hash_pool.run("verify", TOTPUtils.match_legacy_backup_code, code, code_hashes)
+    if index is None:
+        return False
+    
+    remaining = code_hashes[:index] + code_hashes[index + 1:]
+    updated = (
+        db.query(User)
+        .filter(User.id == user_id, User.mfa_backup_codes == stored)
+        .update({User.mfa_backup_codes: json.dumps(remaining) if remaining else None},
+                synchronize_session=False)
+    )
+    db.commit()
+    if updated != 1:
+        logger.warning("Legacy backup code was consumed concurrently")
+        return False
+    logger.info(f"Legacy backup code used by user {user_id}; {len(remaining)} legacy codes left")
+    return True
+
+
+def _legacy_backup_code_count(db: Session, user_id) -> int:
+    """Number of unused pre-lookup-tag codes on the user row."""
+    stored = db.query(User.mfa_backup_codes).filter(User.id == user_id).scalar()
+    try:
+        return len(json.loads(stored)) if stored else 0
+    except ValueError:
+        return 0
+
+
+def remaining_backup_codes(db: Session, user_id) -> int:
+    """Number of unused backup codes for a user."""
+    tagged = db.query(MFABackupCode).filter(MFABackupCode.user_id == user_id).count()
+    return tagged + _legacy_backup_code_count(db, user_id)
@@ -0,0 +1,199 @@
+"""
+Offline breached-password lookup over a memory-mapped sorted hash index.
+"""
+
+import hashlib
+import heapq
+import math
+import mmap
+import os
+import struct
+import sys
+import tempfile
+import threading
+from array import array
+from typing import BinaryIO, Iterable, Iterator, List, Optional
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Breached-password index configuration
+BREACHED_PASSWORDS_INDEX_PATH = os.getenv("BREACHED_PASSWORDS_INDEX_PATH", "")
+
+# File layout: header, then sorted big-endian 64-bit SHA-1 prefixes
+INDEX_MAGIC = b"AEMSBPW1"
+HEADER = struct.Struct(">8sQ")  # magic, record count
+RECORD_SIZE = 8
+
+# Entries sorted in memory per temporary run while building
+BUILD_CHUNK_ENTRIES = 2_000_000
+
+
+def password_key(password: str) -> int:
+    """64-bit SHA-1 prefix of a password, the value stored in the index."""
+    return int.from_bytes(hashlib.sha1(password.encode("utf-8")).digest()[:RECORD_SIZE], "big")
+
+
+def sha1_hex_key(sha1_hex: str) -> int:
+    """64-bit prefix of a hex SHA-1 digest (e.g. a line of a HIBP dump)."""
+    return int(sha1_hex[:RECORD_SIZE * 2], 16)
+
+
+class BreachedPasswordIndex:
+    """Read-only membership test against a sorted index of SHA-1 prefixes.
+    
+    The file is memory-mapped, so pages are loaded on demand and shared
+    between workers; resident memory stays near zero. SHA-1 prefixes are
+    uniformly distributed, so each lookup starts from an interpolated
+    position and binary-searches a window of a few sqrt(n) records. A
+    64-bit prefix keeps false positives negligible (about n / 2**64).
+    """
+    
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path, "rb")
+        try:
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            self._file.close()
+            raise ValueError(f"Empty breached-password index: {path}")
+        
+        magic, self.count = HEADER.unpack_from(self._map, 0)
+        if magic != INDEX_MAGIC or HEADER.size + self.count * RECORD_SIZE > len(self._map):
+            self.close()
+            raise ValueError(f"Not a breached-password index: {path}")
+        self._window = 4 * math.isqrt(self.count) + 16
+    
+    def _key_at(self, position: int) -> int:
+        offset = HEADER.size + position * RECORD_SIZE
+        return int.from_bytes(self._map[offset:offset + RECORD_SIZE], "big")
+    
+    def contains_key(self, key: int) -> bool:
+        """Whether a 64-bit SHA-1 prefix is in the index."""
+        count = self.count
+        if not count:
+            return False
+        
+        # Interpolate, then fall back to the full range if the window misses
+        guess = (key * count) >> 64
+        low = max(0, guess - self._window)
+        high = min(count, guess + self._window)
+        if low > 0 and self._key_at(low) > key:
+            low = 0
+        if high < count and self._key_at(high - 1) < key:
+            high = count
+        
+        while low < high:
+            middle = (low + high) // 2
+            if self._key_at(middle) < key:
+                low = middle + 1
+            else:
+                high = middle
+        return low < count and self._key_at(low) == key
+    
+    def contains(self, password: str) -> bool:
+        """Whether a password appears in the breach corpus."""
+        return self.contains_key(password_key(password))
+    
+    def close(self) -> None:
+        """Unmap and close the index file."""
+        self._map.close()
+        self._file.close()
+
+
+def _write_run(keys: array, directory: str) -> str:
+    """Sort keys and write them as a temporary big-endian run file."""
+    keys = array("Q", sorted(keys))
+    if sys.byteorder == "little":
+        keys.byteswap()
+    handle, path = tempfile.mkstemp(suffix=".run", dir=directory)
+    with os.fdopen(handle, "wb") as run_file:
+        keys.tofile(run_file)
+    return path
+
+
+def _read_run(run_file: BinaryIO) -> Iterator[int]:
+    """Stream keys back from a run file."""
+    while True:
+        block = run_file.read(RECORD_SIZE * 65536)
+        if not block:
+            return
+        for (key,) in struct.iter_unpack(">Q", block):
+            yield key
+
+
+def build_index(keys: Iterable[int], output_path: str,
+                chunk_entries: int = BUILD_CHUNK_ENTRIES) -> int:
+    """Write a deduplicated, sorted index from unsorted keys; returns the record count.
+    
+    Keys are sorted in bounded chunks spilled to temporary runs and
+    merged, so dumps far larger than memory can be indexed.
+    """
+    directory = os.path.dirname(os.path.abspath(output_path))
+    runs: List[str] = []
+    chunk = array("Q")
+    try:
+        for key in keys:
+            chunk.append(key)
+            if len(chunk) >= chunk_entries:
+                runs.append(_write_run(chunk, directory))
+                chunk = array("Q")
+        if chunk or not runs:
+            runs.append(_write_run(chunk, directory))
+        
+        run_files = [open(path, "rb") for path in runs]
+        temporary_path = output_path + ".tmp"
+        count = 0
+        try:
+            with open(temporary_path, "wb") as index_file:
+                index_file.write(HEADER.pack(INDEX_MAGIC, 0))
+                pack = struct.Struct(">Q").pack
+                previous = None
+                buffer = []
+                for key in heapq.merge(*(_read_run(run_file) for run_file in run_files)):
+                    if key == previous:
+                        continue
+                    previous = key
+                    buffer.append(pack(key))
+                    count += 1
+                    if len(buffer) >= 65536:
+                        index_file.write(b"".join(buffer))
+                        buffer = []
+                index_file.write(b"".join(buffer))
+                index_file.seek(0)
+                index_file.write(HEADER.pack(INDEX_MAGIC, count))
+        finally:
+            for run_file in run_files:
+                run_file.close()
+        
+        # Readers never see a partially written index
+        os.replace(temporary_path, output_path)
+        return count
+    finally:
+        for path in runs:
+            os.unlink(path)
+
+
+_index: Optional[BreachedPasswordIndex] = None
+_index_lock = threading.Lock()
+_index_unavailable = False
+
+
+def get_breached_password_index() -> Optional[BreachedPasswordIndex]:
+    """Shared index opened on first use, or None when not configured or unreadable."""
+    global _index, _index_unavailable
+    if _index is None and not _index_unavailable and BREACHED_PASSWORDS_INDEX_PATH:
+        with _index_lock:
+            if _index is None and not _index_unavailable:
+                try:
+                    _index = BreachedPasswordIndex(BREACHED_PASSWORDS_INDEX_PATH)
+                except (OSError, ValueError) as e:
+                    _index_unavailable = True
+                    logger.error(f"Breached-password check disabled: {e}")
+    return _index
+
+
+def is_breached_password(password: str) -> bool:
+    """Whether a password is in the configured breach corpus (False if none is configured)."""
+    index = get_breached_password_index()
+    return index is not None and index.contains(password)
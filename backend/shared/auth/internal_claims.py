@@ -0,0 +1,115 @@
+"""
+Internally signed user claims forwarded from the API gateway to services.
+"""
+
+import base64
+import hashlib
+import hmac
+import json
+import os
+import time
+from typing import Any, Dict, Optional
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Internal claims configuration
+INTERNAL_CLAIMS_SECRET = os.getenv("INTERNAL_CLAIMS_SECRET", "")  # unset disables internal claims
+INTERNAL_CLAIMS_HEADER = "X-Internal-Claims"
+INTERNAL_CLAIMS_TTL_SECONDS = int(os.getenv("INTERNAL_CLAIMS_TTL_SECONDS", "60"))
+
+_VERSION = "v1"
+
+
+def _b64encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode("ascii")
+
+
+def _b64decode(data: str) -> bytes:
+    return base64.urlsafe_b64decode(data + "=" * (-len(data) % 4))
+
+
+class InternalClaimsHandler:
+    """Sign and verify compact user claims for service-to-service hops.
+    
+    The gateway verifies the user's JWT once and forwards
+    "v1.<claims>.<hmac>" in X-Internal-Claims; services check a single
+    HMAC instead of decoding the JWT again. Claims expire with the token,
+    and no later than INTERNAL_CLAIMS_TTL_SECONDS after signing, which
+    bounds replay of a captured header.
+    
+    Without a secret the handler is disabled: nothing is signed and no
+    header is trusted, so services fall back to verifying the JWT.
+    """
+    
+    def __init__(self, secret_key: str = INTERNAL_CLAIMS_SECRET,
+                 ttl_seconds: int = INTERNAL_CLAIMS_TTL_SECONDS):
+        self.secret_key = secret_key.encode("utf-8")
+        self.ttl_seconds = ttl_seconds
+        self.enabled = bool(secret_key)
+        if not self.enabled:
+            logger.warning("INTERNAL_CLAIMS_SECRET is not set; internal claims are disabled")
+    
+    def _signature(self, payload: str) -> str:
+        digest = hmac.new(self.secret_key, f"{_VERSION}.{payload}".encode("ascii"), hashlib.sha256).digest()
+        return _b64encode(digest)
+    
+    def sign(self, user: Dict[str, Any], expires_at: Optional[float] = None) -> Optional[str]:
+        """Sign user claims ({"id", "email", "role", "tenant_id", "roles_version", "session_id"}) into a header value."""
+        if not self.enabled:
+            return None
+        exp = int(time.time()) + self.ttl_seconds
+        if expires_at is not None:
+            exp = min(exp, int(expires_at))
+        
+        claims = {
+            "sub": user.get("id"),
+            "email": user.get("email"),
+            "role": user.get("role"),
+            "tid": user.get("tenant_id"),
+            "rv": user.get("roles_version"),
+            "sid": user.get("session_id"),
+            "exp": exp
+        }
+        payload = _b64encode(json.dumps(claims, separators=(",", ":")).encode("utf-8"))
+        return f"{_VERSION}.{payload}.{self._signature(payload)}"
+    
+    def verify(self, value: Optional[str]) -> Optional[Dict[str, Any]]:
+        """Verify a header value and return the user dict, or None."""
+        if not value or not self.enabled:
+            return None
+        
+        try:
+            version, payload, signature = value.split(".")
+        except ValueError:
+            return None
+        
+        try:
+            valid = version == _VERSION and hmac.compare_digest(signature, self._signature(payload))
+        except (TypeError, UnicodeEncodeError):
+            # Non-ASCII header value: compare_digest and the ASCII encode refuse it
+            valid = False
+        if not valid:
+            logger.warning("Invalid internal claims signature")
+            return None
+        
+        try:
+            claims = json.loads(_b64decode(payload))
+        except ValueError:
+            return None
+        
+        if claims.get("exp", 0) <= time.time() or not claims.get("sub"):
+            return None
+        
+        return {
+            "id": claims["sub"],
+            "email": claims.get("email"),
+            "role": claims.get("role"),
+            "tenant_id": claims.get("tid"),
+            "roles_version": claims.get("rv"),
+            "session_id": claims.get("sid")
+        }
+
+
+# Global internal claims handler instance
+internal_claims_handler = InternalClaimsHandler()
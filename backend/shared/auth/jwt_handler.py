@@ -3,37 +3,182 @@ JWT token handling utilities for A-EMS authentication.
 """
 
 import jwt
+import hashlib
 import os
+import secrets
+import threading
+import time
+from collections import OrderedDict
 from datetime import datetime, timedelta
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, List
 import logging
 
+from .keys import ASYMMETRIC_ALGORITHMS, KeyRing, SigningKey, create_key_ring
+from .revocation import TokenRevocationList, token_revocations
+
 logger = logging.getLogger(__name__)
 
 # JWT Configuration
 JWT_SECRET_KEY = os.getenv("JWT_SECRET_KEY", "your-secret-key-change-in-production")
-JWT_ALGORITHM = "HS256"
+JWT_ALGORITHM = os.getenv("JWT_ALGORITHM", "HS256")  # "HS256", "EdDSA", "ES256" or "RS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 REFRESH_TOKEN_EXPIRE_DAYS = 7
 
+# Verified-token cache (opt-in)
+JWT_VERIFY_CACHE_ENABLED = os.getenv("JWT_VERIFY_CACHE", "false").lower() == "true"
+JWT_VERIFY_CACHE_SIZE = int(os.getenv("JWT_VERIFY_CACHE_SIZE", "10000"))
+JWT_NEGATIVE_CACHE_SECONDS = float(os.getenv("JWT_NEGATIVE_CACHE_SECONDS", "5"))
+JWT_NEGATIVE_CACHE_SIZE = int(os.getenv("JWT_NEGATIVE_CACHE_SIZE", "1024"))
+
+# Cache marker for tokens that recently failed verification
+INVALID_TOKEN = object()
+
+# Decode result for a kid not (yet) in the key ring; never negative-cached
+UNKNOWN_KEY = object()
+
+
+def token_digest(token: str) -> bytes:
+    """Digest used to key tokens without keeping them in memory."""
+    return hashlib.blake2b(token.encode("utf-8"), digest_size=16).digest()
+
+
+class VerifiedTokenCache:
+    """Bounded LRU of decoded claims, each kept until its token's own expiry.
+    
+    Failed verifications are remembered for a few seconds in a separate,
+    smaller LRU so floods of invalid tokens skip signature checks without
+    evicting valid sessions.
+    """
+    
+    def __init__(self, max_size: int = JWT_VERIFY_CACHE_SIZE,
+                 negative_ttl: float = JWT_NEGATIVE_CACHE_SECONDS,
+                 negative_max_size: int = JWT_NEGATIVE_CACHE_SIZE):
+        self.max_size = max_size
+        self.negative_ttl = negative_ttl
+        self.negative_max_size = negative_max_size
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[bytes, tuple]" = OrderedDict()
+        self._negative: "OrderedDict[bytes, float]" = OrderedDict()
+        
+        # Counters (diagnostic only)
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+    
+    def get(self, digest: bytes):
+        """Get cached claims, INVALID_TOKEN, or None on a miss."""
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(digest)
+            if entry is not None:
+                claims, expires_at = entry
+                if now < expires_at:
+                    self._entries.move_to_end(digest)
+                    self.hits += 1
+                    return dict(claims)
+                del self._entries[digest]
+            
+            if self._negative:
+                expires_at = self._negative.get(digest)
+                if expires_at is not None:
+                    if now < expires_at:
+                        self.negative_hits += 1
+                        return INVALID_TOKEN
+                    del self._negative[digest]
+            
+            self.misses += 1
+            return None
+    
+    def put(self, digest: bytes, claims: Dict[str, Any]) -> None:
+        """Cache claims until the token's exp claim."""
+        expires_at = claims.get("exp")
+        if not isinstance(expires_at, (int, float)):
+            return
+        with self._lock:
+            self._entries[digest] = (dict(claims), expires_at)
+            self._entries.move_to_end(digest)
+            if len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+    
+    def put_negative(self, digest: bytes) -> None:
+        """Remember a failed verification briefly."""
+        if self.negative_ttl <= 0:
+            return
+        with self._lock:
+            self._negative[digest] = time.time() + self.negative_ttl
+            self._negative.move_to_end(digest)
+            if len(self._negative) > self.negative_max_size:
+                self._negative.popitem(last=False)
+    
+    def discard(self, digest: bytes) -> None:
+        """Drop a token's cached claims (e.g. when it is revoked)."""
+        with self._lock:
+            self._entries.pop(digest, None)
+    
+    def clear(self) -> None:
+        """Drop all cached results (e.g. on key rotation)."""
+        with self._lock:
+            self._entries.clear()
+            self._negative.clear()
+    
+    def stats(self) -> Dict[str, int]:
+        """Get cache counters."""
+        return {
+            "size": len(self._entries),
+            "negative_size": len(self._negative),
+            "hits": self.hits,
+            "negative_hits": self.negative_hits,
+            "misses": self.misses
+        }
+
 
 class JWTHandler:
-    """JWT token creation and validation."""
+    """JWT token creation and validation.
+    
+    With an asymmetric algorithm, tokens carry a kid header and are
+    verified against the matching public key in a KeyRing, so services
+    need no shared secret and several keys stay valid during rotation.
+    """
     
-    def __init__(self):
+    def __init__(self, cache_enabled: bool = JWT_VERIFY_CACHE_ENABLED,
+                 algorithm: str = JWT_ALGORITHM, keys: Optional[KeyRing] = None,
+                 revocations: Optional[TokenRevocationList] = token_revocations):
         self.secret_key = JWT_SECRET_KEY
-        self.algorithm = JWT_ALGORITHM
+        self.algorithm = algorithm
         self.access_token_expire = ACCESS_TOKEN_EXPIRE_MINUTES
         self.refresh_token_expire = REFRESH_TOKEN_EXPIRE_DAYS
+        self.cache: Optional[VerifiedTokenCache] = VerifiedTokenCache() if cache_enabled else None
+        
+        if keys is None and algorithm in ASYMMETRIC_ALGORITHMS:
+            keys = create_key_ring(algorithm)
+        self.keys = keys
+        self.revocations = revocations
+        if keys is not None:
+            # Retired kids, and kids dropped from a verifier's JWKS fetch
+            keys.on_keys_removed = self._keys_removed
+    
+    def _encode(self, to_encode: Dict[str, Any]) -> str:
+        """Sign claims with the shared secret or the active signing key."""
+        if self.keys is None:
+            return jwt.encode(to_encode, self.secret_key, algorithm=self.algorithm)
+        
+        signing_key = self.keys.signing_key
+        if signing_key is None:
+            raise RuntimeError("No JWT signing key configured (set JWT_PRIVATE_KEY_PATH)")
+        return jwt.encode(
+            to_encode, signing_key.private_key,
+            algorithm=signing_key.algorithm, headers={"kid": signing_key.kid}
+        )
     
     def create_access_token(self, data: Dict[str, Any]) -> str:
         """Create JWT access token."""
         to_encode = data.copy()
         expire = datetime.utcnow() + timedelta(minutes=self.access_token_expire)
         to_encode.update({"exp": expire, "type": "access"})
+        to_encode.setdefault("jti", secrets.token_urlsafe(12))
         
         try:
-            encoded_jwt = jwt.encode(to_encode, self.secret_key, algorithm=self.algorithm)
+            encoded_jwt = self._encode(to_encode)
             return encoded_jwt
         except Exception as e:
             logger.error(f"Failed to create access token: {e}")
@@ -44,26 +189,117 @@ class JWTHandler:
         to_encode = data.copy()
         expire = datetime.utcnow() + timedelta(days=self.refresh_token_expire)
         to_encode.update({"exp": expire, "type": "refresh"})
+        to_encode.setdefault("jti", secrets.token_urlsafe(12))
         
         try:
-            encoded_jwt = jwt.encode(to_encode, self.secret_key, algorithm=self.algorithm)
+            encoded_jwt = self._encode(to_encode)
             return encoded_jwt
         except Exception as e:
             logger.error(f"Failed to create refresh token: {e}")
             raise
     
-    def verify_token(self, token: str) -> Optional[Dict[str, Any]]:
-        """Verify and decode JWT token."""
+    def _decode(self, token: str) -> Any:
+        """Decode and verify a token's signature and expiry (claims, None or UNKNOWN_KEY)."""
         try:
-            payload = jwt.decode(token, self.secret_key, algorithms=[self.algorithm])
+            if self.keys is None:
+                return jwt.decode(token, self.secret_key, algorithms=[self.algorithm])
+            
+            # Pick the key by kid; only its own algorithm is accepted
+            kid = jwt.get_unverified_header(token).get("kid")
+            key = self.keys.get(kid) if kid else None
+            if key is None:
+                logger.warning(f"Invalid token: unknown key ID {kid!r}")
+                return UNKNOWN_KEY
+            payload = jwt.decode(token, key.key, algorithms=[key.algorithm])
             return payload
         except jwt.ExpiredSignatureError:
             logger.warning("Token has expired")
             return None
-        except jwt.JWTError as e:
+        except jwt.InvalidTokenError as e:
             logger.warning(f"Invalid token: {e}")
             return None
     
+    def verify_token(self, token: str) -> Optional[Dict[str, Any]]:
+        """Verify and decode JWT token."""
+        if self.cache is None:
+            payload = self._decode(token)
+        else:
+            digest = token_digest(token)
+            payload = self.cache.get(digest)
+            if payload is INVALID_TOKEN:
+                return None
+            if payload is None:
+                payload = self._decode(token)
+                if payload is None:
+                    self.cache.put_negative(digest)
+                elif payload is not UNKNOWN_KEY:
+                    self.cache.put(digest, payload)
+        
+        # Not cached: the key may be published by the next JWKS fetch
+        if payload is UNKNOWN_KEY:
+            return None
+        
+        # Checked on every call (not cached) so revocation applies at once
+        if payload is not None and self.revocations is not None and self.revocations.is_revoked(payload):
+            logger.warning("Token has been revoked")
+            return None
+        return payload
+    
+    def revoke_token(self, token: str) -> bool:
+        """Revoke a token until it expires; a session ID revokes the whole token pair."""
+        if self.revocations is None:
+            return False
+        payload = self.verify_token(token)
+        if payload is None:
+            return False
+        
+        if payload.get("sid"):
+            # Outlive the refresh token issued alongside
+            expires_at = time.time() + timedelta(days=self.refresh_token_expire).total_seconds()
+            self.revocations.revoke(payload["sid"], expires_at)
+        elif payload.get("jti"):
+            self.revocations.revoke(payload["jti"], payload["exp"])
+        else:
+            return False
+        
+        self.invalidate_token(token)
+        return True
+    
+    def invalidate_token(self, token: str) -> None:
+        """Forget a token's cached verification (call when it is revoked)."""
+        if self.cache is not None:
+            self.cache.discard(token_digest(token))
+    
+    def rotate_key(self, secret_key: str) -> None:
+        """Switch to a new shared secret; cached verifications are dropped."""
+        self.secret_key = secret_key
+        if self.cache is not None:
+            self.cache.clear()
+    
+    def rotate_signing_key(self, signing_key: SigningKey) -> None:
+        """Issue tokens with a new asymmetric key; tokens signed by the old one stay valid."""
+        if self.keys is None:
+            raise RuntimeError("Signing key rotation requires an asymmetric JWT_ALGORITHM")
+        self.keys.rotate(signing_key)
+    
+    def retire_key(self, kid: str) -> None:
+        """Stop accepting tokens signed by a key; cached verifications are dropped."""
+        if self.keys is None:
+            raise RuntimeError("Key retirement requires an asymmetric JWT_ALGORITHM")
+        self.keys.retire(kid)
+    
+    def _keys_removed(self, kids: List[str]) -> None:
+        """Drop cached verifications once signing keys stop being accepted."""
+        logger.info(f"JWT keys no longer accepted: {', '.join(kids)}")
+        if self.cache is not None:
+            self.cache.clear()
+    
+    def jwks(self) -> Dict[str, Any]:
+        """Public keys for the JWKS endpoint (empty with a shared secret)."""
+        if self.keys is None:
+            return {"keys": []}
+        return self.keys.jwks()
+    
     def verify_access_token(self, token: str) -> Optional[Dict[str, Any]]:
         """Verify access token specifically."""
         payload = self.verify_token(token)
@@ -94,6 +330,25 @@ jwt_handler = JWTHandler()
 
 def create_tokens(user_data: Dict[str, Any]) -> Dict[str, str]:
     """Create both access and refresh tokens."""
+    # Both tokens share a session ID so logout can revoke them together;
+    # a new login starts a stored session whose ID becomes the sid
+    sid = user_data.get("sid")
+    if not sid:
+        from .session_store import SESSION_STORE_ENABLED, session_store  # session_store imports this module
+        if SESSION_STORE_ENABLED and user_data.get("sub"):
+            sid = session_store.create(
+                user_data["sub"], expires_in=jwt_handler.refresh_token_expire * 86400
+            ).id
+        else:
+            sid = secrets.token_urlsafe(12)
+    user_data = {**user_data, "sid": sid}
+    
+    # Stamp tenant roles version so services reload changed custom roles on first sight
+    if user_data.get("tenant_id") and "roles_version" not in user_data:
+        from .rbac import tenant_roles  # rbac imports this module
+        if tenant_roles.loader is not None and user_data.get("role") not in tenant_roles.builtin_masks:
+            user_data["roles_version"] = tenant_roles.current_version(str(user_data["tenant_id"]))
+    
     access_token = jwt_handler.create_access_token(user_data)
     refresh_token = jwt_handler.create_refresh_token(user_data)
     
@@ -112,6 +367,8 @@ def get_current_user_from_token(token: str) -> Optional[Dict[str, Any]]:
             "id": payload.get("sub"),
             "email": payload.get("email"),
             "role": payload.get("role"),
-            "tenant_id": payload.get("tenant_id")
+            "tenant_id": payload.get("tenant_id"),
+            "roles_version": payload.get("roles_version"),
+            "session_id": payload.get("sid")
         }
     return None
\ No newline at end of file
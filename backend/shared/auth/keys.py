@@ -0,0 +1,344 @@
+"""
+Asymmetric JWT signing keys, key rings and JWKS distribution.
+"""
+
+import atexit
+import base64
+import hashlib
+import json
+import os
+import threading
+import time
+import urllib.request
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+import jwt
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Key configuration
+ASYMMETRIC_ALGORITHMS = ("EdDSA", "ES256", "RS256")
+JWT_PRIVATE_KEY_PATH = os.getenv("JWT_PRIVATE_KEY_PATH", "")  # PEM signing key (auth service only)
+JWT_KEY_ID = os.getenv("JWT_KEY_ID", "")  # defaults to the RFC 7638 thumbprint
+JWT_PUBLIC_KEYS_DIR = os.getenv("JWT_PUBLIC_KEYS_DIR", "")  # extra *.pem keys accepted (next/retired)
+JWT_JWKS_URL = os.getenv("JWT_JWKS_URL", "")  # e.g. http://auth-service:8000/.well-known/jwks.json
+JWT_JWKS_REFRESH_SECONDS = int(os.getenv("JWT_JWKS_REFRESH_SECONDS", "300"))
+JWT_JWKS_MIN_REFETCH_SECONDS = int(os.getenv("JWT_JWKS_MIN_REFETCH_SECONDS", "30"))
+JWT_JWKS_TIMEOUT_SECONDS = float(os.getenv("JWT_JWKS_TIMEOUT_SECONDS", "2"))
+
+# JWK members hashed for the RFC 7638 thumbprint, per key type
+_THUMBPRINT_MEMBERS = {
+    "RSA": ("e", "kty", "n"),
+    "EC": ("crv", "kty", "x", "y"),
+    "OKP": ("crv", "kty", "x"),
+}
+
+
+def jwk_thumbprint(jwk: Dict[str, Any]) -> str:
+    """RFC 7638 SHA-256 thumbprint of a public JWK, used as its key ID."""
+    members = {name: jwk[name] for name in _THUMBPRINT_MEMBERS[jwk["kty"]]}
+    canonical = json.dumps(members, separators=(",", ":"), sort_keys=True).encode("utf-8")
+    return base64.urlsafe_b64encode(hashlib.sha256(canonical).digest()).rstrip(b"=").decode("ascii")
+
+
+class VerificationKey:
+    """A public key accepted for one algorithm under one key ID."""
+    
+    __slots__ = ("kid", "algorithm", "key", "jwk")
+    
+    def __init__(self, key: Any, algorithm: str, kid: Optional[str] = None):
+        self.key = key
+        self.algorithm = algorithm
+        jwk = jwt.get_algorithm_by_name(algorithm).to_jwk(key, as_dict=True)
+        self.kid = kid or jwk_thumbprint(jwk)
+        self.jwk = {**jwk, "kid": self.kid, "alg": algorithm, "use": "sig"}
+    
+    @classmethod
+    def from_pem(cls, pem: bytes, algorithm: str, kid: Optional[str] = None) -> "VerificationKey":
+        """Load a PEM public key."""
+        return cls(jwt.get_algorithm_by_name(algorithm).prepare_key(pem), algorithm, kid)
+    
+    @classmethod
+    def from_jwk(cls, jwk: Dict[str, Any]) -> "VerificationKey":
+        """Load a key published in a JWKS document."""
+        parsed = jwt.PyJWK(jwk, jwk.get("alg"))
+        return cls(parsed.key, parsed.algorithm_name, jwk.get("kid"))
+
+
+class SigningKey:
+    """A private key used to issue tokens, with its public half."""
+    
+    def __init__(self, private_key: Any, algorithm: str, kid: Optional[str] = None):
+        if algorithm not in ASYMMETRIC_ALGORITHMS:
+            raise ValueError(f"Unsupported signing algorithm: {algorithm}")
+        self.private_key = private_key
+        self.algorithm = algorithm
+        self.public = VerificationKey(private_key.public_key(), algorithm, kid)
+        self.kid = self.public.kid
+    
+    @classmethod
+    def from_pem(cls, pem: bytes, algorithm: str, kid: Optional[str] = None) -> "SigningKey":
+        """Load a PEM private key."""
+        return cls(jwt.get_algorithm_by_name(algorithm).prepare_key(pem), algorithm, kid)
+    
+    @classmethod
+    def generate(cls, algorithm: str) -> "SigningKey":
+        """Generate a fresh key (development, tests and rotation tooling)."""
+        from cryptography.hazmat.primitives.asymmetric import ec, ed25519, rsa
+        
+        if algorithm == "EdDSA":
+            private_key = ed25519.Ed25519PrivateKey.generate()
+        elif algorithm == "ES256":
+            private_key = ec.generate_private_key(ec.SECP256R1())
+        elif algorithm == "RS256":
+            private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+        else:
+            raise ValueError(f"Unsupported signing algorithm: {algorithm}")
+        return cls(private_key, algorithm)
+
+
+class KeyRing:
+    """Keys accepted for verification, indexed by kid, plus the active signing key.
+    
+    Lookups read a dict that is replaced, never mutated, so the hot path
+    takes no lock. Local keys (the signing key and JWT_PUBLIC_KEYS_DIR)
+    are always kept; keys fetched from JWKS replace the previous fetch.
+    
+    Rotating keys: publish the next key first, with add() on the issuer
+    (or by dropping it into JWT_PUBLIC_KEYS_DIR), so it appears in the
+    JWKS document. Wait at least JWT_JWKS_REFRESH_SECONDS for every
+    verifier to fetch it, then rotate(). Verifiers never fetch JWKS on
+    the request path; a token with an unknown kid is rejected and only
+    nudges a background refetch. Whenever kids stop being accepted
+    (retire(), or a JWKS fetch that no longer lists them) the
+    on_keys_removed callback runs, so verification caches can drop
+    tokens those keys signed.
+    """
+    
+    def __init__(self, signing_key: Optional[SigningKey] = None,
+                 public_keys: Iterable[VerificationKey] = ()):
+        self._lock = threading.Lock()
+        self.signing_key = signing_key
+        self._local: Dict[str, VerificationKey] = {key.kid: key for key in public_keys}
+        if signing_key is not None:
+            self._local[signing_key.kid] = signing_key.public
+        self._remote: Dict[str, VerificationKey] = {}
+        self._keys: Dict[str, VerificationKey] = dict(self._local)
+        self.fetcher: Optional["JWKSFetcher"] = None
+        self.on_keys_removed: Optional[Callable[[List[str]], None]] = None
+    
+    def _publish(self) -> List[str]:
+        """Rebuild the lookup dict (lock held); returns kids no longer accepted."""
+        previous = self._keys
+        self._keys = {**self._remote, **self._local}
+        return [kid for kid in previous if kid not in self._keys]
+    
+    def _notify_removed(self, kids: List[str]) -> None:
+        """Run the removal callback outside the lock."""
+        callback = self.on_keys_removed
+        if kids and callback is not None:
+            callback(kids)
+    
+    def get(self, kid: str) -> Optional[VerificationKey]:
+        """Find a verification key; an unknown kid requests a background JWKS refetch."""
+        key = self._keys.get(kid)
+        fetcher = self.fetcher
+        if fetcher is not None:
+            fetcher.start()
+            if key is None:
+                fetcher.request_refresh()
+        return key
+    
+    def add(self, key: VerificationKey) -> None:
+        """Accept an additional key (e.g. one about to become active)."""
+        with self._lock:
+            self._local[key.kid] = key
+            self._publish()
+    
+    def retire(self, kid: str) -> None:
+        """Stop accepting a key once every token it signed has expired."""
+        if self.signing_key is not None and self.signing_key.kid == kid:
+            raise ValueError("Cannot retire the active signing key")
+        with self._lock:
+            self._local.pop(kid, None)
+            self._remote.pop(kid, None)
+            removed = self._publish()
+        self._notify_removed(removed)
+    
+    def rotate(self, signing_key: SigningKey) -> None:
+        """Sign with a new key; the previous key stays valid until retired.
+        
+        Publish the key with add() at least one JWKS refresh interval
+        beforehand, or verifiers reject its tokens until they refetch.
+        """
+        with self._lock:
+            self._local[signing_key.kid] = signing_key.public
+            self.signing_key = signing_key
+            self._publish()
+    
+    def set_remote(self, keys: Iterable[VerificationKey]) -> List[str]:
+        """Replace the keys fetched from JWKS; returns kids no longer accepted."""
+        with self._lock:
+            self._remote = {key.kid: key for key in keys}
+            removed = self._publish()
+        self._notify_removed(removed)
+        return removed
+    
+    def kids(self) -> List[str]:
+        """Key IDs currently accepted."""
+        return list(self._keys)
+    
+    def jwks(self) -> Dict[str, Any]:
+        """JWKS document with every public key this ring accepts."""
+        return {"keys": [key.jwk for key in self._keys.values()]}
+
+
+class JWKSFetcher:
+    """Keeps a key ring in sync with a remote JWKS document.
+    
+    A daemon thread refreshes every refresh_seconds. A token with an
+    unknown kid wakes the thread for an early fetch, at most once per
+    min_refetch_seconds, so requests never wait on the network and bogus
+    kids cannot hammer the auth service.
+    """
+    
+    def __init__(self, ring: KeyRing, url: str,
+                 refresh_seconds: int = JWT_JWKS_REFRESH_SECONDS,
+                 min_refetch_seconds: int = JWT_JWKS_MIN_REFETCH_SECONDS,
+                 timeout: float = JWT_JWKS_TIMEOUT_SECONDS):
+        self.ring = ring
+        self.url = url
+        self.refresh_seconds = refresh_seconds
+        self.min_refetch_seconds = min_refetch_seconds
+        self.timeout = timeout
+        
+        self._fetch_lock = threading.Lock()
+        self._last_attempt = float("-inf")
+        self._thread: Optional[threading.Thread] = None
+        self._wakeup = threading.Event()
+        self._refresh_requested = False
+        self._stopped = False
+        
+        # Counters (diagnostic only)
+        self.fetched = 0
+        self.failed = 0
+    
+    def fetch(self, min_interval: float = 0.0) -> bool:
+        """Fetch the JWKS document and replace the ring's remote keys."""
+        with self._fetch_lock:
+            # Another thread fetched while this one waited for the lock
+            if min_interval and time.monotonic() - self._last_attempt < min_interval:
+                return True
+            self._last_attempt = time.monotonic()
+            try:
+                with urllib.request.urlopen(self.url, timeout=self.timeout) as response:
+                    document = json.loads(response.read())
+                
+                keys = []
+                for jwk in document.get("keys", []):
+                    if jwk.get("use", "sig") != "sig" or jwk.get("alg") not in ASYMMETRIC_ALGORITHMS:
+                        continue
+                    try:
+                        keys.append(VerificationKey.from_jwk(jwk))
+                    except (jwt.PyJWKError, KeyError, ValueError) as e:
+                        logger.warning(f"Skipping unusable JWK {jwk.get('kid')}: {e}")
+                
+                self.ring.set_remote(keys)
+                self.fetched += 1
+                return True
+            except Exception as e:
+                # Keep the previous keys; tokens they signed stay verifiable
+                self.failed += 1
+                logger.warning(f"Failed to fetch JWKS from {self.url}: {e}")
+                return False
+    
+    def request_refresh(self) -> None:
+        """Ask the refresh thread for an early fetch (non-blocking)."""
+        if not self._refresh_requested:
+            self._refresh_requested = True
+            self._wakeup.set()
+    
+    def start(self) -> None:
+        """Start the refresh thread (no-op once running)."""
+        if self._thread is not None or self._stopped:
+            return
+        with self._fetch_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self._run, name="aems-jwks-refresh", daemon=True
+                )
+                self._thread.start()
+    
+    def _run(self) -> None:
+        """Refresh periodically until stopped."""
+        while not self._stopped:
+            self._wakeup.wait(self.refresh_seconds)
+            self._wakeup.clear()
+            if self._refresh_requested:
+                # Early fetches for unknown kids run at most once per min_refetch_seconds
+                delay = self._last_attempt + self.min_refetch_seconds - time.monotonic()
+                if delay > 0 and self._wakeup.wait(delay):
+                    self._wakeup.clear()
+                self._refresh_requested = False
+            if not self._stopped:
+                self.fetch()
+    
+    def shutdown(self, timeout: float = 1.0) -> None:
+        """Stop the refresh thread."""
+        self._stopped = True
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+    
+    def _reset_after_fork(self) -> None:
+        """Forget the refresh thread in a forked child; it restarts on use."""
+        self._fetch_lock = threading.Lock()
+        self._thread = None
+        self._wakeup = threading.Event()
+        self._refresh_requested = False
+    
+    def stats(self) -> Dict[str, Any]:
+        """Get fetch counters."""
+        return {
+            "fetched": self.fetched,
+            "failed": self.failed,
+            "keys": len(self.ring.kids())
+        }
+
+
+def _load_public_keys(directory: str, algorithm: str) -> List[VerificationKey]:
+    """Load every *.pem public key in a directory; the file stem is the kid."""
+    keys = []
+    for path in sorted(Path(directory).glob("*.pem")):
+        try:
+            keys.append(VerificationKey.from_pem(path.read_bytes(), algorithm, path.stem))
+        except (OSError, ValueError, TypeError) as e:
+            logger.error(f"Failed to load public key {path}: {e}")
+    return keys
+
+
+def create_key_ring(algorithm: str) -> KeyRing:
+    """Build the key ring described by the environment."""
+    signing_key = None
+    if JWT_PRIVATE_KEY_PATH:
+        signing_key = SigningKey.from_pem(
+            Path(JWT_PRIVATE_KEY_PATH).read_bytes(), algorithm, JWT_KEY_ID or None
+        )
+    
+    public_keys = _load_public_keys(JWT_PUBLIC_KEYS_DIR, algorithm) if JWT_PUBLIC_KEYS_DIR else []
+    ring = KeyRing(signing_key, public_keys)
+    
+    if JWT_JWKS_URL:
+        ring.fetcher = JWKSFetcher(ring, JWT_JWKS_URL)
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=ring.fetcher._reset_after_fork)
+        atexit.register(ring.fetcher.shutdown)
+        # Prime the ring so the first requests verify without waiting
+        ring.fetcher.fetch()
+    elif signing_key is None and not public_keys:
+        logger.warning(f"No {algorithm} keys configured; using an ephemeral signing key (development only)")
+        ring.rotate(SigningKey.generate(algorithm))
+    
+    return ring
@@ -0,0 +1,418 @@
+"""
+Brute-force login protection with shared-memory counters and DB write-behind.
+"""
+
+import atexit
+import fcntl
+import hashlib
+import ipaddress
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+from datetime import datetime
+from typing import Dict, List, NamedTuple, Optional, Tuple
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Login guard configuration
+LOGIN_GUARD_ENABLED = os.getenv("LOGIN_GUARD_ENABLED", "true").lower() == "true"
+LOGIN_GUARD_PATH = os.getenv(
+    "LOGIN_GUARD_PATH",
+    os.path.join("/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir(), "aems_login_guard")
+)
+LOGIN_GUARD_SLOTS = int(os.getenv("LOGIN_GUARD_SLOTS", "65536"))
+LOGIN_GUARD_WINDOW_SECONDS = int(os.getenv("LOGIN_GUARD_WINDOW_SECONDS", "900"))
+LOGIN_LOCKOUT_SECONDS = int(os.getenv("LOGIN_LOCKOUT_SECONDS", "900"))
+LOGIN_MAX_FAILURES_ACCOUNT = int(os.getenv("LOGIN_MAX_FAILURES_ACCOUNT", "5"))
+LOGIN_MAX_FAILURES_IP = int(os.getenv("LOGIN_MAX_FAILURES_IP", "20"))
+LOGIN_MAX_FAILURES_SUBNET = int(os.getenv("LOGIN_MAX_FAILURES_SUBNET", "100"))
+LOGIN_GUARD_FLUSH_SECONDS = float(os.getenv("LOGIN_GUARD_FLUSH_SECONDS", "5"))
+LOGIN_GUARD_TRUST_FORWARDED = os.getenv("LOGIN_GUARD_TRUST_FORWARDED", "true").lower() == "true"
+
+# Table layout: header, fixed-size slots, then one shared overflow slot
+TABLE_MAGIC = b"AEMSLG02"
+TABLE_HEADER = struct.Struct("<8sI4x")  # magic, slot count
+SLOT = struct.Struct("<QIIIII4x")  # key, window, current, previous, failures, locked_until
+MAX_PROBES = 16
+
+
+class LoginBlock(NamedTuple):
+    """Why a login attempt is refused, and for how long."""
+    
+    scope: str  # "account", "ip" or "subnet"
+    retry_after: int
+
+
+def client_ip(request) -> str:
+    """Client address, taken from the gateway's X-Forwarded-For entry when trusted."""
+    if LOGIN_GUARD_TRUST_FORWARDED:
+        forwarded = request.headers.get("x-forwarded-for")
+        if forwarded:
+            # The rightmost entry was appended by our own gateway
+            return forwarded.rsplit(",", 1)[-1].strip()
+    return request.client.host if request.client else "unknown"
+
+
+def subnet_of(ip: str) -> Optional[str]:
+    """The /24 (IPv4) or /64 (IPv6) network an address belongs to."""
+    try:
+        address = ipaddress.ip_address(ip)
+    except ValueError:
+        return None
+    if address.version == 4:
+        first, second, third, _ = address.packed
+        return f"{first}.{second}.{third}.0/24"
+    return f"{ipaddress.IPv6Address(int(address) >> 64 << 64)}/64"
+
+
+def _slot_key(scope: str, value: str) -> int:
+    """Non-zero 64-bit key for a counter (zero marks an empty slot)."""
+    digest = hashlib.blake2b(f"{scope}:{value}".encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "little") or 1
+
+
+class SharedCounterTable:
+    """Fixed-size hash table of sliding-window failure counters in a shared mmap.
+    
+    Every worker process maps the same file, so counts and lockouts are
+    shared without a network round trip. Updates take an flock on the
+    file (plus a thread lock, since flock does not exclude threads of
+    one process). Each slot keeps the current and previous window's
+    counts; the sliding total weights the previous window by how much of
+    it still overlaps. Stale slots are reused, and when a probe sequence
+    is full the unlocked slot with the oldest window is evicted. A slot
+    under an active lockout is never evicted: when every slot in the
+    sequence is locked, the key counts into a shared overflow slot, so a
+    flood of new keys cannot push a locked-out attacker out of the table.
+    """
+    
+    def __init__(self, path: str = LOGIN_GUARD_PATH, slots: int = LOGIN_GUARD_SLOTS,
+                 window_seconds: int = LOGIN_GUARD_WINDOW_SECONDS):
+        self.path = path
+        self.slots = slots
+        self.window_seconds = window_seconds
+        self._thread_lock = threading.Lock()
+        self._file = None
+        self._map: Optional[mmap.mmap] = None
+        self._pid = None
+    
+    def _open(self) -> mmap.mmap:
+        """Map the table, creating it if needed (reopened after fork so flock is per process)."""
+        if self._map is not None and self._pid == os.getpid():
+            return self._map
+        
+        size = TABLE_HEADER.size + (self.slots + 1) * SLOT.size
+        table_file = os.fdopen(os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600), "r+b")
+        fcntl.flock(table_file, fcntl.LOCK_EX)
+        try:
+            table_file.seek(0)
+            header = table_file.read(TABLE_HEADER.size)
+            if len(header) < TABLE_HEADER.size or TABLE_HEADER.unpack(header) != (TABLE_MAGIC, self.slots):
+                table_file.truncate(0)
+                table_file.truncate(size)
+                table_file.seek(0)
+                table_file.write(TABLE_HEADER.pack(TABLE_MAGIC, self.slots))
+                table_file.flush()
+        finally:
+            fcntl.flock(table_file, fcntl.LOCK_UN)
+        
+        self._file = table_file
+        self._map = mmap.mmap(table_file.fileno(), size)
+        self._pid = os.getpid()
+        return self._map
+    
+    @property
+    def overflow_offset(self) -> int:
+        """Offset of the slot shared by keys that found no evictable slot."""
+        return TABLE_HEADER.size + self.slots * SLOT.size
+    
+    def _find(self, table: mmap.mmap, key: int, window: int, create: bool) -> Optional[int]:
+        """Offset of the key's slot, claiming one if create is set (file lock held).
+        
+        Returns the overflow slot when the probe sequence holds only
+        locked-out slots, and None when the key has no slot.
+        """
+        start = key % self.slots
+        now = int(time.time())
+        reusable = None
+        oldest = None
+        oldest_window = None
+        full = True
+        for probe in range(MAX_PROBES):
+            offset = TABLE_HEADER.size + ((start + probe) % self.slots) * SLOT.size
+            slot_key, slot_window, _, _, _, locked_until = SLOT.unpack_from(table, offset)
+            if slot_key == key:
+                return offset
+            if slot_key == 0:
+                # Keys are never cleared, so an empty slot ends the probe sequence
+                reusable = reusable if reusable is not None else offset
+                full = False
+                break
+            if locked_until > now:
+                continue
+            full = False
+            if reusable is None and slot_window < window - 1:
+                reusable = offset
+            if oldest is None or slot_window < oldest_window:
+                oldest, oldest_window = offset, slot_window
+        
+        if full:
+            # The key may have been counted in the overflow slot
+            return self.overflow_offset
+        if not create:
+            return None
+        offset = reusable if reusable is not None else oldest
+        SLOT.pack_into(table, offset, key, window, 0, 0, 0, 0)
+        return offset
+    
+    def _locked(self):
+        """Context holding the thread lock and the cross-process file lock."""
+        table = self._open()
+        return _TableLock(self._thread_lock, self._file), table
+    
+    def record_failures(self, counters: List[Tuple[str, str, int]],
+                        lockout_seconds: int) -> List[Tuple[int, int]]:
+        """Count a failure on each (scope, value, limit) counter under one lock.
+        
+        Returns (consecutive failures, locked_until) per counter, after
+        locking out any counter whose sliding total reached its limit.
+        """
+        now = time.time()
+        window = int(now // self.window_seconds)
+        # Sliding total: the previous window counts for the part still in range
+        overlap = 1 - (now % self.window_seconds) / self.window_seconds
+        results = []
+        lock, table = self._locked()
+        with lock:
+            for scope, value, limit in counters:
+                key = _slot_key(scope, value)
+                offset = self._find(table, key, window, create=True)
+                _, slot_window, current, previous, failures, locked_until = SLOT.unpack_from(table, offset)
+                if slot_window != window:
+                    previous = current if slot_window == window - 1 else 0
+                    current = 0
+                current += 1
+                failures += 1
+                if current + previous * overlap >= limit:
+                    locked_until = max(locked_until, int(now) + lockout_seconds)
+                SLOT.pack_into(table, offset, key, window, current, previous, failures, locked_until)
+                results.append((failures, locked_until))
+        return results
+    
+    def locked_until(self, counters: List[Tuple[str, str]]) -> List[int]:
+        """Lockout expiry per (scope, value) counter (0 if not locked)."""
+        results = []
+        lock, table = self._locked()
+        with lock:
+            for scope, value in counters:
+                offset = self._find(table, _slot_key(scope, value), 0, create=False)
+                results.append(SLOT.unpack_from(table, offset)[5] if offset is not None else 0)
+        return results
+    
+    def reset(self, scope: str, value: str) -> int:
+        """Clear a counter (e.g. after a successful login); returns the failures it held."""
+        key = _slot_key(scope, value)
+        lock, table = self._locked()
+        with lock:
+            offset = self._find(table, key, 0, create=False)
+            if offset is None or offset == self.overflow_offset:
+                # The overflow slot is shared, so one success must not clear it
+                return 0
+            failures = SLOT.unpack_from(table, offset)[4]
+            SLOT.pack_into(table, offset, key, 0, 0, 0, 0, 0)
+            return failures
+
+
+class _TableLock:
+    """Thread lock plus exclusive flock, released in reverse order."""
+    
+    __slots__ = ("thread_lock", "table_file")
+    
+    def __init__(self, thread_lock: threading.Lock, table_file):
+        self.thread_lock = thread_lock
+        self.table_file = table_file
+    
+    def __enter__(self):
+        self.thread_lock.acquire()
+        try:
+            fcntl.flock(self.table_file, fcntl.LOCK_EX)
+        except BaseException:
+            self.thread_lock.release()
+            raise
+    
+    def __exit__(self, *exc_info):
+        fcntl.flock(self.table_file, fcntl.LOCK_UN)
+        self.thread_lock.release()
+
+
+class LoginGuard:
+    """Brute-force protection per account, client IP and subnet.
+    
+    Decisions read only the shared counter table, so a credential-stuffing
+    burst never touches the database. Account state (failed attempts and
+    locked_until) is coalesced per account and written to the users
+    table in one batch every LOGIN_GUARD_FLUSH_SECONDS. Attempts against
+    addresses with no account are counted but never written.
+    """
+    
+    def __init__(self, table: Optional[SharedCounterTable] = None,
+                 flush_seconds: float = LOGIN_GUARD_FLUSH_SECONDS):
+        self.table = table or SharedCounterTable()
+        self.flush_seconds = flush_seconds
+        
+        self._lock = threading.Lock()
+        self._pending: Dict[str, Tuple[int, int]] = {}  # lowercased email -> (failures, locked_until)
+        self._thread: Optional[threading.Thread] = None
+        self._wakeup = threading.Event()
+        self._stopped = False
+        
+        # Counters (diagnostic only)
+        self.blocked = 0
+        self.flushed = 0
+        self.flush_failures = 0
+    
+    @staticmethod
+    def _counters(email: str, ip: str) -> List[Tuple[str, str]]:
+        """Counters an attempt is charged to: account, IP and subnet."""
+        counters = [("account", email.lower()), ("ip", ip)]
+        subnet = subnet_of(ip)
+        if subnet is not None:
+            counters.append(("subnet", subnet))
+        return counters
+    
+    def check(self, email: str, ip: str) -> Optional[LoginBlock]:
+        """Refuse the attempt if the account, IP or subnet is locked out."""
+        now = int(time.time())
+        counters = self._counters(email, ip)
+        for (scope, _), locked_until in zip(counters, self.table.locked_until(counters)):
+            if locked_until > now:
+                self.blocked += 1
+                return LoginBlock(scope, locked_until - now)
+        return None
+    
+    def record_failure(self, email: str, ip: str) -> None:
+        """Count a failed attempt against the account, IP and subnet."""
+        limits = {"account": LOGIN_MAX_FAILURES_ACCOUNT, "ip": LOGIN_MAX_FAILURES_IP, "subnet": LOGIN_MAX_FAILURES_SUBNET}
+        counters = [(scope, value, limits[scope]) for scope, value in self._counters(email, ip)]
+        failures, locked_until = self.table.record_failures(counters, LOGIN_LOCKOUT_SECONDS)[0]
+        
+        if failures == LOGIN_MAX_FAILURES_ACCOUNT and locked_until > time.time():
+            logger.warning(f"Account locked after {failures} failed login attempts")
+        self._enqueue(email, failures, locked_until)
+    
+    def record_success(self, email: str) -> None:
+        """Clear the account's failures; IP and subnet counters keep decaying on their own."""
+        if self.table.reset("account", email.lower()):
+            self._enqueue(email, 0, 0)
+    
+    def _enqueue(self, email: str, failures: int, locked_until: int) -> None:
+        """Queue the account's latest state for the next batch write."""
+        with self._lock:
+            self._pending[email.lower()] = (failures, locked_until)
+        if self._thread is None and not self._stopped:
+            self._ensure_started()
+    
+    def _ensure_started(self) -> None:
+        """Start the flush thread on first use."""
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self._run, name="aems-login-guard-flusher", daemon=True
+                )
+                self._thread.start()
+    
+    def _run(self) -> None:
+        """Flush pending account state periodically until stopped."""
+        while not self._stopped:
+            self._wakeup.wait(self.flush_seconds)
+            self._wakeup.clear()
+            self.flush()
+    
+    def flush(self) -> int:
+        """Write pending account state to the users table in one batch."""
+        with self._lock:
+            pending = self._pending
+            self._pending = {}
+        if not pending:
+            return 0
+        
+        # Imported lazily so the guard does not depend on the database layer at import
+        from sqlalchemy import bindparam, func, select, update
+        from ..database.base import SessionLocal
+        from ..database.models import User
+        
+        users = User.__table__
+        email_key = func.lower(users.c.email)  # served by ix_users_email_lower
+        statement = (
+            update(users)
+            .where(users.c.id == bindparam("user_id"))
+            .values(failed_login_attempts=bindparam("failures"), locked_until=bindparam("lock_expiry"))
+        )
+        rows = []
+        
+        db = SessionLocal()
+        try:
+            # Resolve addresses to IDs in one query; unknown accounts are dropped here
+            accounts = db.execute(select(users.c.id, email_key).where(email_key.in_(list(pending)))).all()
+            rows = [
+                {
+                    "user_id": user_id,
+                    "failures": pending[email][0],
+                    "lock_expiry": datetime.utcfromtimestamp(pending[email][1]) if pending[email][1] else None
+                }
+                for user_id, email in accounts
+            ]
+            if rows:
+                db.execute(statement, rows)
+            db.commit()
+            self.flushed += len(rows)
+        except Exception as e:
+            db.rollback()
+            self.flush_failures += len(pending)
+            logger.error(f"Failed to write back login state: {e}")
+            # Keep the state for the next flush unless newer state arrived
+            with self._lock:
+                for email, state in pending.items():
+                    self._pending.setdefault(email, state)
+        finally:
+            db.close()
+        return len(rows)
+    
+    def shutdown(self, timeout: float = 5.0) -> None:
+        """Stop the flush thread and write what is pending."""
+        if self._stopped:
+            return
+        self._stopped = True
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        self.flush()
+    
+    def _reset_after_fork(self) -> None:
+        """Start fresh in a forked child; the flush thread does not survive fork."""
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._thread = None
+        self._wakeup = threading.Event()
+    
+    def stats(self) -> Dict[str, int]:
+        """Get guard counters."""
+        return {
+            "blocked": self.blocked,
+            "pending": len(self._pending),
+            "flushed": self.flushed,
+            "flush_failures": self.flush_failures
+        }
+
+
+# Global login guard
+login_guard = LoginGuard() if LOGIN_GUARD_ENABLED else None
+
+if login_guard is not None:
+    if hasattr(os, "register_at_fork"):
+        os.register_at_fork(after_in_child=login_guard._reset_after_fork)
+    atexit.register(login_guard.shutdown)
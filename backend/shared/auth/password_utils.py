@@ -2,15 +2,211 @@
 Password utilities for secure password handling.
 """
 
+import asyncio
 import bcrypt
+import hashlib
+import hmac
+import os
 import secrets
 import string
-from typing import Optional
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional, Tuple
 import re
 import logging
 
+from ..exceptions import ServiceOverloadedError
+from .breached_passwords import is_breached_password
+from ..metrics import registry
+
 logger = logging.getLogger(__name__)
 
+# bcrypt cost: a fixed number of rounds, or "auto" to calibrate on first use
+BCRYPT_ROUNDS = os.getenv("BCRYPT_ROUNDS", "12")
+BCRYPT_TARGET_MS = float(os.getenv("BCRYPT_TARGET_MS", "250"))
+BCRYPT_MIN_ROUNDS = 10
+BCRYPT_MAX_ROUNDS = 16
+
+# Key for MFA backup-code lookup tags (required; there is no safe default)
+MFA_BACKUP_CODE_KEY = os.getenv("MFA_BACKUP_CODE_KEY", "")
+
+# Password hashing pool configuration
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(os.cpu_count() or 2)))
+PASSWORD_HASH_MAX_PENDING = int(os.getenv("PASSWORD_HASH_MAX_PENDING", str(PASSWORD_HASH_WORKERS * 8)))
+PASSWORD_HASH_RETRY_AFTER_SECONDS = int(os.getenv("PASSWORD_HASH_RETRY_AFTER_SECONDS", "1"))
+
+# bcrypt runs for 50-500 ms; default request buckets stop being useful past 1 s
+HASH_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.2, 0.3, 0.5, 0.75, 1.0, 2.0, 5.0)
+
+password_hash_wait_seconds = registry.histogram(
+    "password_hash_wait_seconds", "Time password hashing jobs wait for a worker", ("operation",), HASH_BUCKETS
+)
+password_hash_duration_seconds = registry.histogram(
+    "password_hash_duration_seconds", "Time spent hashing or verifying a password", ("operation",), HASH_BUCKETS
+)
+password_hash_rejected_total = registry.counter(
+    "password_hash_rejected_total", "Password hashing jobs rejected because the queue was full", ("operation",)
+)
+
+
+def _time_hash(rounds: int, repeat: int = 3) -> float:
+    """Fastest of several bcrypt hashes at a cost, in milliseconds."""
+    salt = bcrypt.gensalt(rounds=rounds)
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        bcrypt.hashpw(b"calibration-password", salt)
+        best = min(best, time.perf_counter() - started)
+    return best * 1000
+
+
+def calibrate_bcrypt_rounds(target_ms: float = BCRYPT_TARGET_MS,
+                            min_rounds: int = BCRYPT_MIN_ROUNDS,
+                            max_rounds: int = BCRYPT_MAX_ROUNDS) -> int:
+    """Highest bcrypt cost whose hash time on this machine stays within target_ms.
+    
+    Each extra round doubles the work, so one measurement at a cheap cost
+    is extrapolated, then checked once at the chosen cost. Never returns
+    less than min_rounds, whatever the hardware.
+    """
+    base_rounds = 8
+    base_ms = _time_hash(base_rounds)
+    rounds = min_rounds
+    while rounds < max_rounds and base_ms * 2 ** (rounds + 1 - base_rounds) <= target_ms:
+        rounds += 1
+    
+    # Correct an optimistic extrapolation (e.g. CPU frequency scaling)
+    while rounds > min_rounds and _time_hash(rounds, repeat=1) > target_ms * 1.5:
+        rounds -= 1
+    
+    logger.info(f"Calibrated bcrypt cost: {rounds} rounds for a {target_ms:.0f} ms target")
+    return rounds
+
+
+_bcrypt_rounds: Optional[int] = None
+
+
+def get_bcrypt_rounds() -> int:
+    """bcrypt cost for new hashes (calibrated once when BCRYPT_ROUNDS=auto)."""
+    global _bcrypt_rounds
+    if _bcrypt_rounds is None:
+        if BCRYPT_ROUNDS.lower() == "auto":
+            _bcrypt_rounds = calibrate_bcrypt_rounds()
+        else:
+            _bcrypt_rounds = int(BCRYPT_ROUNDS)
+    return _bcrypt_rounds
+
+
+def bcrypt_rounds_of(hashed_password: str) -> Optional[int]:
+    """Cost factor stored in a bcrypt hash ("$2b$12$..."), or None if unrecognized."""
+    parts = hashed_password.split("$")
+    if len(parts) != 4 or parts[1] not in ("2a", "2b", "2y"):
+        return None
+    try:
+        return int(parts[2])
+    except ValueError:
+        return None
+
+
+def check_backup_code_key() -> None:
+    """Refuse to run without MFA_BACKUP_CODE_KEY (called at service startup)."""
+    if not MFA_BACKUP_CODE_KEY:
+        raise RuntimeError(
+            "MFA_BACKUP_CODE_KEY is not set; backup-code lookup tags need a secret key"
+        )
+
+
+class PasswordHashPool:
+    """Bounded worker pool that keeps bcrypt off the event loop.
+    
+    bcrypt releases the GIL while hashing, so threads give real
+    parallelism without pickling overhead. Jobs beyond max_pending are
+    rejected immediately with ServiceOverloadedError (HTTP 503) rather
+    than queueing behind a login burst until clients time out.
+    """
+    
+    def __init__(self, workers: int = PASSWORD_HASH_WORKERS, max_pending: int = PASSWORD_HASH_MAX_PENDING):
+        self.workers = workers
+        self.max_pending = max_pending
+        self._lock = threading.Lock()
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self.pending = 0
+        
+        # Counters (diagnostic only)
+        self.completed = 0
+        self.rejected = 0
+    
+    def _get_executor(self) -> ThreadPoolExecutor:
+        """Create the executor on first use."""
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="aems-bcrypt")
+        return self._executor
+    
+    async def run(self, operation: str, function: Callable[..., Any], *args) -> Any:
+        """Run a hashing function in the pool, failing fast when it is saturated."""
+        with self._lock:
+            if self.pending >= self.max_pending:
+                self.rejected += 1
+                password_hash_rejected_total.inc((operation,))
+                raise ServiceOverloadedError(
+                    "Too many concurrent authentication requests",
+                    retry_after=PASSWORD_HASH_RETRY_AFTER_SECONDS
+                )
+            self.pending += 1
+        
+        submitted = time.perf_counter()
+        
+        def timed():
+            started = time.perf_counter()
+            password_hash_wait_seconds.observe(started - submitted, (operation,))
+            try:
+                return function(*args)
+            finally:
+                password_hash_duration_seconds.observe(time.perf_counter() - started, (operation,))
+        
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._get_executor(), timed)
+        finally:
+            with self._lock:
+                self.pending -= 1
+                self.completed += 1
+    
+    def shutdown(self) -> None:
+        """Stop the workers after running jobs finish."""
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+    
+    def _reset_after_fork(self) -> None:
+        """Worker threads do not survive fork; start a new executor on use."""
+        self._lock = threading.Lock()
+        self._executor = None
+        self.pending = 0
+    
+    def stats(self) -> Dict[str, int]:
+        """Get pool counters."""
+        return {
+            "workers": self.workers,
+            "pending": self.pending,
+            "completed": self.completed,
+            "rejected": self.rejected
+        }
+
+
+# Global password hashing pool
+password_hash_pool = PasswordHashPool()
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=password_hash_pool._reset_after_fork)
+
+registry.gauge(
+    "password_hash_queue_depth", "Password hashing jobs queued or running",
+    function=lambda: password_hash_pool.pending
+)
+
 
 class PasswordUtils:
     """Password hashing and validation utilities."""
@@ -19,7 +215,7 @@ class PasswordUtils:
     def hash_password(password: str) -> str:
         """Hash password using bcrypt."""
         try:
-            salt = bcrypt.gensalt()
+            salt = bcrypt.gensalt(rounds=get_bcrypt_rounds())
             hashed = bcrypt.hashpw(password.encode('utf-8'), salt)
             return hashed.decode('utf-8')
         except Exception as e:
@@ -35,6 +231,47 @@ class PasswordUtils:
             logger.error(f"Failed to verify password: {e}")
             return False
     
+    @staticmethod
+    def needs_rehash(hashed_password: str) -> bool:
+        """Whether a stored hash uses a lower cost (or another scheme) than new hashes.
+        
+        Only upgrades count: with BCRYPT_ROUNDS=auto each worker calibrates
+        on its own and may settle one round apart, and rehashing on any
+        difference would flip a user's hash back and forth between them.
+        """
+        rounds = bcrypt_rounds_of(hashed_password)
+        return rounds is None or rounds < get_bcrypt_rounds()
+    
+    @staticmethod
+    def verify_and_update(password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+        """Verify password; on success also return a new hash if the stored one should be upgraded.
+        
+        Call on login and persist the new hash when it is not None, so
+        stored hashes follow cost changes without a password reset.
+        """
+        if not PasswordUtils.verify_password(password, hashed_password):
+            return False, None
+        if PasswordUtils.needs_rehash(hashed_password):
+            return True, PasswordUtils.hash_password(password)
+        return True, None
+    
+    # Login, registration and password changes must use the async variants
+    # below; the auth endpoints already turn ServiceOverloadedError into a 503
+    @staticmethod
+    async def hash_password_async(password: str) -> str:
+        """Hash password in the hashing pool without blocking the event loop."""
+        return await password_hash_pool.run("hash", PasswordUtils.hash_password, password)
+    
+    @staticmethod
+    async def verify_password_async(password: str, hashed_password: str) -> bool:
+        """Verify password in the hashing pool without blocking the event loop."""
+        return await password_hash_pool.run("verify", PasswordUtils.verify_password, password, hashed_password)
+    
+    @staticmethod
+    async def verify_and_update_async(password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+        """verify_and_update in the hashing pool without blocking the event loop."""
+        return await password_hash_pool.run("verify", PasswordUtils.verify_and_update, password, hashed_password)
+    
     @staticmethod
     def generate_password(length: int = 12) -> str:
         """Generate a secure random password."""
@@ -98,6 +335,10 @@ class PasswordUtils:
                 result["score"] -= 1
                 break
         
+        # Breach corpus check (offline index, when configured)
+        if is_breached_password(password):
+            result["feedback"].append("Password has appeared in a data breach")
+        
         # Final validation
         result["is_valid"] = len(result["feedback"]) == 0 and result["score"] >= 4
         
@@ -124,17 +365,47 @@ class TOTPUtils:
         return codes
     
     @staticmethod
-    def hash_backup_codes(codes: list) -> list:
-        """Hash backup codes for storage."""
-        return [PasswordUtils.hash_password(code) for code in codes]
+    def normalize_backup_code(code: str) -> str:
+        """Strip formatting so "1234-5678" and "1234 5678" match."""
+        return "".join(char for char in code if char.isalnum()).upper()
     
     @staticmethod
-    def verify_backup_code(code: str, hashed_codes: list) -> bool:
-        """Verify a backup code against hashed codes."""
-        for hashed_code in hashed_codes:
-            if PasswordUtils.verify_password(code, hashed_code):
-                return True
-        return False
+    def backup_code_tag(user_id: str, code: str) -> str:
+        """Keyed lookup tag for a user's backup code.
+        
+        Lets the stored record be found with one indexed lookup, so a
+        wrong code costs an HMAC instead of a bcrypt check per stored code.
+        """
+        check_backup_code_key()
+        message = f"{user_id}:{TOTPUtils.normalize_backup_code(code)}".encode("utf-8")
+        return hmac.new(MFA_BACKUP_CODE_KEY.encode("utf-8"), message, hashlib.sha256).hexdigest()
+    
+    @staticmethod
+    def hash_backup_codes(user_id: str, codes: list) -> list:
+        """Hash backup codes for storage as (lookup_tag, code_hash) pairs."""
+        return [
+            (TOTPUtils.backup_code_tag(user_id, code),
+             PasswordUtils.hash_password(TOTPUtils.normalize_backup_code(code)))
+            for code in codes
+        ]
+    
+    @staticmethod
+    def verify_backup_code(code: str, code_hash: str) -> bool:
+        """Verify a backup code against the one record its lookup tag found."""
+        return PasswordUtils.verify_password(TOTPUtils.normalize_backup_code(code), code_hash)
+    
+    @staticmethod
+    def match_legacy_backup_code(code: str, code_hashes: list) -> Optional[int]:
+        """Index of the legacy hash matching a code, or None.
+        
+        Legacy codes were stored as bcrypt hashes of the "XXXX-XXXX" form.
+        """
+        normalized = TOTPUtils.normalize_backup_code(code)
+        formatted = f"{normalized[:4]}-{normalized[4:]}"
+        for index, code_hash in enumerate(code_hashes):
+            if PasswordUtils.verify_password(formatted, code_hash):
+                return index
+        return None
 
 
 # Global instances
@@ -3,9 +3,17 @@ Role-Based Access Control (RBAC) utilities.
 """
 
 from enum import Enum
-from typing import List, Dict, Set, Optional
+from typing import Callable, List, Dict, Set, Optional, Tuple, Union
 from functools import wraps
+import asyncio
 import logging
+import os
+
+from fastapi import HTTPException, Request, status
+
+from .internal_claims import INTERNAL_CLAIMS_HEADER, internal_claims_handler
+from .jwt_handler import get_current_user_from_token
+from .tenant_roles import TenantRoleStore, create_role_loader
 
 logger = logging.getLogger(__name__)
 
@@ -70,11 +78,104 @@ class Permission(Enum):
     VIEW_LOGS = "view_logs"
 
 
+# Bit for each permission in a role's compiled mask
+PERMISSION_BITS: Dict[Permission, int] = {permission: 1 << index for index, permission in enumerate(Permission)}
+
+# (resource, action) pairs and the permission each requires
+PERMISSION_MAP: Dict[str, Dict[str, Permission]] = {
+    "users": {
+        "create": Permission.CREATE_USER,
+        "read": Permission.READ_USER,
+        "update": Permission.UPDATE_USER,
+        "delete": Permission.DELETE_USER
+    },
+    "dashboard": {
+        "view": Permission.VIEW_DASHBOARD
+    },
+    "sales": {
+        "view": Permission.VIEW_SALES,
+        "manage": Permission.MANAGE_SALES
+    },
+    "finance": {
+        "view": Permission.VIEW_FINANCE,
+        "manage": Permission.MANAGE_FINANCE
+    },
+    "hr": {
+        "view": Permission.VIEW_HR,
+        "manage": Permission.MANAGE_HR
+    },
+    "products": {
+        "view": Permission.VIEW_PRODUCTS,
+        "manage": Permission.MANAGE_PRODUCTS
+    },
+    "risk": {
+        "view": Permission.VIEW_RISK,
+        "manage": Permission.MANAGE_RISK
+    },
+    "reports": {
+        "view": Permission.VIEW_REPORTS,
+        "create": Permission.CREATE_REPORTS,
+        "manage": Permission.MANAGE_REPORTS
+    },
+    "ai": {
+        "chat": Permission.USE_AI_CHAT,
+        "analytics": Permission.VIEW_AI_ANALYTICS
+    }
+}
+
+
 class RBACManager:
-    """Role-Based Access Control manager."""
+    """Role-Based Access Control manager.
+    
+    Role permissions are compiled once into integer bitmasks keyed by the
+    role string, and each (resource, action) pair into a single bit, so
+    every check is a dict lookup and a bitwise AND.
+    """
     
     def __init__(self):
         self.role_permissions = self._initialize_role_permissions()
+        self._compile()
+    
+    def _compile(self) -> None:
+        """Precompute role masks and (resource, action) bits."""
+        self.role_masks: Dict[str, int] = {
+            role.value: self.mask_of(permissions) for role, permissions in self.role_permissions.items()
+        }
+        self.resource_bits: Dict[Tuple[str, str], int] = {
+            (resource, action): PERMISSION_BITS[permission]
+            for resource, actions in PERMISSION_MAP.items()
+            for action, permission in actions.items()
+        }
+    
+    @staticmethod
+    def mask_of(permissions) -> int:
+        """OR together the bits of several permissions."""
+        mask = 0
+        for permission in permissions:
+            mask |= PERMISSION_BITS[permission]
+        return mask
+    
+    def role_mask(self, role: Optional[str]) -> int:
+        """Compiled permission mask for a role (0 if unknown)."""
+        mask = self.role_masks.get(role)
+        if mask is None:
+            mask = self.role_masks.get(role.lower(), 0) if isinstance(role, str) else 0
+        return mask
+    
+    def permission_bit(self, spec: Union[str, Permission]) -> int:
+        """Bit for a Permission, "resource:action" or permission value; raises ValueError if unknown."""
+        if isinstance(spec, Permission):
+            return PERMISSION_BITS[spec]
+        if ":" in spec:
+            resource, _, action = spec.lower().partition(":")
+            bit = self.resource_bits.get((resource, action))
+            if bit is None:
+                raise ValueError(f"Unknown permission: {spec}")
+            return bit
+        try:
+            return PERMISSION_BITS[Permission(spec.lower())]
+        except ValueError:
+            raise ValueError(f"Unknown permission: {spec}")
     
     def _initialize_role_permissions(self) -> Dict[Role, Set[Permission]]:
         """Initialize role-permission mappings."""
@@ -134,12 +235,11 @@ class RBACManager:
     
     def has_permission(self, role: str, permission: Permission) -> bool:
         """Check if a role has a specific permission."""
-        try:
-            user_role = Role(role.lower())
-            return permission in self.role_permissions.get(user_role, set())
-        except ValueError:
-            logger.warning(f"Unknown role: {role}")
-            return False
+        return bool(self.role_mask(role) & PERMISSION_BITS[permission])
+    
+    def has_permissions(self, role: str, required_mask: int) -> bool:
+        """Check if a role has every permission in a compiled mask."""
+        return self.role_mask(role) & required_mask == required_mask
     
     def get_role_permissions(self, role: str) -> Set[Permission]:
         """Get all permissions for a role."""
@@ -152,93 +252,140 @@ class RBACManager:
     
     def can_access_resource(self, user_role: str, resource: str, action: str) -> bool:
         """Check if a user can perform an action on a resource."""
-        permission_map = {
-            "users": {
-                "create": Permission.CREATE_USER,
-                "read": Permission.READ_USER,
-                "update": Permission.UPDATE_USER,
-                "delete": Permission.DELETE_USER
-            },
-            "dashboard": {
-                "view": Permission.VIEW_DASHBOARD
-            },
-            "sales": {
-                "view": Permission.VIEW_SALES,
-                "manage": Permission.MANAGE_SALES
-            },
-            "finance": {
-                "view": Permission.VIEW_FINANCE,
-                "manage": Permission.MANAGE_FINANCE
-            },
-            "hr": {
-                "view": Permission.VIEW_HR,
-                "manage": Permission.MANAGE_HR
-            },
-            "products": {
-                "view": Permission.VIEW_PRODUCTS,
-                "manage": Permission.MANAGE_PRODUCTS
-            },
-            "risk": {
-                "view": Permission.VIEW_RISK,
-                "manage": Permission.MANAGE_RISK
-            },
-            "reports": {
-                "view": Permission.VIEW_REPORTS,
-                "create": Permission.CREATE_REPORTS,
-                "manage": Permission.MANAGE_REPORTS
-            },
-            "ai": {
-                "chat": Permission.USE_AI_CHAT,
-                "analytics": Permission.VIEW_AI_ANALYTICS
-            }
-        }
-        
-        resource_permissions = permission_map.get(resource.lower())
-        if not resource_permissions:
-            return False
-        
-        required_permission = resource_permissions.get(action.lower())
-        if not required_permission:
-            return False
-        
-        return self.has_permission(user_role, required_permission)
+        bit = self.resource_bits.get((resource, action))
+        if bit is None:
+            bit = self.resource_bits.get((resource.lower(), action.lower()))
+            if bit is None:
+                return False
+        return bool(self.role_mask(user_role) & bit)
 
 
 # Global RBAC manager instance
 rbac_manager = RBACManager()
 
+# Global tenant role store (built-in roles resolve without loading anything)
+tenant_roles = TenantRoleStore(
+    rbac_manager.role_masks,
+    {permission.value: bit for permission, bit in PERMISSION_BITS.items()},
+    create_role_loader()
+)
 
-def require_permission(permission: Permission):
-    """Decorator to require specific permission."""
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=tenant_roles._reset_after_fork)
+
+
+def _authenticated_user(request: Request) -> dict:
+    """User already verified for this request, or 401.
+    
+    Reuses request.state.user from AuthenticationMiddleware, then the
+    gateway's signed internal claims, and only then decodes the JWT.
+    """
+    user = getattr(request.state, "user", None)
+    if user:
+        return user
+    
+    user = internal_claims_handler.verify(request.headers.get(INTERNAL_CLAIMS_HEADER))
+    if user is None:
+        authorization = request.headers.get("Authorization", "")
+        if authorization.startswith("Bearer "):
+            user = get_current_user_from_token(authorization[7:])
+    
+    if not user or not user.get("id"):
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail={"error": "Not authenticated", "message": "Valid authorization token required"},
+            headers={"WWW-Authenticate": "Bearer"}
+        )
+    request.state.user = user
+    return user
+
+
+def requires(*permissions: Union[str, Permission], any_of: bool = False) -> Callable:
+    """FastAPI dependency requiring permissions, e.g. Depends(requires("sales:manage")).
+    
+    Permission names are resolved to a bitmask when the route is
+    declared, so a typo fails at startup and each request costs one AND.
+    Returns the authenticated user.
+    """
+    required_mask = 0
+    for permission in permissions:
+        required_mask |= rbac_manager.permission_bit(permission)
+    names = ", ".join(p.value if isinstance(p, Permission) else p for p in permissions)
+    
+    async def dependency(request: Request) -> dict:
+        user = _authenticated_user(request)
+        granted = await tenant_roles.role_mask_async(
+            user.get("tenant_id"), user.get("role"), user.get("roles_version")
+        ) & required_mask
+        if not (granted if any_of else granted == required_mask):
+            raise HTTPException(
+                status_code=status.HTTP_403_FORBIDDEN,
+                detail={"error": "Insufficient permissions", "message": f"Permission required: {names}"}
+            )
+        return user
+    
+    return dependency
+
+
+def requires_role(*roles: Union[str, Role]) -> Callable:
+    """FastAPI dependency requiring one of the given roles."""
+    allowed = frozenset(role.value if isinstance(role, Role) else role.lower() for role in roles)
+    
+    async def dependency(request: Request) -> dict:
+        user = _authenticated_user(request)
+        role = user.get("role")
+        if role not in allowed and (not isinstance(role, str) or role.lower() not in allowed):
+            raise HTTPException(
+                status_code=status.HTTP_403_FORBIDDEN,
+                detail={"error": "Insufficient permissions", "message": f"Role required: {', '.join(sorted(allowed))}"}
+            )
+        return user
+    
+    return dependency
+
+
+def _check_permission(user: Optional[dict], permission: Permission) -> None:
+    if not user:
+        raise PermissionError("Authentication required")
+    mask = tenant_roles.role_mask(user.get('tenant_id'), user.get('role'), user.get('roles_version'))
+    if not mask & PERMISSION_BITS[permission]:
+        raise PermissionError(f"Permission {permission.value} required")
+
+
+def _check_role(user: Optional[dict], role: Role) -> None:
+    if not user:
+        raise PermissionError("Authentication required")
+    if (user.get('role') or "").lower() != role.value:
+        raise PermissionError(f"Role {role.value} required")
+
+
+def _guard(check: Callable[[Optional[dict]], None]):
+    """Wrap sync or async functions that receive current_user as a keyword argument."""
     def decorator(func):
+        if asyncio.iscoroutinefunction(func):
+            @wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                user = kwargs.get('current_user')
+                if user:
+                    # Load tenant roles off the event loop so the check below hits the cache
+                    await tenant_roles.role_mask_async(user.get('tenant_id'), user.get('role'), user.get('roles_version'))
+                check(user)
+                return await func(*args, **kwargs)
+            return async_wrapper
+        
         @wraps(func)
         def wrapper(*args, **kwargs):
-            # This would be implemented with FastAPI dependency injection
-            # For now, it's a placeholder
-            user = kwargs.get('current_user')
-            if not user:
-                raise PermissionError("Authentication required")
-            
-            if not rbac_manager.has_permission(user.get('role'), permission):
-                raise PermissionError(f"Permission {permission.value} required")
-            
+            check(kwargs.get('current_user'))
             return func(*args, **kwargs)
         return wrapper
     return decorator
 
 
+def require_permission(permission: Permission):
+    """Decorator to require specific permission (prefer Depends(requires(...)) on routes)."""
+    return _guard(lambda user: _check_permission(user, permission))
+
+
 def require_role(role: Role):
-    """Decorator to require specific role."""
-    def decorator(func):
-        @wraps(func)
-        def wrapper(*args, **kwargs):
-            user = kwargs.get('current_user')
-            if not user:
-                raise PermissionError("Authentication required")
-            
-            if user.get('role').lower() != role.value:
-                raise PermissionError(f"Role {role.value} required")
-            
-            return func(*args, **kwargs)
-        return wrapper
-    return decorator
\ No newline at end of file
+    """Decorator to require specific role (prefer Depends(requires_role(...)) on routes)."""
+    return _guard(lambda user: _check_role(user, role))
@@ -0,0 +1,321 @@
+"""
+In-memory token revocation list, synchronized incrementally across instances.
+"""
+
+import atexit
+import bisect
+import json
+import os
+import threading
+import time
+import urllib.parse
+import urllib.request
+from abc import ABC, abstractmethod
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Revocation configuration. "memory" keeps revocations in this process only,
+# so it suits a single-worker auth service whose other services poll it with
+# "http"; a multi-worker auth service needs "db", and every service other
+# than the auth service needs "http" (check_revocation_feed enforces both)
+REVOCATION_FEED = os.getenv("REVOCATION_FEED", "memory").lower()  # "memory", "db" or "http"
+REVOCATION_FEED_URL = os.getenv("REVOCATION_FEED_URL", "")  # e.g. http://auth-service:8000/internal/revocations
+REVOCATION_POLL_SECONDS = float(os.getenv("REVOCATION_POLL_SECONDS", "2"))
+REVOCATION_FEED_OVERLAP = int(os.getenv("REVOCATION_FEED_OVERLAP", "64"))
+REVOCATION_FEED_BATCH_SIZE = int(os.getenv("REVOCATION_FEED_BATCH_SIZE", "5000"))
+REVOCATION_FEED_TIMEOUT_SECONDS = float(os.getenv("REVOCATION_FEED_TIMEOUT_SECONDS", "2"))
+
+# (sequence, token or session ID, expiry as a UNIX timestamp)
+RevocationEntry = Tuple[int, str, float]
+
+
+class RevocationFeed(ABC):
+    """Shared, ordered log of revocations."""
+    
+    @abstractmethod
+    def fetch(self, since: int, limit: int) -> List[RevocationEntry]:
+        """Entries with a sequence number above since, oldest first."""
+    
+    @abstractmethod
+    def publish(self, token_id: str, expires_at: float) -> Optional[int]:
+        """Append a revocation and return its sequence number."""
+
+
+class DatabaseRevocationFeed(RevocationFeed):
+    """Revocations stored in the revoked_tokens table (auth service)."""
+    
+    def fetch(self, since: int, limit: int) -> List[RevocationEntry]:
+        # Imported lazily so token verification does not depend on the database layer
+        from ..database.base import SessionLocal
+        from ..database.models import RevokedToken
+        
+        db = SessionLocal()
+        try:
+            rows = (
+                db.query(RevokedToken.seq, RevokedToken.token_id, RevokedToken.expires_at)
+                .filter(RevokedToken.seq > since, RevokedToken.expires_at > datetime.utcnow())
+                .order_by(RevokedToken.seq)
+                .limit(limit)
+                .all()
+            )
+        finally:
+            db.close()
+        return [(seq, token_id, _timestamp(expires_at)) for seq, token_id, expires_at in rows]
+    
+    def publish(self, token_id: str, expires_at: float) -> Optional[int]:
+        from ..database.base import SessionLocal
+        from ..database.models import RevokedToken
+        
+        db = SessionLocal()
+        try:
+            row = RevokedToken(token_id=token_id, expires_at=datetime.utcfromtimestamp(expires_at))
+            db.add(row)
+            db.commit()
+            return row.seq
+        finally:
+            db.close()
+
+
+class HttpRevocationFeed(RevocationFeed):
+    """Revocations read from the auth service's /internal/revocations feed."""
+    
+    def __init__(self, url: str = REVOCATION_FEED_URL, timeout: float = REVOCATION_FEED_TIMEOUT_SECONDS):
+        self.url = url
+        self.timeout = timeout
+    
+    def fetch(self, since: int, limit: int) -> List[RevocationEntry]:
+        query = urllib.parse.urlencode({"since": since, "limit": limit})
+        with urllib.request.urlopen(f"{self.url}?{query}", timeout=self.timeout) as response:
+            document = json.loads(response.read())
+        return [(int(seq), token_id, float(expires_at)) for seq, token_id, expires_at in document["entries"]]
+    
+    def publish(self, token_id: str, expires_at: float) -> Optional[int]:
+        raise RuntimeError(
+            "HttpRevocationFeed is read-only: revoke tokens through the auth service, "
+            "which publishes them to the shared revocation feed"
+        )
+
+
+def _timestamp(value: datetime) -> float:
+    """UNIX timestamp of a naive UTC datetime."""
+    return (value - datetime(1970, 1, 1)).total_seconds()
+
+
+class TokenRevocationList:
+    """Revoked token (jti) and session (sid) IDs, each kept until it expires.
+    
+    Checks are a dict lookup against a snapshot that is replaced, never
+    mutated, so token verification takes no lock and never touches the
+    database. With a feed configured, a background thread pulls new
+    entries incrementally by sequence number; each poll overlaps the
+    last few sequences so rows committed out of order are not missed.
+    Without one, revocations are numbered locally (microseconds since
+    the epoch, so a restarted process stays ahead of its pollers'
+    cursors) and served to other services by changes_since().
+    """
+    
+    def __init__(self, feed: Optional[RevocationFeed] = None,
+                 poll_seconds: float = REVOCATION_POLL_SECONDS,
+                 overlap: int = REVOCATION_FEED_OVERLAP,
+                 batch_size: int = REVOCATION_FEED_BATCH_SIZE):
+        self.feed = feed
+        self.poll_seconds = poll_seconds
+        self.overlap = overlap
+        self.batch_size = batch_size
+        
+        self._lock = threading.Lock()
+        self._revoked: Dict[str, float] = {}
+        self._entries: List[RevocationEntry] = []  # sorted by sequence, for serving the feed
+        self._sequences: List[int] = []
+        self._cursor = 0
+        self._last_local_seq = 0
+        self._next_purge = 0.0
+        
+        self._thread: Optional[threading.Thread] = None
+        self._wakeup = threading.Event()
+        self._stopped = False
+        
+        # Counters (diagnostic only)
+        self.polls = 0
+        self.poll_failures = 0
+        self.rejected = 0
+    
+    def is_revoked(self, claims: Dict[str, Any]) -> bool:
+        """Whether a verified token's jti or sid has been revoked."""
+        if self._thread is None and self.feed is not None:
+            self._ensure_started()
+        
+        revoked = self._revoked
+        if not revoked:
+            return False
+        if claims.get("jti") in revoked or claims.get("sid") in revoked:
+            self.rejected += 1
+            return True
+        return False
+    
+    def _add(self, entries: List[RevocationEntry]) -> int:
+        """Merge entries into the snapshot; returns how many were new."""
+        now = time.time()
+        with self._lock:
+            added: Dict[str, float] = {}
+            for entry in entries:
+                seq, token_id, expires_at = entry
+                if expires_at <= now:
+                    continue
+                if seq is None:
+                    # Memory mode: numbered under the lock so pollers never see a gap filled later
+                    seq = self._last_local_seq = max(self._last_local_seq + 1, int(now * 1_000_000))
+                    entry = (seq, token_id, expires_at)
+                if seq:
+                    index = bisect.bisect_left(self._sequences, seq)
+                    if index == len(self._sequences) or self._sequences[index] != seq:
+                        self._sequences.insert(index, seq)
+                        self._entries.insert(index, entry)
+                    self._cursor = max(self._cursor, seq)
+                if token_id not in self._revoked:
+                    added[token_id] = expires_at
+            if added:
+                self._revoked = {**self._revoked, **added}
+            return len(added)
+    
+    def revoke(self, token_id: str, expires_at: float) -> None:
+        """Revoke a token or session ID until expires_at (UNIX time).
+        
+        Takes effect on this instance immediately; other instances pick it
+        up on their next poll.
+        """
+        if self.feed is not None:
+            self._add([(self.feed.publish(token_id, expires_at) or 0, token_id, expires_at)])
+        else:
+            self._add([(None, token_id, expires_at)])
+    
+    def changes_since(self, since: int, limit: int = REVOCATION_FEED_BATCH_SIZE) -> List[RevocationEntry]:
+        """Unexpired entries after a sequence number (serves the HTTP feed)."""
+        if self._thread is None and self.feed is not None:
+            self._ensure_started()
+        now = time.time()
+        with self._lock:
+            start = bisect.bisect_right(self._sequences, since)
+            entries = self._entries[start:start + limit]
+        return [entry for entry in entries if entry[2] > now]
+    
+    def poll(self) -> int:
+        """Pull new entries from the feed; returns how many were new."""
+        if self.feed is None:
+            return 0
+        added = 0
+        try:
+            since = max(0, self._cursor - self.overlap)
+            while True:
+                entries = self.feed.fetch(since, self.batch_size)
+                added += self._add(entries)
+                if len(entries) < self.batch_size:
+                    break
+                since = entries[-1][0]
+            self.polls += 1
+        except Exception as e:
+            # Keep serving the current snapshot; the next poll catches up
+            self.poll_failures += 1
+            logger.warning(f"Failed to poll token revocations: {e}")
+        return added
+    
+    def purge_expired(self) -> int:
+        """Drop entries whose tokens have expired anyway."""
+        now = time.time()
+        with self._lock:
+            revoked = {token_id: expires_at for token_id, expires_at in self._revoked.items() if expires_at > now}
+            purged = len(self._revoked) - len(revoked)
+            if purged:
+                self._revoked = revoked
+                self._entries = [entry for entry in self._entries if entry[2] > now]
+                self._sequences = [entry[0] for entry in self._entries]
+        return purged
+    
+    def _ensure_started(self) -> None:
+        """Start the poll thread on first use."""
+        with self._lock:
+            if not self._stopped and (self._thread is None or not self._thread.is_alive()):
+                self._thread = threading.Thread(
+                    target=self._run, name="aems-revocation-poller", daemon=True
+                )
+                self._thread.start()
+    
+    def _run(self) -> None:
+        """Poll the feed and purge expired entries until stopped."""
+        while not self._stopped:
+            self.poll()
+            if time.time() >= self._next_purge:
+                self.purge_expired()
+                self._next_purge = time.time() + 60
+            self._wakeup.wait(self.poll_seconds)
+            self._wakeup.clear()
+    
+    def shutdown(self, timeout: float = 1.0) -> None:
+        """Stop the poll thread."""
+        self._stopped = True
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+    
+    def _reset_after_fork(self) -> None:
+        """Forget the poll thread in a forked child; it restarts on use."""
+        self._lock = threading.Lock()
+        self._thread = None
+        self._wakeup = threading.Event()
+    
+    def stats(self) -> Dict[str, int]:
+        """Get revocation counters."""
+        return {
+            "revoked": len(self._revoked),
+            "cursor": self._cursor,
+            "polls": self.polls,
+            "poll_failures": self.poll_failures,
+            "rejected": self.rejected
+        }
+
+
+def _create_feed(name: str = REVOCATION_FEED) -> Optional[RevocationFeed]:
+    """Build the revocation feed selected by configuration."""
+    if name == "memory":
+        return None
+    if name == "db":
+        return DatabaseRevocationFeed()
+    if name == "http":
+        return HttpRevocationFeed()
+    raise ValueError(f"Unknown revocation feed: {name}")
+
+
+def check_revocation_feed(issuer: bool, name: str = REVOCATION_FEED) -> None:
+    """Refuse to start where the configured feed cannot propagate revocations.
+    
+    issuer is True for the auth service, which records revocations and
+    so cannot use the read-only http feed; any other service only
+    learns about them from a db or http feed. Memory
+    mode is per process, so it is refused when WEB_CONCURRENCY (the
+    worker count read by uvicorn and gunicorn) is above one.
+    """
+    if issuer and name == "http":
+        raise RuntimeError("REVOCATION_FEED=http is read-only; the auth service needs REVOCATION_FEED=memory or db")
+    if name != "memory":
+        return
+    if not issuer:
+        raise RuntimeError(
+            "REVOCATION_FEED=memory never receives the auth service's revocations; "
+            "set REVOCATION_FEED=http and REVOCATION_FEED_URL to its /internal/revocations endpoint"
+        )
+    if int(os.getenv("WEB_CONCURRENCY", "1")) > 1:
+        raise RuntimeError(
+            "REVOCATION_FEED=memory only revokes tokens in the worker that handled the request; "
+            "set REVOCATION_FEED=db when running more than one worker"
+        )
+
+
+# Global token revocation list
+token_revocations = TokenRevocationList(_create_feed())
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=token_revocations._reset_after_fork)
+atexit.register(token_revocations.shutdown)
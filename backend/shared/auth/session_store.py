@@ -0,0 +1,503 @@
+"""
+User sessions served from an in-memory LRU, with write-behind to the sessions table.
+"""
+
+import atexit
+import hashlib
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+import logging
+
+from starlette.concurrency import run_in_threadpool
+
+logger = logging.getLogger(__name__)
+
+# Session store configuration
+SESSION_STORE_ENABLED = os.getenv("SESSION_STORE_ENABLED", "true").lower() == "true"
+SESSION_CACHE_SIZE = int(os.getenv("SESSION_CACHE_SIZE", "100000"))
+SESSION_CACHE_TTL_SECONDS = float(os.getenv("SESSION_CACHE_TTL_SECONDS", "30"))  # re-read from the DB after
+SESSION_NEGATIVE_TTL_SECONDS = float(os.getenv("SESSION_NEGATIVE_TTL_SECONDS", "5"))
+SESSION_IDLE_TIMEOUT_SECONDS = int(os.getenv("SESSION_IDLE_TIMEOUT_SECONDS", "1800"))
+SESSION_TOUCH_GRANULARITY_SECONDS = int(os.getenv("SESSION_TOUCH_GRANULARITY_SECONDS", "60"))
+SESSION_FLUSH_SECONDS = float(os.getenv("SESSION_FLUSH_SECONDS", "5"))
+SESSION_PURGE_INTERVAL_SECONDS = float(os.getenv("SESSION_PURGE_INTERVAL_SECONDS", "300"))
+SESSION_PURGE_BATCH_SIZE = int(os.getenv("SESSION_PURGE_BATCH_SIZE", "1000"))
+
+
+def session_token_hash(token: str) -> str:
+    """SHA-256 hex of a session token; only the hash is stored or cached."""
+    return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+
+def is_session_id(sid) -> bool:
+    """Whether a token's sid names a stored session (older tokens carry a random sid)."""
+    if not isinstance(sid, str) or len(sid) != 36:
+        return False
+    try:
+        uuid.UUID(sid)
+    except ValueError:
+        return False
+    return True
+
+
+def _timestamp(value: datetime) -> float:
+    """UNIX timestamp of a naive UTC datetime."""
+    return (value - datetime(1970, 1, 1)).total_seconds()
+
+
+class CachedSession:
+    """An active session as held in memory."""
+    
+    __slots__ = ("id", "user_id", "token_hash", "expires_at", "device_info", "ip_address",
+                 "created_at", "checked_at")
+    
+    def __init__(self, id: str, user_id: str, token_hash: str, expires_at: float,
+                 device_info: Optional[str] = None, ip_address: Optional[str] = None,
+                 created_at: Optional[float] = None):
+        self.id = id
+        self.user_id = user_id
+        self.token_hash = token_hash
+        self.expires_at = expires_at  # UNIX time, slides forward on use
+        self.device_info = device_info
+        self.ip_address = ip_address
+        self.created_at = created_at
+        self.checked_at = time.monotonic()  # last read from the DB
+    
+    @classmethod
+    def from_row(cls, row) -> "CachedSession":
+        return cls(
+            str(row.id), str(row.user_id), row.session_token, _timestamp(row.expires_at),
+            row.device_info, row.ip_address, _timestamp(row.created_at) if row.created_at else None
+        )
+    
+    def to_dict(self) -> Dict[str, object]:
+        """Public view for session listings (no token hash)."""
+        return {
+            "id": self.id,
+            "expires_at": datetime.utcfromtimestamp(self.expires_at).isoformat(),
+            "created_at": datetime.utcfromtimestamp(self.created_at).isoformat() if self.created_at else None,
+            "device_info": self.device_info,
+            "ip_address": self.ip_address
+        }
+
+
+# Negative cache entry: (marker, monotonic expiry)
+_MISSING = object()
+
+
+class SessionStore:
+    """Session validation served from memory for almost every request.
+    
+    Active sessions sit in a bounded LRU keyed by token hash. A hit is
+    re-read from the database only after SESSION_CACHE_TTL_SECONDS, so
+    revocations on other instances apply within that window. Sliding
+    expiry is extended in memory, at most once per touch granularity,
+    and the latest expiry per session is written back in one batch
+    every SESSION_FLUSH_SECONDS. Expired rows are purged in small
+    primary-key batches found through the expires_at index.
+    """
+    
+    def __init__(self, max_entries: int = SESSION_CACHE_SIZE,
+                 ttl_seconds: float = SESSION_CACHE_TTL_SECONDS,
+                 idle_timeout: int = SESSION_IDLE_TIMEOUT_SECONDS,
+                 touch_granularity: int = SESSION_TOUCH_GRANULARITY_SECONDS,
+                 flush_seconds: float = SESSION_FLUSH_SECONDS,
+                 purge_interval: float = SESSION_PURGE_INTERVAL_SECONDS,
+                 purge_batch_size: int = SESSION_PURGE_BATCH_SIZE):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.idle_timeout = idle_timeout
+        self.touch_granularity = touch_granularity
+        self.flush_seconds = flush_seconds
+        self.purge_interval = purge_interval
+        self.purge_batch_size = purge_batch_size
+        
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, object]" = OrderedDict()  # token hash -> CachedSession or (_MISSING, expiry)
+        self._user_sessions: "OrderedDict[str, Tuple[float, List[str]]]" = OrderedDict()  # user ID -> (checked, hashes)
+        self._dirty: Dict[str, float] = {}  # token hash -> latest expiry to write back
+        self._next_purge = 0.0
+        
+        self._thread: Optional[threading.Thread] = None
+        self._wakeup = threading.Event()
+        self._stopped = False
+        
+        # Counters (diagnostic only)
+        self.hits = 0
+        self.misses = 0
+        self.flushed = 0
+        self.flush_failures = 0
+        self.purged = 0
+    
+    def _db(self):
+        # Imported lazily so the store does not depend on the database layer at import
+        from ..database.base import SessionLocal
+        return SessionLocal()
+    
+    def _put(self, entry: CachedSession) -> None:
+        """Insert or refresh a cache entry (lock held)."""
+        self._entries[entry.token_hash] = entry
+        self._entries.move_to_end(entry.token_hash)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+    
+    def create(self, user_id, expires_in: Optional[int] = None, device_info: Optional[str] = None,
+               ip_address: Optional[str] = None) -> CachedSession:
+        """Start a session; its ID is the sid claim of the tokens issued for it.
+        
+        The row stores only a hash of the ID, and expires_in should cover
+        the refresh token so an idle session lasts as long as it does.
+        """
+        from ..database.models import Session
+        
+        session_id = str(uuid.uuid4())
+        token_hash = session_token_hash(session_id)
+        expires_at = time.time() + (expires_in or self.idle_timeout)
+        
+        entry = CachedSession(
+            session_id, str(user_id), token_hash, expires_at, device_info, ip_address, time.time()
+        )
+        db = self._db()
+        try:
+            db.add(Session(
+                id=uuid.UUID(entry.id), user_id=uuid.UUID(entry.user_id), session_token=token_hash,
+                expires_at=datetime.utcfromtimestamp(expires_at), is_active=True,
+                device_info=device_info, ip_address=ip_address
+            ))
+            db.commit()
+        finally:
+            db.close()
+        
+        with self._lock:
+            self._put(entry)
+            listing = self._user_sessions.get(entry.user_id)
+            if listing is not None:
+                self._user_sessions[entry.user_id] = (listing[0], listing[1] + [token_hash])
+        self._ensure_started()
+        return entry
+    
+    def validate(self, session_id: str) -> Optional[CachedSession]:
+        """The active session with an ID, sliding its expiry forward; None if invalid."""
+        token_hash = session_token_hash(session_id)
+        now = time.time()
+        monotonic = time.monotonic()
+        
+        entry = self._entries.get(token_hash)
+        if entry is not None:
+            if type(entry) is tuple:
+                if entry[1] > monotonic:
+                    self.hits += 1
+                    return None
+                entry = None
+            elif monotonic - entry.checked_at > self.ttl_seconds:
+                entry = None
+        
+        if entry is None:
+            self.misses += 1
+            entry = self._load(token_hash)
+            if entry is None:
+                with self._lock:
+                    self._entries[token_hash] = (_MISSING, monotonic + SESSION_NEGATIVE_TTL_SECONDS)
+                    while len(self._entries) > self.max_entries:
+                        self._entries.popitem(last=False)
+                return None
+        else:
+            self.hits += 1
+        
+        if entry.expires_at <= now:
+            self._forget(token_hash)
+            return None
+        
+        # Slide expiry; coalesced so a busy session is written back once per flush
+        expires_at = now + self.idle_timeout
+        if expires_at - entry.expires_at >= self.touch_granularity:
+            entry.expires_at = expires_at
+            with self._lock:
+                self._dirty[token_hash] = expires_at
+                self._entries.move_to_end(token_hash)
+            if self._thread is None:
+                self._ensure_started()
+        return entry
+    
+    async def validate_async(self, session_id: str) -> Optional[CachedSession]:
+        """validate() for request handlers: cache hits run inline, DB reads in the threadpool."""
+        entry = self._entries.get(session_token_hash(session_id))
+        if isinstance(entry, CachedSession) and time.monotonic() - entry.checked_at <= self.ttl_seconds:
+            return self.validate(session_id)
+        return await run_in_threadpool(self.validate, session_id)
+    
+    def _load(self, token_hash: str) -> Optional[CachedSession]:
+        """Read an active session from the DB and cache it."""
+        from ..database.models import Session
+        
+        db = self._db()
+        try:
+            row = (
+                db.query(Session)
+                .filter(Session.session_token == token_hash, Session.is_active.is_(True))
+                .first()
+            )
+            entry = CachedSession.from_row(row) if row is not None else None
+        finally:
+            db.close()
+        if entry is None:
+            return None
+        
+        with self._lock:
+            # An unflushed touch is newer than the row
+            entry.expires_at = max(entry.expires_at, self._dirty.get(token_hash, 0.0))
+            self._put(entry)
+        return entry
+    
+    def _forget(self, token_hash: str) -> None:
+        with self._lock:
+            entry = self._entries.pop(token_hash, None)
+            self._dirty.pop(token_hash, None)
+            if isinstance(entry, CachedSession):
+                self._user_sessions.pop(entry.user_id, None)
+    
+    def revoke(self, session_id: str) -> bool:
+        """End one session."""
+        return self._deactivate(token_hash=session_token_hash(session_id)) > 0
+    
+    def revoke_session(self, user_id, session_id) -> bool:
+        """End one of a user's sessions by its ID (e.g. from a session listing)."""
+        try:
+            session_id = uuid.UUID(str(session_id))
+        except ValueError:
+            return False
+        return self._deactivate(user_id=user_id, session_id=session_id) > 0
+    
+    def revoke_user(self, user_id) -> int:
+        """End all of a user's sessions; returns how many were active."""
+        return self._deactivate(user_id=user_id)
+    
+    def _deactivate(self, token_hash: Optional[str] = None, user_id=None, session_id=None) -> int:
+        """Mark matching sessions inactive and revoke their tokens everywhere.
+        
+        Each session ID goes on the token revocation list, so access and
+        refresh tokens carrying it as sid are rejected by every service,
+        not just session validation here.
+        """
+        from ..database.models import Session
+        from .jwt_handler import jwt_handler
+        from .revocation import token_revocations
+        
+        db = self._db()
+        try:
+            query = db.query(Session).filter(Session.is_active.is_(True))
+            if token_hash is not None:
+                query = query.filter(Session.session_token == token_hash)
+            if user_id is not None:
+                query = query.filter(Session.user_id == uuid.UUID(str(user_id)))
+            if session_id is not None:
+                query = query.filter(Session.id == uuid.UUID(str(session_id)))
+            rows = query.with_entities(Session.id, Session.session_token).all()
+            hashes = [token_hash for _, token_hash in rows]
+            if hashes:
+                db.query(Session).filter(Session.session_token.in_(hashes)).update(
+                    {Session.is_active: False}, synchronize_session=False
+                )
+                db.commit()
+        finally:
+            db.close()
+        
+        # Outlive any refresh token issued for the session
+        revoked_until = time.time() + jwt_handler.refresh_token_expire * 86400
+        for revoked_id, _ in rows:
+            token_revocations.revoke(str(revoked_id), revoked_until)
+        
+        with self._lock:
+            for revoked in hashes:
+                entry = self._entries.pop(revoked, None)
+                self._dirty.pop(revoked, None)
+                if isinstance(entry, CachedSession):
+                    self._user_sessions.pop(entry.user_id, None)
+            if user_id is not None:
+                self._user_sessions.pop(str(user_id), None)
+        return len(hashes)
+    
+    def list_user_sessions(self, user_id) -> List[CachedSession]:
+        """A user's active sessions, from the cache when the listing is fresh."""
+        user_id = str(user_id)
+        now = time.time()
+        listing = self._user_sessions.get(user_id)
+        if listing is not None and time.monotonic() - listing[0] <= self.ttl_seconds:
+            entries = [self._entries.get(token_hash) for token_hash in listing[1]]
+            if all(isinstance(entry, CachedSession) for entry in entries):
+                self.hits += 1
+                return [entry for entry in entries if entry.expires_at > now]
+        
+        self.misses += 1
+        from ..database.models import Session
+        
+        db = self._db()
+        try:
+            rows = (
+                db.query(Session)
+                .filter(
+                    Session.user_id == uuid.UUID(user_id),
+                    Session.is_active.is_(True),
+                    Session.expires_at > datetime.utcfromtimestamp(now)
+                )
+                .all()
+            )
+            loaded = [CachedSession.from_row(row) for row in rows]
+        finally:
+            db.close()
+        
+        with self._lock:
+            entries = []
+            for entry in loaded:
+                cached = self._entries.get(entry.token_hash)
+                if isinstance(cached, CachedSession):
+                    entry = cached  # keeps an unflushed sliding expiry
+                else:
+                    self._put(entry)
+                entries.append(entry)
+            self._user_sessions[user_id] = (time.monotonic(), [entry.token_hash for entry in entries])
+            self._user_sessions.move_to_end(user_id)
+            while len(self._user_sessions) > self.max_entries:
+                self._user_sessions.popitem(last=False)
+        return entries
+    
+    def flush(self) -> int:
+        """Write pending sliding-expiry updates to the sessions table in one batch."""
+        with self._lock:
+            dirty = self._dirty
+            self._dirty = {}
+        if not dirty:
+            return 0
+        
+        from sqlalchemy import bindparam, update
+        from ..database.models import Session
+        
+        sessions = Session.__table__
+        # Never move an expiry backwards (another instance may have extended it further)
+        statement = (
+            update(sessions)
+            .where(sessions.c.session_token == bindparam("match_token"))
+            .where(sessions.c.expires_at < bindparam("new_expiry"))
+            .where(sessions.c.is_active.is_(True))
+            .values(expires_at=bindparam("new_expiry"))
+        )
+        rows = [
+            {"match_token": token_hash, "new_expiry": datetime.utcfromtimestamp(expires_at)}
+            for token_hash, expires_at in dirty.items()
+        ]
+        
+        db = self._db()
+        try:
+            db.execute(statement, rows)
+            db.commit()
+            self.flushed += len(rows)
+        except Exception as e:
+            db.rollback()
+            self.flush_failures += len(rows)
+            logger.error(f"Failed to write back session expiry: {e}")
+            # Retry with the next flush unless a newer touch arrived
+            with self._lock:
+                for token_hash, expires_at in dirty.items():
+                    self._dirty.setdefault(token_hash, expires_at)
+        finally:
+            db.close()
+        return len(rows)
+    
+    def purge_expired(self) -> int:
+        """Delete expired sessions in small batches; returns rows deleted.
+        
+        Each batch is a range scan on the expires_at index followed by a
+        primary-key delete, so no statement holds locks on a large range.
+        """
+        from ..database.models import Session
+        
+        cutoff = datetime.utcnow()
+        deleted = 0
+        db = self._db()
+        try:
+            while True:
+                ids = [
+                    session_id for (session_id,) in (
+                        db.query(Session.id)
+                        .filter(Session.expires_at < cutoff)
+                        .order_by(Session.expires_at)
+                        .limit(self.purge_batch_size)
+                    )
+                ]
+                if ids:
+                    db.query(Session).filter(Session.id.in_(ids)).delete(synchronize_session=False)
+                    db.commit()
+                    deleted += len(ids)
+                if len(ids) < self.purge_batch_size or self._stopped:
+                    break
+        except Exception as e:
+            db.rollback()
+            logger.error(f"Failed to purge expired sessions: {e}")
+        finally:
+            db.close()
+        
+        self.purged += deleted
+        return deleted
+    
+    def _ensure_started(self) -> None:
+        """Start the flush and purge thread on first use."""
+        with self._lock:
+            if not self._stopped and (self._thread is None or not self._thread.is_alive()):
+                self._thread = threading.Thread(
+                    target=self._run, name="aems-session-store", daemon=True
+                )
+                self._thread.start()
+    
+    def _run(self) -> None:
+        """Flush touches and purge expired sessions until stopped."""
+        while not self._stopped:
+            self._wakeup.wait(self.flush_seconds)
+            self._wakeup.clear()
+            self.flush()
+            if time.time() >= self._next_purge:
+                self._next_purge = time.time() + self.purge_interval
+                self.purge_expired()
+    
+    def shutdown(self, timeout: float = 5.0) -> None:
+        """Stop the background thread and write pending touches."""
+        if self._stopped:
+            return
+        self._stopped = True
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        self.flush()
+    
+    def _reset_after_fork(self) -> None:
+        """Start fresh in a forked child; the thread does not survive fork."""
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._user_sessions = OrderedDict()
+        self._dirty = {}
+        self._thread = None
+        self._wakeup = threading.Event()
+    
+    def stats(self) -> Dict[str, int]:
+        """Get session store counters."""
+        return {
+            "cached": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "pending": len(self._dirty),
+            "flushed": self.flushed,
+            "flush_failures": self.flush_failures,
+            "purged": self.purged
+        }
+
+
+# Global session store
+session_store = SessionStore()
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=session_store._reset_after_fork)
+atexit.register(session_store.shutdown)
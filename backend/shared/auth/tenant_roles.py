@@ -0,0 +1,334 @@
+"""
+Tenant-defined custom roles, compiled to permission bitmasks and cached per process.
+"""
+
+import json
+import os
+import threading
+import time
+import uuid
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+import logging
+
+from starlette.concurrency import run_in_threadpool
+
+logger = logging.getLogger(__name__)
+
+# Tenant role configuration
+TENANT_ROLES_SOURCE = os.getenv("TENANT_ROLES_SOURCE", "db").lower()  # "db" or "none"
+TENANT_ROLES_MAX_AGE_SECONDS = float(os.getenv("TENANT_ROLES_MAX_AGE_SECONDS", "30"))
+TENANT_ROLES_RETRY_SECONDS = float(os.getenv("TENANT_ROLES_RETRY_SECONDS", "5"))
+TENANT_ROLES_CACHE_SIZE = int(os.getenv("TENANT_ROLES_CACHE_SIZE", "10000"))
+
+# Length of the TenantRole.name column
+ROLE_NAME_MAX_LENGTH = 50
+
+# Role name -> (permission values, inherited role names)
+RoleDefinitions = Dict[str, Tuple[List[str], List[str]]]
+
+
+def _tenant_uuid(tenant_id) -> uuid.UUID:
+    """Tenant ID from claims (a string) as a UUID column value."""
+    return tenant_id if isinstance(tenant_id, uuid.UUID) else uuid.UUID(str(tenant_id))
+
+
+class CompiledTenantRoles(NamedTuple):
+    """A tenant's custom roles as flattened bitmasks."""
+    
+    version: int
+    masks: Dict[str, int]
+    expires_at: float  # time.monotonic() deadline
+
+
+class DatabaseRoleLoader:
+    """Reads role definitions and the roles version from the tenant tables."""
+    
+    def load(self, tenant_id: str, db=None) -> Tuple[int, RoleDefinitions]:
+        """Current version and role definitions of a tenant."""
+        # Imported lazily so permission checks do not depend on the database layer
+        from ..database.base import SessionLocal
+        from ..database.models import Tenant, TenantRole
+        
+        tenant_id = _tenant_uuid(tenant_id)
+        session = db or SessionLocal()
+        try:
+            version = session.query(Tenant.roles_version).filter(Tenant.id == tenant_id).scalar() or 0
+            rows = (
+                session.query(TenantRole.name, TenantRole.permissions, TenantRole.inherits)
+                .filter(TenantRole.tenant_id == tenant_id, TenantRole.deleted_at.is_(None))
+                .all()
+            )
+        finally:
+            if db is None:
+                session.close()
+        return version, {name: (json.loads(permissions or "[]"), json.loads(inherits or "[]"))
+                         for name, permissions, inherits in rows}
+
+
+class TenantRoleStore:
+    """Per-process cache of compiled tenant roles.
+    
+    Each tenant's roles are loaded once, inheritance is flattened, and
+    every role becomes a single bitmask, so a custom role check costs the
+    same dict lookup and AND as a built-in one. An entry is reloaded when
+    a token carries a newer roles_version claim, when invalidate() is
+    called on a change notice, or after max_age as a backstop for tokens
+    issued before the change.
+    
+    Loads hold a per-tenant lock, so a slow load for one tenant never
+    delays checks for another; request handlers use role_mask_async(),
+    which runs the load in the threadpool instead of on the event loop.
+    """
+    
+    def __init__(self, builtin_masks: Dict[str, int], permission_bits: Dict[str, int],
+                 loader: Optional[DatabaseRoleLoader] = None,
+                 max_age: float = TENANT_ROLES_MAX_AGE_SECONDS,
+                 retry_seconds: float = TENANT_ROLES_RETRY_SECONDS,
+                 max_tenants: int = TENANT_ROLES_CACHE_SIZE):
+        self.builtin_masks = builtin_masks
+        self.permission_bits = permission_bits
+        self.loader = loader
+        self.max_age = max_age
+        self.retry_seconds = retry_seconds
+        self.max_tenants = max_tenants
+        
+        self._lock = threading.Lock()
+        self._tenants: Dict[str, CompiledTenantRoles] = {}
+        self._load_locks: Dict[str, threading.Lock] = {}
+        
+        # Counters (diagnostic only)
+        self.loads = 0
+        self.load_failures = 0
+    
+    def compile(self, definitions: RoleDefinitions, strict: bool = False) -> Dict[str, int]:
+        """Flatten inheritance and map each role to a bitmask.
+        
+        Strict mode (used when saving) raises ValueError on unknown
+        permissions, unknown parents, cycles and built-in name clashes;
+        otherwise the offending entry is logged and skipped.
+        """
+        def problem(message: str) -> None:
+            if strict:
+                raise ValueError(message)
+            logger.warning(f"Ignoring tenant role definition: {message}")
+        
+        masks: Dict[str, int] = {}
+        visiting = set()
+        
+        def resolve(name: str) -> int:
+            if name in self.builtin_masks:
+                return self.builtin_masks[name]
+            if name in masks:
+                return masks[name]
+            if name in visiting:
+                problem(f"Role inheritance cycle through {name!r}")
+                return 0
+            if name not in definitions:
+                problem(f"Unknown inherited role {name!r}")
+                return 0
+            
+            visiting.add(name)
+            permissions, inherits = definitions[name]
+            mask = 0
+            for permission in permissions:
+                bit = self.permission_bits.get(permission)
+                if bit is None:
+                    problem(f"Unknown permission {permission!r} in role {name!r}")
+                    continue
+                mask |= bit
+            for parent in inherits:
+                mask |= resolve(parent)
+            visiting.discard(name)
+            masks[name] = mask
+            return mask
+        
+        for name in definitions:
+            if name in self.builtin_masks:
+                problem(f"Role {name!r} shadows a built-in role")
+                continue
+            resolve(name)
+        return masks
+    
+    def role_mask(self, tenant_id: Optional[str], role: Optional[str], version: Optional[int] = None) -> int:
+        """Permission mask of a built-in or tenant role (0 if unknown)."""
+        mask = self.builtin_masks.get(role)
+        if mask is not None:
+            return mask
+        if not isinstance(role, str):
+            return 0
+        if not tenant_id or self.loader is None:
+            return self.builtin_masks.get(role.lower(), 0)
+        
+        compiled = self._cached(tenant_id, version)
+        if compiled is None:
+            compiled = self._refresh(tenant_id, version)
+        return self._tenant_mask(compiled, role)
+    
+    async def role_mask_async(self, tenant_id: Optional[str], role: Optional[str],
+                              version: Optional[int] = None) -> int:
+        """role_mask() for request handlers: cache hits run inline, loads in the threadpool."""
+        if role in self.builtin_masks or not isinstance(role, str) or not tenant_id or self.loader is None:
+            return self.role_mask(tenant_id, role, version)
+        
+        compiled = self._cached(tenant_id, version)
+        if compiled is None:
+            compiled = await run_in_threadpool(self._refresh, tenant_id, version)
+        return self._tenant_mask(compiled, role)
+    
+    def _cached(self, tenant_id: str, version: Optional[int] = None) -> Optional[CompiledTenantRoles]:
+        """Cached roles of a tenant, or None if missing, expired or older than version."""
+        compiled = self._tenants.get(tenant_id)
+        if compiled is None or (version or 0) > compiled.version or compiled.expires_at <= time.monotonic():
+            return None
+        return compiled
+    
+    def _tenant_mask(self, compiled: CompiledTenantRoles, role: str) -> int:
+        """Mask of a role within a tenant's compiled roles, falling back to built-ins."""
+        mask = compiled.masks.get(role)
+        if mask is None:
+            role = role.lower()
+            mask = self.builtin_masks.get(role)
+            if mask is None:
+                mask = compiled.masks.get(role, 0)
+        return mask
+    
+    def current_version(self, tenant_id: str) -> int:
+        """Roles version of a tenant, for stamping into issued tokens."""
+        compiled = self._tenants.get(tenant_id)
+        if compiled is None or compiled.expires_at <= time.monotonic():
+            compiled = self._refresh(tenant_id)
+        return compiled.version
+    
+    def _refresh(self, tenant_id: str, version: Optional[int] = None) -> CompiledTenantRoles:
+        """Load and compile a tenant's roles; concurrent misses for a tenant share one load."""
+        with self._lock:
+            load_lock = self._load_locks.get(tenant_id)
+            if load_lock is None:
+                load_lock = self._load_locks[tenant_id] = threading.Lock()
+        
+        with load_lock:
+            compiled = self._cached(tenant_id, version)
+            if compiled is not None:
+                return compiled
+            compiled = self._tenants.get(tenant_id)
+            
+            try:
+                loaded_version, definitions = self.loader.load(tenant_id)
+                # A token ahead of a lagging replica forces one reload, not one per request
+                compiled = CompiledTenantRoles(
+                    max(loaded_version, version or 0), self.compile(definitions), time.monotonic() + self.max_age
+                )
+                self.loads += 1
+            except Exception as e:
+                # Keep the previous roles (or none) and retry shortly
+                self.load_failures += 1
+                logger.error(f"Failed to load roles for tenant {tenant_id}: {e}")
+                previous = compiled or CompiledTenantRoles(0, {}, 0.0)
+                compiled = previous._replace(expires_at=time.monotonic() + self.retry_seconds)
+            
+            with self._lock:
+                if tenant_id not in self._tenants and len(self._tenants) >= self.max_tenants:
+                    # Drop the oldest-loaded tenant (dicts keep insertion order)
+                    evicted = next(iter(self._tenants))
+                    self._tenants.pop(evicted)
+                    self._load_locks.pop(evicted, None)
+                self._tenants.pop(tenant_id, None)
+                self._tenants[tenant_id] = compiled
+            return compiled
+    
+    def invalidate(self, tenant_id: Optional[str] = None, version: Optional[int] = None) -> None:
+        """Drop cached roles of one tenant (or all) unless already at version."""
+        with self._lock:
+            if tenant_id is None:
+                self._tenants = {}
+                self._load_locks = {}
+                return
+            compiled = self._tenants.get(tenant_id)
+            if compiled is not None and (version is None or version > compiled.version):
+                del self._tenants[tenant_id]
+    
+    def save_role(self, db, tenant_id, name: str, permissions: Iterable[str],
+                  inherits: Iterable[str] = ()) -> int:
+        """Create or replace a tenant role; returns the new roles version.
+        
+        The tenant's full role set is compiled strictly before anything is
+        written, so a definition that would break another role is refused.
+        """
+        from ..database.models import TenantRole
+        
+        tenant_id = _tenant_uuid(tenant_id)
+        name = name.strip().lower()
+        if not name or len(name) > ROLE_NAME_MAX_LENGTH:
+            raise ValueError(f"Role names must be 1 to {ROLE_NAME_MAX_LENGTH} characters long")
+        permissions = sorted(set(permissions))
+        inherits = [parent.strip().lower() for parent in inherits]
+        _, definitions = self.loader.load(tenant_id, db)
+        definitions[name] = (permissions, inherits)
+        self.compile(definitions, strict=True)
+        
+        row = db.query(TenantRole).filter(TenantRole.tenant_id == tenant_id, TenantRole.name == name).first()
+        if row is None:
+            row = TenantRole(tenant_id=tenant_id, name=name)
+            db.add(row)
+        row.permissions = json.dumps(permissions)
+        row.inherits = json.dumps(inherits)
+        row.deleted_at = None
+        return self._bump_version(db, tenant_id)
+    
+    def delete_role(self, db, tenant_id, name: str) -> int:
+        """Delete a tenant role; refused while other roles inherit it."""
+        from ..database.models import TenantRole
+        
+        tenant_id = _tenant_uuid(tenant_id)
+        name = name.strip().lower()
+        _, definitions = self.loader.load(tenant_id, db)
+        if definitions.pop(name, None) is None:
+            raise ValueError(f"Unknown role {name!r}")
+        self.compile(definitions, strict=True)
+        
+        db.query(TenantRole).filter(
+            TenantRole.tenant_id == tenant_id, TenantRole.name == name
+        ).delete(synchronize_session=False)
+        return self._bump_version(db, tenant_id)
+    
+    def _bump_version(self, db, tenant_id) -> int:
+        """Increment the tenant's roles version in the same transaction and commit."""
+        from ..database.models import Tenant
+        
+        db.query(Tenant).filter(Tenant.id == tenant_id).update(
+            {Tenant.roles_version: Tenant.roles_version + 1}, synchronize_session=False
+        )
+        db.commit()
+        version = db.query(Tenant.roles_version).filter(Tenant.id == tenant_id).scalar() or 0
+        self.invalidate(str(tenant_id))
+        return version
+    
+    def list_roles(self, tenant_id, db=None) -> Dict[str, Dict[str, List[str]]]:
+        """Stored definitions of a tenant's roles."""
+        _, definitions = self.loader.load(tenant_id, db)
+        return {
+            name: {"permissions": permissions, "inherits": inherits}
+            for name, (permissions, inherits) in sorted(definitions.items())
+        }
+    
+    def _reset_after_fork(self) -> None:
+        """Give a forked child its own locks."""
+        self._lock = threading.Lock()
+        self._load_locks = {}
+    
+    def stats(self) -> Dict[str, int]:
+        """Get tenant role cache counters."""
+        return {
+            "tenants": len(self._tenants),
+            "loads": self.loads,
+            "load_failures": self.load_failures
+        }
+
+
+def create_role_loader(source: str = TENANT_ROLES_SOURCE) -> Optional[DatabaseRoleLoader]:
+    """Build the role loader selected by configuration."""
+    if source == "none":
+        return None
+    if source == "db":
+        return DatabaseRoleLoader()
+    raise ValueError(f"Unknown tenant roles source: {source}")
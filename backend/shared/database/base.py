@@ -2,12 +2,17 @@
 Base database classes and utilities for A-EMS microservices.
 """
 
-from sqlalchemy import create_engine, MetaData
+from sqlalchemy import create_engine, event, MetaData
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.pool import QueuePool
 import os
+import time
 from typing import Generator
+from ..logging.correlation import correlation_sql_comment
+from ..logging.timing import record_phase
+from ..logging.tracing import tracer
+from ..metrics import registry
 
 # Database configuration
 DATABASE_URL = os.getenv(
@@ -25,8 +30,121 @@ engine = create_engine(
     echo=os.getenv("SQL_DEBUG", "false").lower() == "true"
 )
 
+# Connection pool gauges
+registry.gauge("db_pool_size", "Configured DB connection pool size", function=engine.pool.size)
+registry.gauge("db_pool_checked_out", "DB connections currently checked out", function=engine.pool.checkedout)
+registry.gauge("db_pool_overflow", "DB connections open beyond the pool size", function=engine.pool.overflow)
+
+# Append the correlation ID to every statement as a SQL comment
+DB_QUERY_COMMENTS = os.getenv("DB_QUERY_COMMENTS", "true").lower() == "true"
+
+# Longest statement prefix attached to query spans
+DB_SPAN_STATEMENT_LENGTH = int(os.getenv("DB_SPAN_STATEMENT_LENGTH", "256"))
+
+
+@event.listens_for(engine, "before_cursor_execute")
+def _start_query_timer(conn, cursor, statement, parameters, context, executemany):
+    """Remember when a statement was sent to the database."""
+    conn.info.setdefault("query_start_ns", []).append(time.perf_counter_ns())
+
+
+@event.listens_for(engine, "after_cursor_execute")
+def _stop_query_timer(conn, cursor, statement, parameters, context, executemany):
+    """Add statement execution time to the request's db phase."""
+    record_phase("db", time.perf_counter_ns() - conn.info["query_start_ns"].pop())
+
+
+@event.listens_for(engine, "before_cursor_execute")
+def _start_query_span(conn, cursor, statement, parameters, context, executemany):
+    """Open a client span for the statement when a trace is being recorded."""
+    span = tracer.start_child_span(
+        "db.query", kind="client", attributes={"db.statement": statement[:DB_SPAN_STATEMENT_LENGTH]}
+    )
+    conn.info.setdefault("query_spans", []).append(span)
+
+
+@event.listens_for(engine, "after_cursor_execute")
+def _end_query_span(conn, cursor, statement, parameters, context, executemany):
+    """Close the statement's span."""
+    span = conn.info["query_spans"].pop()
+    if span is not None:
+        span.end()
+
+
+@event.listens_for(engine, "handle_error")
+def _fail_query_span(exception_context):
+    """Close the span (and timer) of a statement that raised."""
+    conn = exception_context.connection
+    if conn is None or not conn.info.get("query_spans"):
+        return
+    conn.info["query_start_ns"].pop()
+    span = conn.info["query_spans"].pop()
+    if span is not None:
+        span.record_exception(exception_context.original_exception)
+        span.end()
+
+
+if DB_QUERY_COMMENTS:
+    @event.listens_for(engine, "before_cursor_execute", retval=True)
+    def _add_correlation_comment(conn, cursor, statement, parameters, context, executemany):
+        """Tag statements with the request correlation ID for DB-side tracing."""
+        return correlation_sql_comment(statement), parameters
+
+
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# Request sessions by whether they were ever used
+_request_sessions = registry.counter(
+    "db_request_sessions_total", "Per-request DB sessions, by whether a session was created", ("used",)
+)
+
+
+class LazySession:
+    """Session proxy that creates the real Session on first attribute access.
+    
+    Dependencies and endpoints that return before querying never build a
+    Session, and the pool connection is only checked out once a statement
+    runs. close() releases whatever was created. Code that needs a real
+    Session instance (isinstance checks) gets one from "with db as session:".
+    """
+    
+    __slots__ = ("_factory", "_session")
+    
+    def __init__(self, factory=SessionLocal):
+        self._factory = factory
+        self._session = None
+    
+    def _real(self):
+        """The real session, created on first use."""
+        session = self._session
+        if session is None:
+            session = self._session = self._factory()
+        return session
+    
+    def __getattr__(self, name):
+        return getattr(self._real(), name)
+    
+    def __enter__(self):
+        return self._real().__enter__()
+    
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        session = self._session
+        if session is not None:
+            self._session = None
+            session.__exit__(exc_type, exc_value, traceback)
+    
+    @property
+    def started(self) -> bool:
+        """Whether the real session has been created."""
+        return self._session is not None
+    
+    def close(self) -> None:
+        """Close the real session, if any, returning its connection to the pool."""
+        session = self._session
+        if session is not None:
+            self._session = None
+            session.close()
+
 # Base class for all models
 Base = declarative_base()
 
@@ -41,8 +159,8 @@ class DatabaseBase:
         self.db = None
     
     def get_db(self) -> Generator:
-        """Get database session."""
-        db = SessionLocal()
+        """Get database session (created on first use)."""
+        db = LazySession()
         try:
             yield db
         finally:
@@ -59,9 +177,14 @@ class DatabaseBase:
 
 # Database dependency for FastAPI
 def get_database() -> Generator:
-    """Database dependency for FastAPI dependency injection."""
-    db = SessionLocal()
+    """Database dependency for FastAPI dependency injection.
+    
+    Yields a LazySession, so requests that never query cost no session
+    setup and hold no pool connection.
+    """
+    db = LazySession()
     try:
         yield db
     finally:
+        _request_sessions.inc(("true" if db.started else "false",))
         db.close()
\ No newline at end of file
@@ -0,0 +1,30 @@
+-- Migration: create_business_event_rollups
+-- Description: Windowed business event rollups written by the db rollup sink
+-- Created: 2026-10-19T00:01:00
+
+-- 
+-- Up Migration
+-- 
+
+CREATE TABLE IF NOT EXISTS business_event_rollups (
+    id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+    window_start TIMESTAMP NOT NULL,
+    window_seconds INTEGER NOT NULL,
+    event VARCHAR(100) NOT NULL,
+    resource VARCHAR(100) NOT NULL,
+    action VARCHAR(100) NOT NULL,
+    tenant_id VARCHAR(255),
+    count INTEGER NOT NULL,
+    duration_ms TEXT,
+    sums TEXT,
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS ix_business_event_rollups_window ON business_event_rollups(window_start, event);
+
+-- 
+-- Down Migration (Rollback)
+-- 
+
+-- DROP INDEX IF EXISTS ix_business_event_rollups_window;
+-- DROP TABLE IF EXISTS business_event_rollups;
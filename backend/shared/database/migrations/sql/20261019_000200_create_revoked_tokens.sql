@@ -0,0 +1,23 @@
+-- Migration: create_revoked_tokens
+-- Description: Revoked token and session IDs served by the db revocation feed
+-- Created: 2026-10-19T00:02:00
+
+-- 
+-- Up Migration
+-- 
+
+CREATE TABLE IF NOT EXISTS revoked_tokens (
+    seq SERIAL PRIMARY KEY,
+    token_id VARCHAR(64) NOT NULL,
+    expires_at TIMESTAMP NOT NULL,
+    revoked_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS ix_revoked_tokens_expires_at ON revoked_tokens(expires_at);
+
+-- 
+-- Down Migration (Rollback)
+-- 
+
+-- DROP INDEX IF EXISTS ix_revoked_tokens_expires_at;
+-- DROP TABLE IF EXISTS revoked_tokens;
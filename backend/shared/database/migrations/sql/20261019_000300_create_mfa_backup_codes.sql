@@ -0,0 +1,24 @@
+-- Migration: create_mfa_backup_codes
+-- Description: MFA backup codes stored one per row, found by a keyed lookup tag
+-- Created: 2026-10-19T00:03:00
+
+-- 
+-- Up Migration
+-- 
+
+CREATE TABLE IF NOT EXISTS mfa_backup_codes (
+    id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+    user_id UUID NOT NULL REFERENCES users(id),
+    lookup_tag VARCHAR(64) UNIQUE NOT NULL,
+    code_hash VARCHAR(255) NOT NULL,
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS ix_mfa_backup_codes_user_id ON mfa_backup_codes(user_id);
+
+-- 
+-- Down Migration (Rollback)
+-- 
+
+-- DROP INDEX IF EXISTS ix_mfa_backup_codes_user_id;
+-- DROP TABLE IF EXISTS mfa_backup_codes;
@@ -0,0 +1,15 @@
+-- Migration: index_users_email_lower
+-- Description: Case-insensitive email index used by the login guard write-back
+-- Created: 2026-10-19T00:04:00
+
+-- 
+-- Up Migration
+-- 
+
+CREATE INDEX IF NOT EXISTS ix_users_email_lower ON users(lower(email));
+
+-- 
+-- Down Migration (Rollback)
+-- 
+
+-- DROP INDEX IF EXISTS ix_users_email_lower;
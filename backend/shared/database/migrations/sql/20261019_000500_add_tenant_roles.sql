@@ -0,0 +1,30 @@
+-- Migration: add_tenant_roles
+-- Description: Tenant-defined roles and the per-tenant roles version that invalidates cached role masks
+-- Created: 2026-10-19T00:05:00
+
+-- 
+-- Up Migration
+-- 
+
+ALTER TABLE tenants ADD COLUMN IF NOT EXISTS roles_version INTEGER NOT NULL DEFAULT 0;
+
+CREATE TABLE IF NOT EXISTS tenant_roles (
+    id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+    tenant_id UUID NOT NULL REFERENCES tenants(id),
+    name VARCHAR(50) NOT NULL,
+    permissions TEXT NOT NULL DEFAULT '[]',
+    inherits TEXT NOT NULL DEFAULT '[]',
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    deleted_at TIMESTAMP NULL
+);
+
+CREATE UNIQUE INDEX IF NOT EXISTS ux_tenant_roles_tenant_name ON tenant_roles(tenant_id, name);
+
+-- 
+-- Down Migration (Rollback)
+-- 
+
+-- DROP INDEX IF EXISTS ux_tenant_roles_tenant_name;
+-- DROP TABLE IF EXISTS tenant_roles;
+-- ALTER TABLE tenants DROP COLUMN IF EXISTS roles_version;
@@ -0,0 +1,17 @@
+-- Migration: index_sessions
+-- Description: Session lookups by user and chunked purge of expired sessions
+-- Created: 2026-10-19T00:06:00
+
+-- 
+-- Up Migration
+-- 
+
+CREATE INDEX IF NOT EXISTS ix_sessions_user_id ON sessions(user_id);
+CREATE INDEX IF NOT EXISTS ix_sessions_expires_at ON sessions(expires_at);
+
+-- 
+-- Down Migration (Rollback)
+-- 
+
+-- DROP INDEX IF EXISTS ix_sessions_expires_at;
+-- DROP INDEX IF EXISTS ix_sessions_user_id;
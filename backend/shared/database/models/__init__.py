@@ -2,7 +2,7 @@
 Shared database models for A-EMS microservices.
 """
 
-from sqlalchemy import Column, String, DateTime, Boolean, Text, UUID, ForeignKey, Integer
+from sqlalchemy import Column, String, DateTime, Boolean, Text, UUID, ForeignKey, Integer, Index, text
 from sqlalchemy.ext.declarative import declared_attr
 from sqlalchemy.orm import relationship
 from datetime import datetime
@@ -34,15 +34,20 @@ class Tenant(Base, TimestampMixin):
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
     name = Column(String(255), nullable=False)
     slug = Column(String(100), unique=True, nullable=False)
+    roles_version = Column(Integer, default=0, nullable=False)  # bumped on every custom role change
     
     # Relationships
     users = relationship("User", back_populates="tenant")
+    roles = relationship("TenantRole", back_populates="tenant", cascade="all, delete-orphan")
 
 
 class User(Base, TimestampMixin, TenantMixin):
     """User model for authentication and authorization."""
     
     __tablename__ = "users"
+    __table_args__ = (
+        Index("ix_users_email_lower", text("lower(email)")),  # case-insensitive lookups
+    )
     
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
     email = Column(String(255), unique=True, nullable=False)
@@ -55,7 +60,7 @@ class User(Base, TimestampMixin, TenantMixin):
     # MFA fields
     mfa_enabled = Column(Boolean, default=False)
     mfa_secret = Column(String(255), nullable=True)
-    mfa_backup_codes = Column(Text, nullable=True)  # JSON string of backup codes
+    mfa_backup_codes = Column(Text, nullable=True)  # Legacy JSON list of bcrypt hashes, drained on use
     
     # OAuth fields
     google_id = Column(String(255), nullable=True)
@@ -68,6 +73,24 @@ class User(Base, TimestampMixin, TenantMixin):
     # Relationships
     tenant = relationship("Tenant", back_populates="users")
     audit_logs = relationship("AuditLog", back_populates="user")
+    backup_codes = relationship("MFABackupCode", back_populates="user", cascade="all, delete-orphan")
+
+
+class TenantRole(Base, TimestampMixin, TenantMixin):
+    """Tenant-defined role, compiled into a permission bitmask when loaded."""
+    
+    __tablename__ = "tenant_roles"
+    __table_args__ = (
+        Index("ux_tenant_roles_tenant_name", "tenant_id", "name", unique=True),
+    )
+    
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    name = Column(String(50), nullable=False)
+    permissions = Column(Text, nullable=False, default="[]")  # JSON list of permission values
+    inherits = Column(Text, nullable=False, default="[]")  # JSON list of built-in or tenant role names
+    
+    # Relationships
+    tenant = relationship("Tenant", back_populates="roles")
 
 
 class AuditLog(Base, TimestampMixin, TenantMixin):
@@ -89,14 +112,33 @@ class AuditLog(Base, TimestampMixin, TenantMixin):
     user = relationship("User", back_populates="audit_logs")
 
 
+class MFABackupCode(Base):
+    """Unused MFA backup code, found by its keyed lookup tag."""
+    
+    __tablename__ = "mfa_backup_codes"
+    
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    user_id = Column(UUID(as_uuid=True), ForeignKey('users.id'), nullable=False, index=True)
+    lookup_tag = Column(String(64), unique=True, nullable=False)  # HMAC of user ID and code
+    code_hash = Column(String(255), nullable=False)  # bcrypt hash of the code
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    
+    # Relationships
+    user = relationship("User", back_populates="backup_codes")
+
+
 class Session(Base, TimestampMixin):
     """User session management."""
     
     __tablename__ = "sessions"
+    __table_args__ = (
+        Index("ix_sessions_user_id", "user_id"),
+        Index("ix_sessions_expires_at", "expires_at"),  # chunked purge of expired rows
+    )
     
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
     user_id = Column(UUID(as_uuid=True), ForeignKey('users.id'), nullable=False)
-    session_token = Column(String(255), unique=True, nullable=False)
+    session_token = Column(String(255), unique=True, nullable=False)  # SHA-256 of the token
     refresh_token = Column(String(255), unique=True, nullable=True)
     expires_at = Column(DateTime, nullable=False)
     is_active = Column(Boolean, default=True)
@@ -104,4 +146,39 @@ class Session(Base, TimestampMixin):
     ip_address = Column(String(45), nullable=True)
     
     # Relationships
-    user = relationship("User")
\ No newline at end of file
+    user = relationship("User")
+
+
+class BusinessEventRollup(Base):
+    """Aggregated business event counts per time window."""
+    
+    __tablename__ = "business_event_rollups"
+    __table_args__ = (
+        Index("ix_business_event_rollups_window", "window_start", "event"),
+    )
+    
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    window_start = Column(DateTime, nullable=False)
+    window_seconds = Column(Integer, nullable=False)
+    event = Column(String(100), nullable=False)
+    resource = Column(String(100), nullable=False)
+    action = Column(String(100), nullable=False)
+    tenant_id = Column(String(255), nullable=True)
+    count = Column(Integer, nullable=False)
+    duration_ms = Column(Text, nullable=True)  # JSON histogram
+    sums = Column(Text, nullable=True)  # JSON string
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+
+
+class RevokedToken(Base):
+    """Revoked token or session IDs, kept until the tokens expire."""
+    
+    __tablename__ = "revoked_tokens"
+    __table_args__ = (
+        Index("ix_revoked_tokens_expires_at", "expires_at"),
+    )
+    
+    seq = Column(Integer, primary_key=True, autoincrement=True)  # feed cursor
+    token_id = Column(String(64), nullable=False)  # jti or sid claim
+    expires_at = Column(DateTime, nullable=False)
+    revoked_at = Column(DateTime, default=datetime.utcnow, nullable=False)
\ No newline at end of file
@@ -83,6 +83,17 @@ class RateLimitError(AEMSException):
         super().__init__(message, "RATE_LIMIT_ERROR", error_details)
 
 
+class ServiceOverloadedError(AEMSException):
+    """Work rejected because a bounded resource is saturated."""
+    
+    def __init__(self, message: str = "Service temporarily overloaded", retry_after: int = None,
+                 details: Dict[str, Any] = None):
+        error_details = details or {}
+        if retry_after:
+            error_details["retry_after"] = retry_after
+        super().__init__(message, "SERVICE_OVERLOADED", error_details)
+
+
 class ConfigurationError(AEMSException):
     """Configuration errors."""
     
@@ -152,6 +163,7 @@ EXCEPTION_STATUS_MAP = {
     ExternalServiceError: 503,
     AIServiceError: 503,
     RateLimitError: 429,
+    ServiceOverloadedError: 503,
     ConfigurationError: 500,
     NotFoundError: 404,
     ConflictError: 409,
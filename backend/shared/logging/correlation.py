@@ -2,21 +2,48 @@
 Correlation ID utilities for distributed tracing.
 """
 
-import uuid
+import base64
 import contextvars
+import random
+import re
+import time
 from typing import Optional
 from fastapi import Request
 
 
-# Context variable for correlation ID
+# Context variable for correlation ID (the only place the current ID lives)
 correlation_id_context: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar(
     'correlation_id', default=None
 )
 
+CORRELATION_ID_HEADER = "X-Correlation-ID"
+
+# Incoming IDs are propagated into headers and SQL comments, so only
+# accept a conservative character set and length
+_VALID_CORRELATION_ID = re.compile(r"^[A-Za-z0-9._:-]{1,128}$")
+
+# RFC 4648 base32 alphabet translated to Crockford's (as used by ULIDs)
+_CROCKFORD_TRANSLATION = str.maketrans(
+    "ABCDEFGHIJKLMNOPQRSTUVWXYZ234567",
+    "0123456789ABCDEFGHJKMNPQRSTVWXYZ"
+)
+
 
 def generate_correlation_id() -> str:
-    """Generate a new correlation ID."""
-    return str(uuid.uuid4())
+    """Generate a new time-ordered correlation ID (ULID layout).
+    
+    48 bits of millisecond timestamp followed by 80 random bits, encoded
+    as 26 Crockford base32 characters, so IDs sort by creation time.
+    """
+    value = (time.time_ns() // 1_000_000) << 80 | random.getrandbits(80)
+    # 20 bytes encode to 32 base32 chars; the first 6 only cover zero padding
+    encoded = base64.b32encode(value.to_bytes(20, "big"))[6:]
+    return encoded.decode("ascii").translate(_CROCKFORD_TRANSLATION)
+
+
+def is_valid_correlation_id(correlation_id: str) -> bool:
+    """Check an externally supplied correlation ID is safe to propagate."""
+    return _VALID_CORRELATION_ID.match(correlation_id) is not None
 
 
 def get_correlation_id() -> Optional[str]:
@@ -24,7 +51,7 @@ def get_correlation_id() -> Optional[str]:
     return correlation_id_context.get()
 
 
-def set_correlation_id(correlation_id: str) -> None:
+def set_correlation_id(correlation_id: Optional[str]) -> None:
     """Set correlation ID in current context."""
     correlation_id_context.set(correlation_id)
 
@@ -41,8 +68,8 @@ def extract_correlation_id_from_request(request: Request) -> str:
     if not correlation_id:
         correlation_id = request.headers.get("X-Trace-ID")
     
-    # Generate new one if not found
-    if not correlation_id:
+    # Generate new one if not found or not safe to propagate
+    if not correlation_id or not is_valid_correlation_id(correlation_id):
         correlation_id = generate_correlation_id()
     
     return correlation_id
@@ -56,28 +83,42 @@ def add_correlation_id_to_response_headers(correlation_id: str) -> dict:
     }
 
 
+async def inject_correlation_id(request) -> None:
+    """httpx request hook forwarding the current correlation ID upstream."""
+    correlation_id = correlation_id_context.get()
+    if correlation_id:
+        request.headers[CORRELATION_ID_HEADER] = correlation_id
+
+
+def correlation_sql_comment(statement: str) -> str:
+    """Append the current correlation ID to a SQL statement as a comment."""
+    correlation_id = correlation_id_context.get()
+    if correlation_id:
+        return f"{statement} /* correlation_id='{correlation_id}' */"
+    return statement
+
+
 class CorrelationIDManager:
-    """Manager for correlation ID context."""
+    """Manager for correlation ID context.
     
-    def __init__(self):
-        self.current_id: Optional[str] = None
+    Holds no per-request state itself; everything lives in the context
+    variable so concurrent requests never see each other's IDs.
+    """
     
     def start_request(self, request: Request) -> str:
         """Start request processing with correlation ID."""
         correlation_id = extract_correlation_id_from_request(request)
         set_correlation_id(correlation_id)
-        self.current_id = correlation_id
         return correlation_id
     
     def get_current_id(self) -> Optional[str]:
         """Get current correlation ID."""
-        return get_correlation_id() or self.current_id
+        return get_correlation_id()
     
     def clear_context(self) -> None:
         """Clear correlation ID context."""
         set_correlation_id(None)
-        self.current_id = None
 
 
 # Global correlation ID manager
-correlation_manager = CorrelationIDManager()
\ No newline at end of file
+correlation_manager = CorrelationIDManager()
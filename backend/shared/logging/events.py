@@ -0,0 +1,330 @@
+"""
+In-process aggregation of business events into periodic rollups.
+"""
+
+import atexit
+import bisect
+import json
+import os
+import random
+import threading
+import time
+from abc import ABC, abstractmethod
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from .logger import get_logger
+from .timing import PHASE_BUCKETS_MS
+
+
+# Aggregation configuration
+BUSINESS_EVENTS_AGGREGATE = os.getenv("BUSINESS_EVENTS_AGGREGATE", "true").lower() == "true"
+BUSINESS_EVENTS_WINDOW_SECONDS = int(os.getenv("BUSINESS_EVENTS_WINDOW_SECONDS", "60"))
+BUSINESS_EVENTS_SINK = os.getenv("BUSINESS_EVENTS_SINK", "log").lower()  # "log", "file" or "db"
+BUSINESS_EVENTS_FILE_PATH = os.getenv("BUSINESS_EVENTS_FILE_PATH", "/var/log/aems/business_events.jsonl")
+BUSINESS_EVENTS_RAW_SAMPLE_RATE = float(os.getenv("BUSINESS_EVENTS_RAW_SAMPLE_RATE", "0.0"))
+# Events still logged one by one in addition to the rollups (audit trail of user actions)
+BUSINESS_EVENTS_RAW_EVENTS = frozenset(
+    event.strip() for event in os.getenv("BUSINESS_EVENTS_RAW_EVENTS", "user_action").split(",") if event.strip()
+)
+BUSINESS_EVENTS_MAX_KEYS = int(os.getenv("BUSINESS_EVENTS_MAX_KEYS", "10000"))
+
+# Key used once a window already holds BUSINESS_EVENTS_MAX_KEYS keys
+OVERFLOW_KEY = ("_overflow", "_overflow", "_overflow", None)
+
+EventKey = Tuple[str, str, str, Optional[str]]
+
+
+class EventRollup:
+    """Counters, sums and a latency histogram for one event key in one window."""
+    
+    __slots__ = ("count", "duration_count", "duration_sum_ms", "duration_buckets", "sums")
+    
+    def __init__(self):
+        self.count = 0
+        self.duration_count = 0
+        self.duration_sum_ms = 0.0
+        self.duration_buckets = [0] * (len(PHASE_BUCKETS_MS) + 1)
+        self.sums: Dict[str, float] = {}
+    
+    def observe(self, duration_ms: Optional[float], values: Optional[Dict[str, float]]) -> None:
+        """Add one event."""
+        self.count += 1
+        if duration_ms is not None:
+            self.duration_count += 1
+            self.duration_sum_ms += duration_ms
+            self.duration_buckets[bisect.bisect_left(PHASE_BUCKETS_MS, duration_ms)] += 1
+        if values:
+            sums = self.sums
+            for name, value in values.items():
+                sums[name] = sums.get(name, 0) + value
+    
+    def to_dict(self, window_start: int, window_seconds: int, key: EventKey) -> Dict[str, Any]:
+        """Export rollup with its window and key."""
+        event, resource, action, tenant_id = key
+        rollup = {
+            "window_start": datetime.utcfromtimestamp(window_start).isoformat(),
+            "window_seconds": window_seconds,
+            "event": event,
+            "resource": resource,
+            "action": action,
+            "tenant_id": tenant_id,
+            "count": self.count,
+            "sums": self.sums
+        }
+        if self.duration_count:
+            rollup["duration_ms"] = {
+                "count": self.duration_count,
+                "sum": self.duration_sum_ms,
+                "buckets": {
+                    str(bound): count
+                    for bound, count in zip(PHASE_BUCKETS_MS + ("+Inf",), self.duration_buckets)
+                    if count
+                }
+            }
+        return rollup
+
+
+class RollupSink(ABC):
+    """Destination for flushed rollups."""
+    
+    @abstractmethod
+    def write(self, rollups: List[Dict[str, Any]]) -> None:
+        """Persist a batch of flushed rollups."""
+    
+    def close(self) -> None:
+        pass
+
+
+class LogRollupSink(RollupSink):
+    """Write one compact log line per rollup."""
+    
+    def __init__(self):
+        self.logger = get_logger("business_events")
+    
+    def write(self, rollups: List[Dict[str, Any]]) -> None:
+        for rollup in rollups:
+            self.logger.info(
+                f"Business event rollup: {rollup['event']} - {rollup['action']} on {rollup['resource']}",
+                extra_data={**rollup, "type": "business_event_rollup"},
+                tenant_id=rollup["tenant_id"]
+            )
+
+
+class FileRollupSink(RollupSink):
+    """Append rollups to a file as JSON lines."""
+    
+    def __init__(self, path: str = BUSINESS_EVENTS_FILE_PATH):
+        self.path = path
+    
+    def write(self, rollups: List[Dict[str, Any]]) -> None:
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        with open(self.path, "a", encoding="utf-8") as rollup_file:
+            rollup_file.write("".join(json.dumps(rollup) + "\n" for rollup in rollups))
+
+
+class DatabaseRollupSink(RollupSink):
+    """Insert rollups into the business_event_rollups table."""
+    
+    def write(self, rollups: List[Dict[str, Any]]) -> None:
+        # Imported lazily so logging does not depend on the database layer
+        from ..database.base import SessionLocal
+        from ..database.models import BusinessEventRollup
+        
+        rows = [
+            {
+                "window_start": datetime.fromisoformat(rollup["window_start"]),
+                "window_seconds": rollup["window_seconds"],
+                "event": rollup["event"],
+                "resource": rollup["resource"],
+                "action": rollup["action"],
+                "tenant_id": rollup["tenant_id"],
+                "count": rollup["count"],
+                "duration_ms": json.dumps(rollup.get("duration_ms")),
+                "sums": json.dumps(rollup["sums"])
+            }
+            for rollup in rollups
+        ]
+        
+        db = SessionLocal()
+        try:
+            db.bulk_insert_mappings(BusinessEventRollup, rows)
+            db.commit()
+        finally:
+            db.close()
+
+
+class EventAggregator:
+    """Aggregates business events per time window and flushes rollups in the background.
+    
+    Recording only updates in-memory counters under a lock. A flush thread
+    hands each finished window to the sink, so the sink sees one rollup
+    per (event, resource, action, tenant) and window instead of one
+    record per event. Events named in raw_events are aggregated and
+    still logged individually; others only when sampled.
+    """
+    
+    def __init__(self, sink: Optional[RollupSink] = None,
+                 window_seconds: int = BUSINESS_EVENTS_WINDOW_SECONDS,
+                 max_keys: int = BUSINESS_EVENTS_MAX_KEYS,
+                 raw_sample_rate: float = BUSINESS_EVENTS_RAW_SAMPLE_RATE,
+                 raw_events: frozenset = BUSINESS_EVENTS_RAW_EVENTS):
+        self.sink = sink
+        self.window_seconds = window_seconds
+        self.max_keys = max_keys
+        self.raw_sample_rate = raw_sample_rate
+        self.raw_events = raw_events
+        
+        self._lock = threading.Lock()
+        self._window_start = self._align(time.time())
+        self._current: Dict[EventKey, EventRollup] = {}
+        self._completed: List[Tuple[int, Dict[EventKey, EventRollup]]] = []
+        
+        self._thread: Optional[threading.Thread] = None
+        self._wakeup = threading.Event()
+        self._stopped = False
+        
+        # Counters (diagnostic only)
+        self.recorded = 0
+        self.flushed = 0
+        self.overflowed = 0
+        self.failed = 0
+    
+    def _align(self, now: float) -> int:
+        return int(now // self.window_seconds * self.window_seconds)
+    
+    def _rotate(self, now: float) -> None:
+        """Close the current window if it has ended (lock held)."""
+        window_start = self._align(now)
+        if window_start != self._window_start:
+            if self._current:
+                self._completed.append((self._window_start, self._current))
+                self._current = {}
+            self._window_start = window_start
+    
+    def record(self, event: str, resource: str, action: str, tenant_id: Optional[str] = None,
+               duration_ms: Optional[float] = None, values: Optional[Dict[str, float]] = None) -> bool:
+        """Aggregate one event. Returns True if the raw event should also be logged."""
+        key = (event, resource, action, tenant_id)
+        now = time.time()
+        
+        with self._lock:
+            if now - self._window_start >= self.window_seconds:
+                self._rotate(now)
+            
+            rollup = self._current.get(key)
+            if rollup is None:
+                if len(self._current) >= self.max_keys:
+                    self.overflowed += 1
+                    key = OVERFLOW_KEY
+                    rollup = self._current.get(key)
+                if rollup is None:
+                    rollup = self._current[key] = EventRollup()
+            rollup.observe(duration_ms, values)
+            self.recorded += 1
+        
+        if self._thread is None and not self._stopped:
+            self._ensure_started()
+        
+        if event in self.raw_events:
+            return True
+        return self.raw_sample_rate > 0 and random.random() < self.raw_sample_rate
+    
+    def _ensure_started(self) -> None:
+        """Start the flush thread on first use."""
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self._run, name="aems-event-flusher", daemon=True
+                )
+                self._thread.start()
+    
+    def _run(self) -> None:
+        """Flush completed windows shortly after each window boundary."""
+        while not self._stopped:
+            next_boundary = self._window_start + self.window_seconds
+            self._wakeup.wait(max(0.0, next_boundary - time.time()) + 0.1)
+            self._wakeup.clear()
+            if not self._stopped:
+                self.flush()
+    
+    def flush(self, include_current: bool = False) -> int:
+        """Write completed windows (and optionally the current one) to the sink."""
+        with self._lock:
+            self._rotate(time.time())
+            windows = self._completed
+            self._completed = []
+            if include_current and self._current:
+                windows.append((self._window_start, self._current))
+                self._current = {}
+        
+        rollups = [
+            rollup.to_dict(window_start, self.window_seconds, key)
+            for window_start, window in windows
+            for key, rollup in window.items()
+        ]
+        if not rollups or self.sink is None:
+            return 0
+        
+        try:
+            self.sink.write(rollups)
+            self.flushed += len(rollups)
+        except Exception:
+            self.failed += len(rollups)
+        return len(rollups)
+    
+    def shutdown(self, timeout: float = 5.0) -> None:
+        """Flush everything, including the partial window, and stop the thread."""
+        if self._stopped:
+            return
+        self._stopped = True
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        self.flush(include_current=True)
+        if self.sink is not None:
+            self.sink.close()
+    
+    def _reset_after_fork(self) -> None:
+        """Start fresh in a forked child; the flush thread does not survive fork."""
+        self._lock = threading.Lock()
+        self._current = {}
+        self._completed = []
+        self._thread = None
+        self._wakeup = threading.Event()
+    
+    def stats(self) -> Dict[str, int]:
+        """Get aggregation counters."""
+        return {
+            "recorded": self.recorded,
+            "rollups_flushed": self.flushed,
+            "rollups_failed": self.failed,
+            "overflowed": self.overflowed,
+            "active_keys": len(self._current)
+        }
+
+
+def _create_sink(name: str = BUSINESS_EVENTS_SINK) -> RollupSink:
+    """Build the rollup sink selected by configuration."""
+    if name == "log":
+        return LogRollupSink()
+    if name == "file":
+        return FileRollupSink()
+    if name == "db":
+        return DatabaseRollupSink()
+    raise ValueError(f"Unknown business event sink: {name}")
+
+
+# Global business event aggregator
+event_aggregator = EventAggregator(_create_sink()) if BUSINESS_EVENTS_AGGREGATE else None
+
+if event_aggregator is not None:
+    if hasattr(os, "register_at_fork"):
+        os.register_at_fork(after_in_child=event_aggregator._reset_after_fork)
+    atexit.register(event_aggregator.shutdown)
+
+
+def shutdown_event_aggregation(timeout: float = 5.0) -> None:
+    """Flush pending rollups (call from application shutdown, before logging)."""
+    if event_aggregator is not None:
+        event_aggregator.shutdown(timeout)
@@ -0,0 +1,290 @@
+"""
+File log handlers for production deployments.
+"""
+
+import fcntl
+import glob
+import gzip
+import logging
+import os
+import queue
+import shutil
+import threading
+import time
+from contextlib import contextmanager
+from typing import List
+
+
+# Rotation configuration
+LOG_FILE_PATH = os.getenv("LOG_FILE_PATH", "/var/log/aems/application.log")
+LOG_ROTATE_MAX_BYTES = int(os.getenv("LOG_ROTATE_MAX_BYTES", str(100 * 1024 * 1024)))
+LOG_ROTATE_INTERVAL_SECONDS = int(os.getenv("LOG_ROTATE_INTERVAL_SECONDS", "86400"))
+LOG_ROTATE_BACKUP_COUNT = int(os.getenv("LOG_ROTATE_BACKUP_COUNT", "14"))
+LOG_RETENTION_DAYS = float(os.getenv("LOG_RETENTION_DAYS", "30"))
+LOG_FSYNC_INTERVAL_SECONDS = float(os.getenv("LOG_FSYNC_INTERVAL_SECONDS", "1.0"))
+LOG_WRITE_BUFFER_BYTES = int(os.getenv("LOG_WRITE_BUFFER_BYTES", str(64 * 1024)))
+
+_STOP = object()
+
+
+class RotatingCompressedFileHandler(logging.Handler):
+    """Buffered file handler with size/time rotation and background compression.
+    
+    Writes go to a buffered file and are fsynced periodically instead of
+    flushed per line. On rotation the active file is renamed atomically
+    and a maintenance thread gzips the rotated segment and applies the
+    retention policy, so the writer never waits on compression.
+    
+    Several worker processes may share one file: buffered lines are
+    appended with a single write under an flock on "<file>.lock", and
+    the rotation check runs under the same lock against the file's real
+    size. A process that finds the path pointing at a new inode reopens
+    it, so no process keeps writing into a segment another one rotated.
+    """
+    
+    def __init__(self, filename: str = LOG_FILE_PATH,
+                 max_bytes: int = LOG_ROTATE_MAX_BYTES,
+                 interval_seconds: int = LOG_ROTATE_INTERVAL_SECONDS,
+                 backup_count: int = LOG_ROTATE_BACKUP_COUNT,
+                 retention_days: float = LOG_RETENTION_DAYS,
+                 compress: bool = True,
+                 fsync_interval: float = LOG_FSYNC_INTERVAL_SECONDS,
+                 buffer_size: int = LOG_WRITE_BUFFER_BYTES):
+        super().__init__()
+        self.filename = os.path.abspath(filename)
+        self.max_bytes = max_bytes
+        self.interval_seconds = interval_seconds
+        self.backup_count = backup_count
+        self.retention_days = retention_days
+        self.compress = compress
+        self.fsync_interval = fsync_interval
+        self.buffer_size = buffer_size
+        self.terminator = "\n"
+        
+        self.stream = None
+        self._inode = None
+        self._lock_file = None
+        self._buffer: List[bytes] = []
+        self._buffered = 0
+        self._dirty = False
+        self._next_rollover = 0.0
+        self._open()
+        self._start_maintenance()
+        
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=self._reset_after_fork)
+    
+    def _start_maintenance(self) -> None:
+        """Start the compression, retention and fsync thread."""
+        self._tasks: queue.Queue = queue.Queue()
+        self._maintenance = threading.Thread(
+            target=self._run_maintenance, name="aems-log-maintenance", daemon=True
+        )
+        self._maintenance.start()
+    
+    def _open(self) -> None:
+        """Open the active log file for appends."""
+        os.makedirs(os.path.dirname(self.filename), exist_ok=True)
+        self.stream = open(self.filename, "ab", buffering=0)
+        self._inode = os.fstat(self.stream.fileno()).st_ino
+        if self.interval_seconds > 0:
+            now = time.time()
+            self._next_rollover = (now // self.interval_seconds + 1) * self.interval_seconds
+    
+    @contextmanager
+    def _file_lock(self):
+        """Hold the lock that serializes appends and rotation across processes."""
+        if self._lock_file is None:
+            self._lock_file = open(self.filename + ".lock", "a")
+        fcntl.flock(self._lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+    
+    def _reopen_if_rotated(self) -> None:
+        """Follow the path to a new file after another process rotated it."""
+        try:
+            inode = os.stat(self.filename).st_ino
+        except FileNotFoundError:
+            inode = None
+        if self.stream is None or inode != self._inode:
+            if self.stream is not None:
+                self.stream.close()
+            self._open()
+    
+    def _should_rollover(self, pending: int) -> bool:
+        """Check size and time rotation triggers against the shared file."""
+        size = os.fstat(self.stream.fileno()).st_size
+        if self.max_bytes > 0 and size > 0 and size + pending > self.max_bytes:
+            return True
+        return self.interval_seconds > 0 and time.time() >= self._next_rollover
+    
+    def _rotated_name(self) -> str:
+        """Build a unique name for the segment being rotated out."""
+        base = f"{self.filename}.{time.strftime('%Y%m%d-%H%M%S', time.gmtime())}"
+        name, counter = base, 1
+        while os.path.exists(name) or os.path.exists(name + ".gz"):
+            name = f"{base}.{counter}"
+            counter += 1
+        return name
+    
+    def _rollover(self) -> None:
+        """Rename the active file atomically and start a new one (file lock held)."""
+        os.fsync(self.stream.fileno())
+        self.stream.close()
+        
+        rotated = self._rotated_name()
+        os.replace(self.filename, rotated)
+        self._open()
+        self._dirty = False
+        
+        self._tasks.put(rotated)
+    
+    def emit(self, record: logging.LogRecord) -> None:
+        """Write a single record."""
+        self.emit_batch([record])
+    
+    def emit_batch(self, records: List[logging.LogRecord]) -> None:
+        """Format and write a batch of records with a single write call."""
+        lines = []
+        for record in records:
+            if record.levelno < self.level or not self.filter(record):
+                continue
+            try:
+                lines.append(self.format(record) + self.terminator)
+            except Exception:
+                self.handleError(record)
+        
+        if not lines:
+            return
+        
+        data = "".join(lines).encode("utf-8")
+        
+        self.acquire()
+        try:
+            self._buffer.append(data)
+            self._buffered += len(data)
+            if self._buffered >= self.buffer_size:
+                self._write_buffer()
+        except Exception:
+            self.handleError(records[-1])
+        finally:
+            self.release()
+    
+    def _write_buffer(self) -> None:
+        """Append buffered lines with one write under the file lock (handler lock held)."""
+        if not self._buffer:
+            return
+        data = b"".join(self._buffer)
+        self._buffer = []
+        self._buffered = 0
+        
+        with self._file_lock():
+            self._reopen_if_rotated()
+            if self._should_rollover(len(data)):
+                self._rollover()
+            # O_APPEND keeps each batch contiguous next to other processes' writes
+            self.stream.write(data)
+        self._dirty = True
+    
+    def flush(self) -> None:
+        """Write buffered lines and fsync them to disk."""
+        self.acquire()
+        try:
+            self._write_buffer()
+            if self.stream is not None and self._dirty:
+                os.fsync(self.stream.fileno())
+                self._dirty = False
+        finally:
+            self.release()
+    
+    def _run_maintenance(self) -> None:
+        """Compress rotated segments, enforce retention and fsync periodically."""
+        while True:
+            try:
+                task = self._tasks.get(timeout=self.fsync_interval)
+            except queue.Empty:
+                task = None
+            
+            if task is _STOP:
+                return
+            
+            try:
+                self.flush()
+                if task is not None:
+                    if self.compress:
+                        self._compress(task)
+                    with self._file_lock():
+                        self._apply_retention()
+            except Exception:
+                # Maintenance must never take the writer down
+                pass
+    
+    def _compress(self, path: str) -> None:
+        """Gzip a rotated segment via a temporary file and atomic rename."""
+        temp_path = f"{path}.gz.{os.getpid()}.tmp"
+        try:
+            with open(path, "rb") as source, gzip.open(temp_path, "wb") as target:
+                shutil.copyfileobj(source, target)
+        except FileNotFoundError:
+            # Removed by another process's retention pass
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            return
+        os.replace(temp_path, path + ".gz")
+        os.remove(path)
+    
+    def _apply_retention(self) -> None:
+        """Delete rotated segments beyond the backup count or retention age."""
+        segments = [
+            path for path in glob.glob(glob.escape(self.filename) + ".*")
+            if not path.endswith((".tmp", ".lock"))
+        ]
+        segments.sort(key=os.path.getmtime, reverse=True)
+        
+        expired: List[str] = []
+        if self.backup_count > 0:
+            expired.extend(segments[self.backup_count:])
+            segments = segments[:self.backup_count]
+        
+        if self.retention_days > 0:
+            cutoff = time.time() - self.retention_days * 86400
+            expired.extend(path for path in segments if os.path.getmtime(path) < cutoff)
+        
+        for path in expired:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+    
+    def _reset_after_fork(self) -> None:
+        """Start fresh in a forked child; the parent writes its own buffer.
+        
+        The lock file is reopened because flock locks belong to the open
+        file, which the child would otherwise share with its parent.
+        """
+        self._buffer = []
+        self._buffered = 0
+        self._lock_file = None
+        if self.stream is not None:
+            self._start_maintenance()
+    
+    def close(self) -> None:
+        """Flush, stop the maintenance thread and close the file."""
+        if self._maintenance.is_alive():
+            self._tasks.put(_STOP)
+            self._maintenance.join(5.0)
+        
+        self.acquire()
+        try:
+            self.flush()
+            if self.stream is not None:
+                self.stream.close()
+                self.stream = None
+            if self._lock_file is not None:
+                self._lock_file.close()
+                self._lock_file = None
+        finally:
+            self.release()
+        super().close()
@@ -0,0 +1,535 @@
+"""
+Incremental on-disk index over JSON log files for fast request lookups.
+"""
+
+import contextlib
+import fcntl
+import glob
+import gzip
+import hashlib
+import heapq
+import json
+import logging
+import mmap
+import os
+import re
+import threading
+from datetime import datetime
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from .handlers import LOG_FILE_PATH
+
+logger = logging.getLogger(__name__)
+
+# Indexer configuration
+LOG_INDEX_DIR = os.getenv("LOG_INDEX_DIR", os.path.join(os.path.dirname(LOG_FILE_PATH), "index"))
+LOG_INDEX_MAX_RUNS = int(os.getenv("LOG_INDEX_MAX_RUNS", "8"))
+LOG_INDEX_UPDATE_SECONDS = float(os.getenv("LOG_INDEX_UPDATE_SECONDS", "5"))
+
+INDEXED_FIELDS = ("correlation_id", "user_id", "tenant_id")
+
+# Key of the per-minute time bucket entries
+TIME_BUCKET_FIELD = "ts"
+
+# JSONFormatter always starts a line with the timestamp, and writes the
+# top-level ID fields before "service", which it always writes and which
+# cannot occur unescaped inside an earlier value; keys further on (inside
+# "extra") are never read as top-level fields
+_TIMESTAMP_PREFIX = b'{"timestamp": "'
+_TIMESTAMP_START = len(_TIMESTAMP_PREFIX)
+_BUCKET_SLICE = slice(_TIMESTAMP_START, _TIMESTAMP_START + 16)
+# Leading bytes hashed to recognise a segment after it is renamed or gzipped
+_FINGERPRINT_BYTES = 256
+
+_SERVICE_KEY = b'"service":'
+# null is matched explicitly so a missing top-level value never falls through to another key
+_FIELD_PATTERN = re.compile(
+    rb'"(correlation_id|user_id|tenant_id)": (?:"([^"\\\t\n]{1,256})"|(-?[0-9]{1,20})|null)'
+)
+_TENANT_PATTERN = re.compile(rb'"tenant_id": (?:"([^"\\\t\n]{1,256})"|(-?[0-9]{1,20})|null)')
+
+
+def _line_timestamp(line: bytes) -> bytes:
+    """Raw ISO timestamp at the start of a JSONFormatter line."""
+    return line[_TIMESTAMP_START:line.find(b'"', _TIMESTAMP_START)]
+
+
+def _header_end(line: bytes) -> int:
+    """Offset where the top-level ID fields of a line end (0 if not a JSONFormatter line)."""
+    return max(line.find(_SERVICE_KEY), 0)
+
+
+def _line_tenant(line: bytes) -> Optional[bytes]:
+    """Top-level tenant_id of a line, or None when it is missing or null."""
+    match = _TENANT_PATTERN.search(line, 0, _header_end(line))
+    return (match.group(1) or match.group(2)) if match else None
+
+
+def _line_bounds(data, position: int) -> Tuple[int, int]:
+    """Get start and end offsets of the line containing a position."""
+    start = data.rfind(b"\n", 0, position) + 1
+    end = data.find(b"\n", start)
+    return start, len(data) if end < 0 else end
+
+
+def _lower_bound(data, prefix: bytes) -> int:
+    """Offset of the first line not sorting before prefix in sorted line data."""
+    low, high = 0, len(data)
+    while low < high:
+        start, end = _line_bounds(data, (low + high) // 2)
+        if data[start:end] < prefix:
+            low = end + 1
+        else:
+            high = start
+    return low
+
+
+def _fingerprint(path: str, compressed: bool) -> Optional[str]:
+    """Hash the first bytes of a log file (decompressed for gzip)."""
+    opener = gzip.open if compressed else open
+    with opener(path, "rb") as source:
+        head = source.read(_FINGERPRINT_BYTES)
+    return hashlib.sha1(head).hexdigest() if len(head) == _FINGERPRINT_BYTES else None
+
+
+class _LogReader:
+    """Reads lines at offsets: via mmap for plain files, by seeking for gzip."""
+    
+    def __init__(self, entry: dict):
+        self._file = (gzip.open if entry["compressed"] else open)(entry["path"], "rb")
+        self._data = None
+        if not entry["compressed"] and os.fstat(self._file.fileno()).st_size:
+            self._data = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+    
+    def lines_from(self, offset: int) -> Iterator[bytes]:
+        """Yield complete lines starting at an offset."""
+        data = self._data
+        if data is None:
+            self._file.seek(offset)
+            for line in self._file:
+                if not line.endswith(b"\n"):
+                    return
+                yield line[:-1]
+            return
+        
+        while True:
+            end = data.find(b"\n", offset)
+            if end < 0:
+                return
+            yield data[offset:end]
+            offset = end + 1
+    
+    def close(self) -> None:
+        if self._data is not None:
+            self._data.close()
+        self._file.close()
+
+
+class IndexRun:
+    """Immutable sorted run of "field\\tkey\\tfile_id\\toffset" lines, searched via mmap."""
+    
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path, "rb")
+        size = os.fstat(self._file.fileno()).st_size
+        self._data = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+    
+    def scan(self, prefix: bytes, stop: Optional[bytes] = None) -> Iterator[List[bytes]]:
+        """Yield entries from the first one matching prefix, until stop (or the prefix ends)."""
+        data = self._data
+        position = _lower_bound(data, prefix)
+        while position < len(data):
+            end = data.find(b"\n", position)
+            end = len(data) if end < 0 else end
+            line = data[position:end]
+            if stop is None:
+                if not line.startswith(prefix):
+                    return
+            elif line > stop:
+                return
+            yield line.split(b"\t")
+            position = end + 1
+    
+    def lines(self) -> Iterator[bytes]:
+        """Iterate over all lines in sorted order."""
+        data = self._data
+        position = 0
+        while position < len(data):
+            end = data.find(b"\n", position)
+            yield data[position:end + 1]
+            position = end + 1
+    
+    def close(self) -> None:
+        if isinstance(self._data, mmap.mmap):
+            self._data.close()
+        self._file.close()
+
+
+class LogIndex:
+    """Index of correlation_id, user_id, tenant_id and minute buckets to file offsets.
+    
+    Each update pass reads only bytes appended since the previous pass
+    (memory-mapped), and writes the new postings as one sorted run file.
+    Lookups binary-search every run, and runs are merged once there are
+    more than LOG_INDEX_MAX_RUNS of them. Log files are tracked by inode
+    and by a fingerprint of their first bytes, so segments renamed and
+    gzipped by the rotating handler keep their postings (offsets refer
+    to the uncompressed stream).
+    
+    Several processes may share one index (every service worker and the
+    log_search CLI): updates hold an exclusive flock on the index
+    directory and searches a shared one, and each reloads state.json
+    under the lock when another process has changed it. Services call
+    start_updates() so a background thread indexes new lines and
+    searches never pay for an update pass.
+    """
+    
+    def __init__(self, log_path: str = LOG_FILE_PATH, index_dir: str = LOG_INDEX_DIR,
+                 max_runs: int = LOG_INDEX_MAX_RUNS):
+        self.log_path = os.path.abspath(log_path)
+        self.index_dir = index_dir
+        self.max_runs = max_runs
+        self._lock = threading.Lock()
+        self._state_path = os.path.join(index_dir, "state.json")
+        self._lock_path = os.path.join(index_dir, ".lock")
+        self._state = {"next_file_id": 1, "next_run": 1, "files": {}, "runs": []}
+        self._state_signature = None
+        self._runs: List[IndexRun] = []
+        
+        self._thread: Optional[threading.Thread] = None
+        self._wakeup = threading.Event()
+        self._stopped = False
+        self.update_interval = LOG_INDEX_UPDATE_SECONDS
+        
+        # Counters (diagnostic only)
+        self.updates = 0
+        self.update_failures = 0
+    
+    @contextlib.contextmanager
+    def _locked(self, exclusive: bool):
+        """Hold the thread lock and the index directory flock, with state reloaded."""
+        with self._lock:
+            os.makedirs(self.index_dir, exist_ok=True)
+            with open(self._lock_path, "a+b") as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+                try:
+                    self._reload_state()
+                    yield
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+    
+    def _reload_state(self) -> None:
+        """Re-read state.json (and reopen runs) if another process replaced it."""
+        try:
+            stat = os.stat(self._state_path)
+        except FileNotFoundError:
+            return
+        signature = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        if signature == self._state_signature:
+            return
+        
+        with open(self._state_path, "r", encoding="utf-8") as state_file:
+            self._state = json.load(state_file)
+        self._state_signature = signature
+        
+        current = {os.path.basename(run.path): run for run in self._runs}
+        self._runs = []
+        for name in self._state["runs"]:
+            run = current.pop(name, None)
+            self._runs.append(run or IndexRun(os.path.join(self.index_dir, name)))
+        for run in current.values():
+            run.close()
+    
+    def _save_state(self) -> None:
+        """Persist state atomically (exclusive lock held)."""
+        temp_path = self._state_path + ".tmp"
+        with open(temp_path, "w", encoding="utf-8") as state_file:
+            json.dump(self._state, state_file)
+        os.replace(temp_path, self._state_path)
+        stat = os.stat(self._state_path)
+        self._state_signature = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+    
+    def _sync_files(self) -> List[str]:
+        """Match log files on disk to tracked files; return ids needing indexing."""
+        files = self._state["files"]
+        by_inode = {(entry["dev"], entry["inode"]): file_id for file_id, entry in files.items()}
+        by_path = {entry["path"]: file_id for file_id, entry in files.items()}
+        by_fingerprint = {entry.get("fingerprint"): file_id for file_id, entry in files.items()}
+        by_fingerprint.pop(None, None)
+        seen = set()
+        pending = []
+        
+        for path in [self.log_path] + sorted(glob.glob(glob.escape(self.log_path) + ".*")):
+            if path.endswith(".tmp") or not os.path.isfile(path):
+                continue
+            stat = os.stat(path)
+            compressed = path.endswith(".gz")
+            
+            if compressed:
+                # Compressed from a tracked plain segment, or a segment we have never seen
+                file_id = by_path.get(path) or by_path.get(path[:-3])
+            else:
+                file_id = by_inode.get((stat.st_dev, stat.st_ino))
+            
+            if file_id is None and by_fingerprint:
+                # Rotated (and possibly gzipped) between two update passes
+                file_id = by_fingerprint.get(_fingerprint(path, compressed))
+            
+            entry = files.get(file_id) if file_id else None
+            if entry is not None and not compressed and stat.st_size < entry["offset"]:
+                # Truncated in place: treat as a new file
+                entry = None
+            
+            if entry is None:
+                file_id = str(self._state["next_file_id"])
+                self._state["next_file_id"] += 1
+                entry = files[file_id] = {"offset": 0, "last_bucket": None}
+            
+            entry.update(path=path, dev=stat.st_dev, inode=stat.st_ino, compressed=compressed)
+            seen.add(file_id)
+            # Plain files are indexed as they grow; compressed segments once more
+            # in case lines were appended after the last pass before rotation
+            if compressed and not entry.get("complete") or not compressed and stat.st_size > entry["offset"]:
+                pending.append(file_id)
+        
+        # Segments removed by retention
+        for file_id in list(files):
+            if file_id not in seen:
+                del files[file_id]
+        return pending
+    
+    def _open_data(self, entry: dict):
+        """Open a log file's contents for indexing (mmap, or decompressed for gzip)."""
+        if entry["compressed"]:
+            with gzip.open(entry["path"], "rb") as source:
+                return source.read(), None
+        log_file = open(entry["path"], "rb")
+        return mmap.mmap(log_file.fileno(), 0, access=mmap.ACCESS_READ), log_file
+    
+    def _index_file(self, file_id: str, entry: dict, postings: List[bytes]) -> int:
+        """Collect postings for complete lines after the indexed offset."""
+        data, log_file = self._open_data(entry)
+        try:
+            position = entry["offset"]
+            last_bucket = entry["last_bucket"]
+            last_bucket = last_bucket.encode("ascii") if last_bucket else None
+            suffix_id = file_id.encode("ascii")
+            lines = 0
+            
+            while True:
+                end = data.find(b"\n", position)
+                if end < 0:
+                    break
+                line = data[position:end]
+                offset = str(position).encode("ascii")
+                
+                if line.startswith(_TIMESTAMP_PREFIX):
+                    bucket = line[_BUCKET_SLICE]
+                    if bucket != last_bucket:
+                        postings.append(b"ts\t" + bucket + b"\t" + suffix_id + b"\t" + offset + b"\n")
+                        last_bucket = bucket
+                    
+                    for match in _FIELD_PATTERN.finditer(line, 0, _header_end(line)):
+                        field = match.group(1)
+                        value = match.group(2) or match.group(3)
+                        if value is None:
+                            continue
+                        postings.append(field + b"\t" + value + b"\t" + suffix_id + b"\t" + offset + b"\n")
+                
+                position = end + 1
+                lines += 1
+            
+            if entry.get("fingerprint") is None and len(data) >= _FINGERPRINT_BYTES:
+                entry["fingerprint"] = hashlib.sha1(data[:_FINGERPRINT_BYTES]).hexdigest()
+            entry["offset"] = position
+            entry["complete"] = entry["compressed"]
+            entry["last_bucket"] = last_bucket.decode("ascii") if last_bucket else None
+            return lines
+        finally:
+            if log_file is not None:
+                data.close()
+                log_file.close()
+    
+    def update(self) -> Dict[str, int]:
+        """Index everything appended since the last update."""
+        with self._locked(exclusive=True):
+            postings: List[bytes] = []
+            lines = 0
+            files = self._state["files"]
+            
+            for file_id in self._sync_files():
+                lines += self._index_file(file_id, files[file_id], postings)
+            
+            if postings:
+                postings.sort()
+                name = f"run-{self._state['next_run']:08d}.idx"
+                self._state["next_run"] += 1
+                path = os.path.join(self.index_dir, name)
+                with open(path + ".tmp", "wb") as run_file:
+                    run_file.writelines(postings)
+                os.replace(path + ".tmp", path)
+                self._state["runs"].append(name)
+                self._runs.append(IndexRun(path))
+            
+            if len(self._runs) > self.max_runs:
+                self._compact()
+            
+            self._save_state()
+            return {"lines": lines, "postings": len(postings), "runs": len(self._runs)}
+    
+    def _compact(self) -> None:
+        """Merge all runs into one, dropping postings of deleted files."""
+        live = {file_id.encode("ascii") for file_id in self._state["files"]}
+        name = f"run-{self._state['next_run']:08d}.idx"
+        self._state["next_run"] += 1
+        path = os.path.join(self.index_dir, name)
+        
+        with open(path + ".tmp", "wb") as run_file:
+            for line in heapq.merge(*(run.lines() for run in self._runs)):
+                if line.split(b"\t", 3)[2] in live:
+                    run_file.write(line)
+        os.replace(path + ".tmp", path)
+        
+        for run in self._runs:
+            run.close()
+            os.remove(run.path)
+        self._runs = [IndexRun(path)]
+        self._state["runs"] = [name]
+    
+    def _read_lines(self, locations: List[Tuple[str, int]], limit: int,
+                    tenant: Optional[bytes] = None) -> List[dict]:
+        """Read the newest limit log lines at (file_id, offset) locations, oldest first.
+        
+        Only the kept lines are parsed; the rest are compared by their raw
+        timestamp prefix and dropped.
+        """
+        by_file: Dict[str, List[int]] = {}
+        for file_id, offset in locations:
+            by_file.setdefault(file_id, []).append(offset)
+        
+        newest: List[Tuple[bytes, int, bytes]] = []  # min-heap of (timestamp, sequence, line)
+        sequence = 0
+        for file_id, offsets in by_file.items():
+            entry = self._state["files"].get(file_id)
+            if entry is None:
+                continue
+            reader = _LogReader(entry)
+            try:
+                for offset in sorted(set(offsets)):
+                    for line in reader.lines_from(offset):
+                        if tenant is None or _line_tenant(line) == tenant:
+                            sequence += 1
+                            item = (_line_timestamp(line), sequence, bytes(line))
+                            if len(newest) < limit:
+                                heapq.heappush(newest, item)
+                            elif item > newest[0]:
+                                heapq.heapreplace(newest, item)
+                        break
+            finally:
+                reader.close()
+        
+        return [json.loads(line) for _, _, line in sorted(newest)]
+    
+    def lookup(self, field: str, value: str, limit: int = 1000, tenant_id: Optional[str] = None) -> List[dict]:
+        """Find the newest log entries whose top-level field equals value.
+        
+        With tenant_id, only entries logged for that tenant are returned.
+        """
+        if field not in INDEXED_FIELDS:
+            raise ValueError(f"Field is not indexed: {field}")
+        
+        prefix = f"{field}\t{value}\t".encode("utf-8")
+        tenant = tenant_id.encode("utf-8") if tenant_id is not None else None
+        with self._locked(exclusive=False):
+            locations = [
+                (parts[2].decode("ascii"), int(parts[3]))
+                for run in self._runs for parts in run.scan(prefix)
+            ]
+            return self._read_lines(locations, limit, tenant)
+    
+    def time_range(self, start: datetime, end: datetime, limit: int = 1000,
+                   tenant_id: Optional[str] = None) -> List[dict]:
+        """Find log entries with start <= timestamp <= end (naive UTC datetimes).
+        
+        With tenant_id, only entries logged for that tenant are returned.
+        """
+        start_key, end_key = start.isoformat(), end.isoformat()
+        low = f"ts\t{start_key[:16]}\t".encode("ascii")
+        high = f"ts\t{end_key[:16]}\t~".encode("ascii")
+        tenant = tenant_id.encode("utf-8") if tenant_id is not None else None
+        
+        with self._locked(exclusive=False):
+            # Earliest bucket offset per file within the range
+            first_offsets: Dict[str, int] = {}
+            for run in self._runs:
+                for parts in run.scan(low, high):
+                    file_id, offset = parts[2].decode("ascii"), int(parts[3])
+                    first_offsets[file_id] = min(offset, first_offsets.get(file_id, offset))
+            
+            entries = []
+            for file_id, offset in sorted(first_offsets.items()):
+                entry = self._state["files"].get(file_id)
+                if entry is None:
+                    continue
+                reader = _LogReader(entry)
+                try:
+                    for line in reader.lines_from(offset):
+                        if len(entries) >= limit:
+                            break
+                        timestamp = _line_timestamp(line).decode("ascii", "replace")
+                        if timestamp > end_key:
+                            break
+                        if timestamp >= start_key and (tenant is None or _line_tenant(line) == tenant):
+                            entries.append(json.loads(line))
+                finally:
+                    reader.close()
+            
+            entries.sort(key=lambda item: item.get("timestamp", ""))
+            return entries[:limit]
+    
+    def start_updates(self, interval: float = LOG_INDEX_UPDATE_SECONDS) -> None:
+        """Index new lines in a background thread every interval seconds."""
+        self.update_interval = interval
+        with self._lock:
+            if not self._stopped and (self._thread is None or not self._thread.is_alive()):
+                self._thread = threading.Thread(
+                    target=self._run, name="aems-log-indexer", daemon=True
+                )
+                self._thread.start()
+    
+    def _run(self) -> None:
+        """Run update passes until stopped."""
+        while not self._stopped:
+            try:
+                self.update()
+                self.updates += 1
+            except Exception as e:
+                # Searches keep using the postings indexed so far
+                self.update_failures += 1
+                logger.warning(f"Failed to update log index: {e}")
+            self._wakeup.wait(self.update_interval)
+            self._wakeup.clear()
+    
+    def shutdown(self, timeout: float = 1.0) -> None:
+        """Stop the update thread."""
+        self._stopped = True
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+    
+    def stats(self) -> Dict[str, int]:
+        """Get update counters."""
+        return {
+            "runs": len(self._runs),
+            "files": len(self._state["files"]),
+            "updates": self.updates,
+            "update_failures": self.update_failures
+        }
+    
+    def close(self) -> None:
+        """Release run memory maps."""
+        self.shutdown()
+        with self._lock:
+            for run in self._runs:
+                run.close()
+            self._runs = []
@@ -4,52 +4,179 @@ Structured logging utilities for A-EMS microservices.
 
 import logging
 import json
-import uuid
-from datetime import datetime
-from typing import Dict, Any, Optional
+import time
+from typing import Dict, Any, List, Optional
 import os
 import sys
+import threading
+from .correlation import get_correlation_id
+from .handlers import RotatingCompressedFileHandler
+from .pipeline import AsyncLogHandler, LOG_ASYNC_ENABLED
+from .redaction import LOG_REDACTION_ENABLED, Redactor, redactor as default_redactor
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# JSON encoder backend: "json" (stdlib, default) or "orjson" when installed
+LOG_JSON_BACKEND = os.getenv("LOG_JSON_BACKEND", "json")
+
+
+def _orjson_dumps(value: Any) -> str:
+    """Encode a value with orjson."""
+    return orjson.dumps(value, default=str).decode("utf-8")
+
+
+def _make_stdlib_dumps():
+    """Build a json.dumps()-compatible encoder with per-call setup hoisted out."""
+    encoder = json.JSONEncoder(default=str)
+    encode_str = json.encoder.encode_basestring_ascii
+    c_make_encoder = json.encoder.c_make_encoder
+    if c_make_encoder is None:
+        return encoder.encode
+    
+    iterencode = c_make_encoder(
+        None, encoder.default, encode_str, None,
+        encoder.key_separator, encoder.item_separator, False, False, True
+    )
+    
+    def dumps(value: Any) -> str:
+        if value.__class__ is str:
+            return encode_str(value)
+        if value is None:
+            return "null"
+        return "".join(iterencode(value, 0))
+    
+    return dumps
 
 
 class JSONFormatter(logging.Formatter):
-    """JSON formatter for structured logging."""
+    """JSON formatter for structured logging.
+    
+    Static service fields are encoded once, the per-second part of the
+    timestamp is cached and the entry is assembled from pre-encoded key
+    fragments instead of building and dumping a dict for every record.
+    """
+    
+    _CACHE_LIMIT = 4096
+    
+    def __init__(self, *args, backend: Optional[str] = None,
+                 redactor: Optional[Redactor] = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        backend = (backend or LOG_JSON_BACKEND).lower()
+        
+        # Sensitive values are masked in messages and extra data
+        if redactor is None and LOG_REDACTION_ENABLED:
+            redactor = default_redactor
+        self._redactor = redactor
+        
+        if backend == "orjson" and orjson is not None:
+            # Compact separators and raw UTF-8: same schema, different bytes
+            self._dumps = _orjson_dumps
+            item_sep, key_sep = ",", ":"
+        else:
+            # Matches json.dumps() defaults byte for byte
+            self._dumps = _make_stdlib_dumps()
+            item_sep, key_sep = ", ", ": "
+        
+        def key(name: str, first: bool = False) -> str:
+            return ("{" if first else item_sep) + self._dumps(name) + key_sep
+        
+        self._key_timestamp = key("timestamp", first=True)
+        self._key_level = key("level")
+        self._key_logger = key("logger")
+        self._key_message = key("message")
+        self._key_module = key("module")
+        self._key_function = key("function")
+        self._key_line = key("line")
+        self._key_correlation_id = key("correlation_id")
+        self._key_user_id = key("user_id")
+        self._key_tenant_id = key("tenant_id")
+        self._key_exception = key("exception")
+        self._key_extra = key("extra")
+        
+        # Service context never changes within a process
+        self._service_fields = (
+            key("service") + self._dumps(os.getenv("SERVICE_NAME", "unknown")) +
+            key("version") + self._dumps(os.getenv("SERVICE_VERSION", "dev"))
+        )
+        
+        self._encoded_cache: Dict[Any, str] = {}
+        self._timestamp_cache = (None, "")
+    
+    def _encode_cached(self, value: Any) -> str:
+        """Encode a frequently repeated value (logger, module, level names)."""
+        encoded = self._encoded_cache.get(value)
+        if encoded is None:
+            if len(self._encoded_cache) >= self._CACHE_LIMIT:
+                self._encoded_cache = {}
+            encoded = self._encoded_cache[value] = self._dumps(value)
+        return encoded
+    
+    def _format_timestamp(self, created: float) -> str:
+        """Format record time like datetime.isoformat(), caching the seconds part."""
+        seconds = int(created)
+        microseconds = round((created - seconds) * 1_000_000)
+        if microseconds >= 1_000_000:
+            seconds += 1
+            microseconds -= 1_000_000
+        
+        cached_seconds, prefix = self._timestamp_cache
+        if seconds != cached_seconds:
+            prefix = '"' + time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(seconds))
+            self._timestamp_cache = (seconds, prefix)
+        
+        if microseconds:
+            return f'{prefix}.{microseconds:06d}"'
+        return prefix + '"'
     
     def format(self, record: logging.LogRecord) -> str:
         """Format log record as JSON."""
-        log_entry = {
-            "timestamp": datetime.utcnow().isoformat(),
-            "level": record.levelname,
-            "logger": record.name,
-            "message": record.getMessage(),
-            "module": record.module,
-            "function": record.funcName,
-            "line": record.lineno,
-        }
+        encode = self._encode_cached
+        redactor = self._redactor
+        
+        message = record.getMessage()
+        if redactor is not None:
+            message = redactor.redact_string(message)
+        
+        parts = [
+            self._key_timestamp, self._format_timestamp(record.created),
+            self._key_level, encode(record.levelname),
+            self._key_logger, encode(record.name),
+            self._key_message, self._dumps(message),
+            self._key_module, encode(record.module),
+            self._key_function, encode(record.funcName),
+            self._key_line, str(record.lineno),
+        ]
         
         # Add correlation ID if available
         if hasattr(record, 'correlation_id'):
-            log_entry["correlation_id"] = record.correlation_id
+            parts += (self._key_correlation_id, self._dumps(record.correlation_id))
         
         # Add user context if available
         if hasattr(record, 'user_id'):
-            log_entry["user_id"] = record.user_id
+            parts += (self._key_user_id, self._dumps(record.user_id))
         
         if hasattr(record, 'tenant_id'):
-            log_entry["tenant_id"] = record.tenant_id
+            parts += (self._key_tenant_id, self._dumps(record.tenant_id))
         
         # Add service context
-        log_entry["service"] = os.getenv("SERVICE_NAME", "unknown")
-        log_entry["version"] = os.getenv("SERVICE_VERSION", "dev")
+        parts.append(self._service_fields)
         
         # Add exception info if present
         if record.exc_info:
-            log_entry["exception"] = self.formatException(record.exc_info)
+            parts += (self._key_exception, self._dumps(self.formatException(record.exc_info)))
         
         # Add any extra fields
         if hasattr(record, 'extra_data'):
-            log_entry["extra"] = record.extra_data
+            extra_data = record.extra_data
+            if redactor is not None:
+                extra_data = redactor.redact(extra_data)
+            parts += (self._key_extra, self._dumps(extra_data))
         
-        return json.dumps(log_entry)
+        parts.append("}")
+        return "".join(parts)
 
 
 class CorrelationFilter(logging.Filter):
@@ -57,64 +184,149 @@ class CorrelationFilter(logging.Filter):
     
     def filter(self, record: logging.LogRecord) -> bool:
         """Add correlation ID to record if not present."""
-        if not hasattr(record, 'correlation_id'):
-            record.correlation_id = getattr(self, '_correlation_id', str(uuid.uuid4()))
+        if getattr(record, 'correlation_id', None) is None:
+            record.correlation_id = get_correlation_id() or getattr(self, '_correlation_id', None)
         return True
 
 
-class AEMSLogger:
-    """Enhanced logger for A-EMS services."""
+class LoggingConfig:
+    """Process-wide logging configuration shared by every AEMSLogger.
     
-    def __init__(self, name: str):
-        self.logger = logging.getLogger(name)
-        self.correlation_id: Optional[str] = None
-        self._setup_logger()
+    Handlers are built once, on first use, and shared by all loggers;
+    loggers are cached by name so repeated get_logger() calls are cheap.
+    """
     
-    def _setup_logger(self):
-        """Setup logger configuration."""
-        # Set log level from environment
-        log_level = os.getenv("LOG_LEVEL", "INFO").upper()
-        self.logger.setLevel(getattr(logging, log_level))
-        
-        # Remove existing handlers
-        self.logger.handlers.clear()
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._handlers: Optional[List[logging.Handler]] = None
+        self._loggers: Dict[str, "AEMSLogger"] = {}
+        self.level = getattr(logging, os.getenv("LOG_LEVEL", "INFO").upper())
+    
+    def _build_handlers(self) -> List[logging.Handler]:
+        """Create the process-wide handlers."""
+        handlers = []
         
         # Create console handler
         console_handler = logging.StreamHandler(sys.stdout)
         console_handler.setFormatter(JSONFormatter())
         console_handler.addFilter(CorrelationFilter())
-        self.logger.addHandler(console_handler)
+        handlers.append(console_handler)
         
         # File handler for production
         if os.getenv("ENVIRONMENT") == "production":
-            file_handler = logging.FileHandler("/var/log/aems/application.log")
+            file_handler = RotatingCompressedFileHandler()
             file_handler.setFormatter(JSONFormatter())
             file_handler.addFilter(CorrelationFilter())
-            self.logger.addHandler(file_handler)
+            handlers.append(file_handler)
+        
+        # Write through the background pipeline so logging never blocks the caller
+        if LOG_ASYNC_ENABLED:
+            return [AsyncLogHandler(handlers)]
+        return handlers
+    
+    def get_handlers(self) -> List[logging.Handler]:
+        """Get shared handlers, building them on first use."""
+        handlers = self._handlers
+        if handlers is None:
+            with self._lock:
+                if self._handlers is None:
+                    self._handlers = self._build_handlers()
+                handlers = self._handlers
+        return handlers
+    
+    def get_logger(self, name: str) -> "AEMSLogger":
+        """Get the cached logger for a name, creating it if needed."""
+        aems_logger = self._loggers.get(name)
+        if aems_logger is None:
+            with self._lock:
+                aems_logger = self._loggers.get(name)
+                if aems_logger is None:
+                    aems_logger = self._loggers[name] = AEMSLogger(name)
+        return aems_logger
+    
+    def set_level(self, level: str, name: Optional[str] = None) -> None:
+        """Change log level at runtime for one logger or all of them."""
+        level_value = getattr(logging, level.upper())
+        with self._lock:
+            if name is None:
+                self.level = level_value
+                targets = list(self._loggers.values())
+            else:
+                targets = [self.get_logger(name)]
+        
+        for aems_logger in targets:
+            aems_logger.logger.setLevel(level_value)
+    
+    def close(self) -> None:
+        """Close shared handlers; they are rebuilt on next use."""
+        with self._lock:
+            handlers, self._handlers = self._handlers, None
+            for aems_logger in self._loggers.values():
+                aems_logger._configured = False
+        
+        for handler in handlers or []:
+            handler.close()
+
+
+class AEMSLogger:
+    """Enhanced logger for A-EMS services."""
+    
+    def __init__(self, name: str):
+        self.logger = logging.getLogger(name)
+        self.correlation_id: Optional[str] = None
+        self._configured = False
+    
+    def _setup_logger(self):
+        """Setup logger configuration (runs lazily on first log call)."""
+        handlers = logging_config.get_handlers()
+        
+        # Keep a level already set through set_log_level()
+        if self.logger.level == logging.NOTSET:
+            self.logger.setLevel(logging_config.level)
+        
+        # Attach the shared handlers
+        if self.logger.handlers != handlers:
+            self.logger.handlers.clear()
+            for handler in handlers:
+                self.logger.addHandler(handler)
         
         # Prevent propagation to root logger
         self.logger.propagate = False
+        self._configured = True
     
     def set_correlation_id(self, correlation_id: str):
         """Set correlation ID for current context."""
         self.correlation_id = correlation_id
         # Update filter
-        for handler in self.logger.handlers:
-            for filter_obj in handler.filters:
-                if isinstance(filter_obj, CorrelationFilter):
-                    filter_obj._correlation_id = correlation_id
+        for handler in logging_config.get_handlers():
+            for target in getattr(handler, "handlers", [handler]):
+                for filter_obj in target.filters:
+                    if isinstance(filter_obj, CorrelationFilter):
+                        filter_obj._correlation_id = correlation_id
     
     def _log(self, level: int, message: str, extra_data: Optional[Dict[str, Any]] = None, 
-             user_id: Optional[str] = None, tenant_id: Optional[str] = None):
-        """Internal logging method."""
+             user_id: Optional[str] = None, tenant_id: Optional[str] = None,
+             created: Optional[float] = None):
+        """Internal logging method (created back-dates the entry, as a time.time() value)."""
+        if not self._configured:
+            self._setup_logger()
+        
+        # Capture the request's ID now; records may be formatted on another thread
         extra = {
-            'correlation_id': self.correlation_id,
+            'correlation_id': get_correlation_id() or self.correlation_id,
             'extra_data': extra_data or {},
             'user_id': user_id,
             'tenant_id': tenant_id
         }
         
-        self.logger.log(level, message, extra=extra)
+        if created is None:
+            self.logger.log(level, message, extra=extra)
+        elif self.logger.isEnabledFor(level):
+            # Deferred entries (e.g. a sampled request start) carry the time the event happened
+            record = self.logger.makeRecord(self.logger.name, level, __file__, 0, message, None, None, "_log", extra)
+            record.created = created
+            record.msecs = (created - int(created)) * 1000
+            self.logger.handle(record)
     
     def debug(self, message: str, extra_data: Optional[Dict[str, Any]] = None, 
               user_id: Optional[str] = None, tenant_id: Optional[str] = None):
@@ -122,9 +334,10 @@ class AEMSLogger:
         self._log(logging.DEBUG, message, extra_data, user_id, tenant_id)
     
     def info(self, message: str, extra_data: Optional[Dict[str, Any]] = None,
-             user_id: Optional[str] = None, tenant_id: Optional[str] = None):
+             user_id: Optional[str] = None, tenant_id: Optional[str] = None,
+             created: Optional[float] = None):
         """Log info message."""
-        self._log(logging.INFO, message, extra_data, user_id, tenant_id)
+        self._log(logging.INFO, message, extra_data, user_id, tenant_id, created)
     
     def warning(self, message: str, extra_data: Optional[Dict[str, Any]] = None,
                 user_id: Optional[str] = None, tenant_id: Optional[str] = None):
@@ -198,9 +411,18 @@ class AEMSLogger:
         self.info(message, event_data, user_id, tenant_id)
 
 
+# Global logging configuration
+logging_config = LoggingConfig()
+
+
 def get_logger(name: str) -> AEMSLogger:
     """Get logger instance for a module."""
-    return AEMSLogger(name)
+    return logging_config.get_logger(name)
+
+
+def set_log_level(level: str, name: Optional[str] = None) -> None:
+    """Change log level at runtime without rebuilding loggers."""
+    logging_config.set_level(level, name)
 
 
 # Module-level logger
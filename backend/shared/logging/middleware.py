@@ -2,27 +2,34 @@
 Logging middleware for FastAPI applications.
 """
 
+import math
 import time
 from typing import Callable
 from fastapi import Request, Response
 from starlette.middleware.base import BaseHTTPMiddleware
 from .logger import get_logger
 from .correlation import correlation_manager
+from .events import EventAggregator, event_aggregator
+from .sampling import RequestLogSampler, request_log_sampler
+from .timing import timed_phase
 
 logger = get_logger(__name__)
 
 
 class LoggingMiddleware(BaseHTTPMiddleware):
-    """Middleware for request/response logging with correlation IDs."""
+    """Middleware for request/response logging with correlation IDs.
     
-    async def dispatch(self, request: Request, call_next: Callable) -> Response:
-        """Process request and response with logging."""
-        start_time = time.time()
-        
-        # Start correlation ID tracking
-        correlation_id = correlation_manager.start_request(request)
-        
-        # Log request
+    Request logs are sampled tail-first: the start entry is only built
+    once the request has finished and the sampler has decided to keep it,
+    and it is stamped with the time the request actually started.
+    """
+    
+    def __init__(self, app, sampler: RequestLogSampler = None):
+        super().__init__(app)
+        self.sampler = sampler or request_log_sampler
+    
+    def _log_request_start(self, request: Request, start_time: float) -> None:
+        """Log the (deferred) request start entry, back-dated to start_time."""
         logger.info(
             f"Request started: {request.method} {request.url.path}",
             extra_data={
@@ -33,8 +40,16 @@ class LoggingMiddleware(BaseHTTPMiddleware):
                 "headers": dict(request.headers),
                 "client_ip": request.client.host if request.client else None,
                 "type": "request_start"
-            }
+            },
+            created=start_time
         )
+    
+    async def dispatch(self, request: Request, call_next: Callable) -> Response:
+        """Process request and response with logging."""
+        start_time = time.time()
+        
+        # Reuse the ID set by CorrelationIDMiddleware, or start tracking here
+        correlation_id = correlation_manager.get_current_id() or correlation_manager.start_request(request)
         
         try:
             # Process request
@@ -43,13 +58,16 @@ class LoggingMiddleware(BaseHTTPMiddleware):
             # Calculate duration
             duration = time.time() - start_time
             
-            # Log response
-            logger.log_api_request(
-                method=request.method,
-                path=request.url.path,
-                status_code=response.status_code,
-                duration=duration
-            )
+            # Log request and response if sampled
+            with timed_phase("logging"):
+                if self.sampler.should_log(request.url.path, response.status_code, duration * 1000):
+                    self._log_request_start(request, start_time)
+                    logger.log_api_request(
+                        method=request.method,
+                        path=request.url.path,
+                        status_code=response.status_code,
+                        duration=duration
+                    )
             
             # Add correlation ID to response headers
             response.headers["X-Correlation-ID"] = correlation_id
@@ -61,7 +79,9 @@ class LoggingMiddleware(BaseHTTPMiddleware):
             # Calculate duration for error case
             duration = time.time() - start_time
             
-            # Log error
+            # Errors are always logged
+            self.sampler.should_log(request.url.path, 500, duration * 1000, error=True)
+            self._log_request_start(request, start_time)
             logger.error(
                 f"Request failed: {request.method} {request.url.path}",
                 extra_data={
@@ -101,15 +121,51 @@ class DatabaseLoggingMixin:
 
 
 class BusinessEventLogger:
-    """Logger for business events and analytics."""
+    """Logger for business events and analytics.
     
-    def __init__(self):
+    With an aggregator, events are rolled up per window; user actions
+    (BUSINESS_EVENTS_RAW_EVENTS) are still logged one by one, other
+    events only as a sample. Without one every event is logged.
+    """
+    
+    def __init__(self, aggregator: EventAggregator = None):
         self.logger = get_logger("business_events")
+        self.aggregator = aggregator or event_aggregator
+    
+    def _emit(self, event: str, resource: str, action: str, user_id: str = None,
+              tenant_id: str = None, extra_data: dict = None):
+        """Aggregate an event and log it raw if sampled (or not aggregating)."""
+        if self.aggregator is not None:
+            duration_ms = None
+            values = {}
+            for name, value in (extra_data or {}).items():
+                if name == "duration_ms":
+                    # Caller-supplied; a bad value must not break the request
+                    try:
+                        duration_ms = float(value)
+                    except (TypeError, ValueError):
+                        duration_ms = None
+                    if duration_ms is not None and not math.isfinite(duration_ms):
+                        duration_ms = None
+                elif isinstance(value, (int, float)) and not isinstance(value, bool):
+                    values[name] = value
+            
+            if not self.aggregator.record(event, resource, action, tenant_id, duration_ms, values):
+                return
+        
+        self.logger.log_business_event(
+            event=event,
+            resource=resource,
+            action=action,
+            user_id=user_id,
+            tenant_id=tenant_id,
+            extra_data=extra_data
+        )
     
     def log_user_action(self, user_id: str, action: str, resource: str, 
                        tenant_id: str = None, extra_data: dict = None):
         """Log user business actions."""
-        self.logger.log_business_event(
+        self._emit(
             event="user_action",
             resource=resource,
             action=action,
@@ -120,7 +176,7 @@ class BusinessEventLogger:
     
     def log_system_event(self, event: str, description: str, extra_data: dict = None):
         """Log system events."""
-        self.logger.log_business_event(
+        self._emit(
             event="system_event",
             resource="system",
             action=event,
@@ -133,7 +189,7 @@ class BusinessEventLogger:
     def log_ai_interaction(self, user_id: str, query: str, response_type: str,
                           duration: float, tenant_id: str = None):
         """Log AI chat interactions."""
-        self.logger.log_business_event(
+        self._emit(
             event="ai_interaction",
             resource="ai_chat",
             action="query",
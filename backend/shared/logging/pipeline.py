@@ -0,0 +1,257 @@
+"""
+Background log pipeline that keeps log I/O off the request path.
+"""
+
+import atexit
+import logging
+import os
+import queue
+import threading
+from typing import Dict, List, Optional, Tuple
+
+
+# Pipeline configuration
+LOG_ASYNC_ENABLED = os.getenv("LOG_ASYNC", "true").lower() == "true"
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+LOG_QUEUE_POLICY = os.getenv("LOG_QUEUE_POLICY", "drop").lower()  # "drop" or "block"
+LOG_QUEUE_BLOCK_TIMEOUT = float(os.getenv("LOG_QUEUE_BLOCK_TIMEOUT", "1.0"))
+LOG_BATCH_SIZE = int(os.getenv("LOG_BATCH_SIZE", "256"))
+
+_STOP = object()
+
+
+class _FlushMarker:
+    """Queue marker signalled once every record before it is written."""
+    
+    __slots__ = ("event",)
+    
+    def __init__(self):
+        self.event = threading.Event()
+
+
+class LogPipeline:
+    """Bounded queue drained in batches by a background writer thread."""
+    
+    def __init__(self, maxsize: int = LOG_QUEUE_SIZE, policy: str = LOG_QUEUE_POLICY,
+                 batch_size: int = LOG_BATCH_SIZE):
+        if policy not in ("drop", "block"):
+            raise ValueError(f"Unknown log queue policy: {policy}")
+        self.maxsize = maxsize
+        self.policy = policy
+        self.batch_size = batch_size
+        self._queue: queue.Queue = queue.Queue(maxsize)
+        self._thread: Optional[threading.Thread] = None
+        self._start_lock = threading.Lock()
+        self._stopped = False
+        
+        # Counters (diagnostic only, updated without locking)
+        self.enqueued = 0
+        self.dropped = 0
+        self.written = 0
+        self.batches = 0
+    
+    def _ensure_started(self) -> None:
+        """Start the writer thread on first use."""
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self._run, name="aems-log-writer", daemon=True
+                )
+                self._thread.start()
+    
+    def enqueue(self, handler: "AsyncLogHandler", record: logging.LogRecord) -> None:
+        """Hand a record to the writer thread without doing any I/O."""
+        if self._stopped:
+            # Pipeline already shut down: write synchronously
+            _write_batch(handler.handlers, [record])
+            return
+        
+        if self._thread is None:
+            self._ensure_started()
+        
+        item = (handler, record)
+        try:
+            if self.policy == "block":
+                self._queue.put(item, timeout=LOG_QUEUE_BLOCK_TIMEOUT)
+            else:
+                self._queue.put_nowait(item)
+            self.enqueued += 1
+        except queue.Full:
+            self.dropped += 1
+    
+    def _run(self) -> None:
+        """Writer thread main loop."""
+        while True:
+            item = self._queue.get()
+            batch = [item]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            
+            if self._process(batch):
+                return
+    
+    def _process(self, batch: list) -> bool:
+        """Write a batch, honouring flush and stop markers. Returns True on stop."""
+        pending: List[Tuple["AsyncLogHandler", logging.LogRecord]] = []
+        stop = False
+        
+        for item in batch:
+            if item is _STOP:
+                stop = True
+            elif isinstance(item, _FlushMarker):
+                self._write_pending(pending)
+                pending = []
+                item.event.set()
+            else:
+                pending.append(item)
+        
+        self._write_pending(pending)
+        return stop
+    
+    def _write_pending(self, pending: List[Tuple["AsyncLogHandler", logging.LogRecord]]) -> None:
+        """Group pending records by target handlers and write them."""
+        if not pending:
+            return
+        
+        grouped: Dict[int, Tuple[list, List[logging.LogRecord]]] = {}
+        for handler, record in pending:
+            entry = grouped.get(id(handler))
+            if entry is None:
+                entry = grouped[id(handler)] = (handler.handlers, [])
+            entry[1].append(record)
+        
+        for targets, records in grouped.values():
+            _write_batch(targets, records)
+        
+        self.written += len(pending)
+        self.batches += 1
+    
+    def flush(self, timeout: float = 5.0) -> bool:
+        """Wait until every record queued so far has been written."""
+        if self._stopped or self._thread is None or not self._thread.is_alive():
+            return True
+        
+        marker = _FlushMarker()
+        try:
+            self._queue.put(marker, timeout=timeout)
+        except queue.Full:
+            return False
+        return marker.event.wait(timeout)
+    
+    def shutdown(self, timeout: float = 5.0) -> None:
+        """Drain the queue and stop the writer thread."""
+        if self._stopped:
+            return
+        
+        thread = self._thread
+        if thread is not None and thread.is_alive():
+            try:
+                self._queue.put(_STOP, timeout=timeout)
+                thread.join(timeout)
+            except queue.Full:
+                pass
+        self._stopped = True
+    
+    def _reset_after_fork(self) -> None:
+        """Start fresh in a forked child; the writer thread does not survive fork."""
+        self._queue = queue.Queue(self.maxsize)
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._stopped = False
+    
+    def stats(self) -> dict:
+        """Get pipeline counters."""
+        return {
+            "enqueued": self.enqueued,
+            "dropped": self.dropped,
+            "written": self.written,
+            "batches": self.batches,
+            "queue_depth": self._queue.qsize(),
+            "queue_size": self.maxsize,
+            "policy": self.policy
+        }
+
+
+def _write_batch(targets: list, records: List[logging.LogRecord]) -> None:
+    """Format records for each target handler and write them in one call."""
+    for target in targets:
+        # Handlers that batch their own writes (e.g. the rotating file handler)
+        emit_batch = getattr(target, "emit_batch", None)
+        if emit_batch is not None:
+            emit_batch(records)
+            continue
+        
+        stream = getattr(target, "stream", None)
+        if not isinstance(target, logging.StreamHandler) or stream is None:
+            for record in records:
+                if record.levelno >= target.level:
+                    target.handle(record)
+            continue
+        
+        lines = []
+        for record in records:
+            if record.levelno < target.level or not target.filter(record):
+                continue
+            try:
+                lines.append(target.format(record) + target.terminator)
+            except Exception:
+                target.handleError(record)
+        
+        if not lines:
+            continue
+        
+        target.acquire()
+        try:
+            stream.write("".join(lines))
+            target.flush()
+        except Exception:
+            target.handleError(records[-1])
+        finally:
+            target.release()
+
+
+class AsyncLogHandler(logging.Handler):
+    """Handler that enqueues records for the background log pipeline."""
+    
+    def __init__(self, handlers: list, pipeline: Optional[LogPipeline] = None):
+        super().__init__()
+        self.handlers = handlers
+        self.pipeline = pipeline or log_pipeline
+    
+    def handle(self, record: logging.LogRecord) -> bool:
+        """Filter and enqueue without taking the handler lock."""
+        rv = self.filter(record)
+        if rv:
+            self.emit(record)
+        return rv
+    
+    def emit(self, record: logging.LogRecord) -> None:
+        """Enqueue record for the writer thread."""
+        self.pipeline.enqueue(self, record)
+    
+    def flush(self) -> None:
+        """Wait for queued records to be written."""
+        self.pipeline.flush()
+    
+    def close(self) -> None:
+        """Close the wrapped handlers."""
+        for handler in self.handlers:
+            handler.close()
+        super().close()
+
+
+# Global log pipeline
+log_pipeline = LogPipeline()
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=log_pipeline._reset_after_fork)
+
+atexit.register(log_pipeline.shutdown)
+
+
+def shutdown_logging(timeout: float = 5.0) -> None:
+    """Flush and stop the log pipeline (call from application shutdown)."""
+    log_pipeline.shutdown(timeout)
@@ -0,0 +1,182 @@
+"""
+Sensitive-data redaction for structured log payloads.
+"""
+
+import os
+import re
+from typing import Any, Dict, Iterable, Optional, Set
+
+
+# Redaction configuration
+LOG_REDACTION_ENABLED = os.getenv("LOG_REDACTION", "true").lower() == "true"
+
+# Key names (case-insensitive substrings) whose values are always masked
+DEFAULT_SENSITIVE_KEYS = (
+    "password", "passwd", "secret", "api_key", "apikey", "x-api-key",
+    "authorization", "cookie", "credential", "private_key", "access_key", "mfa_backup_codes"
+)
+
+# Key names matched only at the end of a key: "access_token" and "csrfToken"
+# are masked, "token_type", "tokens_used" and "max_tokens" are not
+DEFAULT_SENSITIVE_KEY_SUFFIXES = ("token",)
+
+# Value patterns masked wherever they appear inside strings
+DEFAULT_VALUE_PATTERNS = {
+    "jwt": r"eyJ[A-Za-z0-9_-]{5,}\.[A-Za-z0-9_-]{5,}\.[A-Za-z0-9_-]*",
+    "bearer": r"(?i:bearer)\s+[A-Za-z0-9._~+/-]{8,}=*",
+    # Candidate digit runs; issuer prefix, length and Luhn checksum are verified on match
+    "card": r"[0-9][0-9 -]{11,}[0-9]",
+}
+
+# Card issuer prefix ranges (IIN) with the lengths each network issues
+_CARD_RANGES = (
+    ("4", "4", (13, 16, 19)),  # Visa
+    ("51", "55", (16,)),  # Mastercard
+    ("2221", "2720", (16,)),  # Mastercard 2-series
+    ("34", "34", (15,)),  # American Express
+    ("37", "37", (15,)),
+    ("6011", "6011", (16, 19)),  # Discover
+    ("644", "649", (16, 19)),
+    ("65", "65", (16, 19)),
+    ("3528", "3589", (16, 19)),  # JCB
+    ("300", "305", (14,)),  # Diners Club
+    ("36", "36", (14,)),
+    ("38", "39", (14, 16)),
+    ("62", "62", (16, 19)),  # UnionPay
+)
+
+REDACTED = "***"
+
+# Strings shorter than this cannot contain any default value pattern
+_MIN_PATTERN_LENGTH = 13
+
+# Bounds for the cache of strings known to contain nothing sensitive
+_CLEAN_CACHE_SIZE = 8192
+_CLEAN_CACHE_MAX_LENGTH = 256
+
+
+def _card_number_valid(number: str) -> bool:
+    """Check a card number candidate's issuer prefix, length and Luhn checksum.
+    
+    The prefix check keeps Luhn-valid IDs that no card network issues
+    (one digit run in ten passes Luhn by chance) out of the redaction.
+    """
+    text = "".join(char for char in number if char.isdigit())
+    if not any(
+        first <= text[:len(first)] <= last and len(text) in lengths
+        for first, last, lengths in _CARD_RANGES
+    ):
+        return False
+    checksum = 0
+    for index, digit in enumerate(int(char) for char in reversed(text)):
+        if index % 2:
+            digit *= 2
+            if digit > 9:
+                digit -= 9
+        checksum += digit
+    return checksum % 10 == 0
+
+
+class Redactor:
+    """Redaction engine compiled once from a key/value policy.
+    
+    Sensitive key names (substrings, or suffixes such as "token") are
+    matched by a single compiled alternation and cached per key. Each
+    value pattern is compiled on its own so literal prefixes (such as
+    "eyJ" for JWTs) keep the regex scan fast. Nested
+    structures are walked in one pass and only the containers that
+    actually change are copied; untouched subtrees are returned as-is.
+    """
+    
+    def __init__(self, sensitive_keys: Iterable[str] = DEFAULT_SENSITIVE_KEYS,
+                 value_patterns: Optional[Dict[str, str]] = None,
+                 mask: str = REDACTED,
+                 sensitive_key_suffixes: Iterable[str] = DEFAULT_SENSITIVE_KEY_SUFFIXES):
+        keys = sorted({key.lower() for key in sensitive_keys}, key=len, reverse=True)
+        alternatives = [re.escape(key) for key in keys]
+        alternatives.extend(re.escape(suffix.lower()) + "$" for suffix in sensitive_key_suffixes)
+        self._key_pattern = re.compile("|".join(alternatives)) if alternatives else None
+        
+        patterns = DEFAULT_VALUE_PATTERNS if value_patterns is None else value_patterns
+        self._value_patterns = [
+            (re.compile(pattern), self._make_replacer(name)) for name, pattern in patterns.items()
+        ]
+        
+        self.mask = mask
+        self._key_cache: Dict[str, bool] = {}
+        # Short strings already known to be clean (header values repeat a lot)
+        self._clean_strings: Set[str] = set()
+    
+    def is_sensitive_key(self, key: Any) -> bool:
+        """Check whether values under this key must be masked."""
+        cached = self._key_cache.get(key)
+        if cached is None:
+            cached = bool(
+                self._key_pattern is not None and isinstance(key, str)
+                and self._key_pattern.search(key.lower())
+            )
+            if len(self._key_cache) < 4096:
+                self._key_cache[key] = cached
+        return cached
+    
+    @staticmethod
+    def _make_replacer(name: str):
+        """Build the substitution callback for a value pattern."""
+        replacement = f"[REDACTED:{name}]"
+        if name == "card":
+            return lambda match: replacement if _card_number_valid(match.group()) else match.group()
+        return lambda match: replacement
+    
+    def redact_string(self, value: str) -> str:
+        """Mask sensitive patterns inside a string."""
+        if len(value) < _MIN_PATTERN_LENGTH or value in self._clean_strings:
+            return value
+        
+        redacted = value
+        for pattern, replacer in self._value_patterns:
+            if pattern.search(redacted) is not None:
+                redacted = pattern.sub(replacer, redacted)
+        
+        if redacted == value:
+            if len(value) <= _CLEAN_CACHE_MAX_LENGTH:
+                if len(self._clean_strings) >= _CLEAN_CACHE_SIZE:
+                    self._clean_strings.clear()
+                self._clean_strings.add(value)
+            return value
+        return redacted
+    
+    def redact(self, value: Any) -> Any:
+        """Redact a value, copying only containers that change."""
+        if isinstance(value, str):
+            return self.redact_string(value)
+        
+        if isinstance(value, dict):
+            result = None
+            for key, item in value.items():
+                if item is not None and self.is_sensitive_key(key):
+                    new_item = self.mask
+                else:
+                    new_item = self.redact(item)
+                if new_item is not item:
+                    if result is None:
+                        result = dict(value)
+                    result[key] = new_item
+            return value if result is None else result
+        
+        if isinstance(value, (list, tuple)):
+            result = None
+            for index, item in enumerate(value):
+                new_item = self.redact(item)
+                if new_item is not item:
+                    if result is None:
+                        result = list(value)
+                    result[index] = new_item
+            if result is None:
+                return value
+            return tuple(result) if isinstance(value, tuple) else result
+        
+        return value
+
+
+# Global redactor used by the JSON formatter
+redactor = Redactor()
@@ -0,0 +1,117 @@
+"""
+Sampling and rate limiting for request logs.
+"""
+
+import os
+import random
+import time
+from typing import Dict, List, Optional, Tuple
+
+
+def _parse_rates(value: str) -> Dict[str, float]:
+    """Parse "key=rate,key=rate" settings into a dict."""
+    rates = {}
+    for item in value.split(","):
+        if "=" not in item:
+            continue
+        key, rate = item.split("=", 1)
+        rates[key.strip()] = float(rate)
+    return rates
+
+
+# Sampling configuration
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", "1.0"))
+LOG_SAMPLE_ROUTES = _parse_rates(os.getenv("LOG_SAMPLE_ROUTES", "/health=0,/metrics=0"))
+LOG_SAMPLE_STATUS = _parse_rates(os.getenv("LOG_SAMPLE_STATUS", ""))
+LOG_SLOW_REQUEST_MS = float(os.getenv("LOG_SLOW_REQUEST_MS", "1000"))
+LOG_MAX_LINES_PER_SECOND = float(os.getenv("LOG_MAX_LINES_PER_SECOND", "0"))
+
+
+class TokenBucket:
+    """Token bucket limiting how many log lines are written per second."""
+    
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+    
+    def consume(self, tokens: float = 1.0) -> bool:
+        """Take tokens from the bucket if enough are available."""
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        
+        if self.tokens >= tokens:
+            self.tokens -= tokens
+            return True
+        return False
+
+
+class RequestLogSampler:
+    """Decides, once a request has finished, whether its log lines are kept.
+    
+    Errors and slow requests are always kept. Everything else is sampled by
+    route prefix (or status class when no route rate applies) and then
+    capped by a token bucket.
+    """
+    
+    def __init__(self, default_rate: float = LOG_SAMPLE_RATE,
+                 route_rates: Optional[Dict[str, float]] = None,
+                 status_rates: Optional[Dict[str, float]] = None,
+                 slow_request_ms: float = LOG_SLOW_REQUEST_MS,
+                 max_lines_per_second: float = LOG_MAX_LINES_PER_SECOND):
+        self.default_rate = default_rate
+        self.status_rates = status_rates if status_rates is not None else LOG_SAMPLE_STATUS
+        self.slow_request_ms = slow_request_ms
+        self.bucket = TokenBucket(max_lines_per_second) if max_lines_per_second > 0 else None
+        
+        # Longest prefix first so the most specific route wins
+        rates = route_rates if route_rates is not None else LOG_SAMPLE_ROUTES
+        self.route_rates: List[Tuple[str, float]] = sorted(
+            rates.items(), key=lambda item: len(item[0]), reverse=True
+        )
+        
+        self.counters: Dict[str, int] = {}
+    
+    def _count(self, key: str) -> None:
+        self.counters[key] = self.counters.get(key, 0) + 1
+    
+    def sample_rate(self, path: str, status_code: int) -> float:
+        """Get the sample rate for a route and status code."""
+        for prefix, rate in self.route_rates:
+            if path.startswith(prefix):
+                return rate
+        
+        status_class = f"{status_code // 100}xx"
+        return self.status_rates.get(str(status_code), self.status_rates.get(status_class, self.default_rate))
+    
+    def should_log(self, path: str, status_code: int, duration_ms: float,
+                   lines: int = 2, error: bool = False) -> bool:
+        """Tail-based decision for a finished request."""
+        status_class = f"{status_code // 100}xx"
+        
+        # Errors and slow requests are always interesting
+        if error or status_code >= 500 or duration_ms >= self.slow_request_ms:
+            self._count(f"forced:{status_class}")
+            return True
+        
+        rate = self.sample_rate(path, status_code)
+        if rate < 1.0 and (rate <= 0.0 or random.random() >= rate):
+            self._count(f"dropped_sampled:{status_class}")
+            return False
+        
+        if self.bucket is not None and not self.bucket.consume(lines):
+            self._count(f"dropped_rate_limited:{status_class}")
+            return False
+        
+        self._count(f"kept:{status_class}")
+        return True
+    
+    def stats(self) -> Dict[str, int]:
+        """Get kept/dropped counters keyed by "<outcome>:<status class>"."""
+        return dict(self.counters)
+
+
+# Global request log sampler
+request_log_sampler = RequestLogSampler()
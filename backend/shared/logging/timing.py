@@ -0,0 +1,179 @@
+"""
+Per-request phase timing for Server-Timing headers and latency breakdowns.
+"""
+
+import bisect
+import contextvars
+import os
+import random
+import threading
+import time
+from typing import Dict, Optional, Tuple
+from .tracing import SpanScope, tracer
+
+
+# Server-Timing header emission (collection itself is always on)
+SERVER_TIMING_ENABLED = os.getenv("SERVER_TIMING_ENABLED", "false").lower() == "true"
+SERVER_TIMING_SAMPLE_RATE = float(os.getenv("SERVER_TIMING_SAMPLE_RATE", "0.0"))
+
+# Histogram bucket upper bounds in milliseconds
+PHASE_BUCKETS_MS = (0.1, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+_PHASE_BUCKETS_NS = tuple(int(bound * 1_000_000) for bound in PHASE_BUCKETS_MS)
+
+
+class RequestTiming:
+    """Accumulated phase durations for a single request."""
+    
+    __slots__ = ("start_ns", "phases", "emit_header")
+    
+    def __init__(self, emit_header: bool = False):
+        self.start_ns = time.perf_counter_ns()
+        self.phases: Dict[str, int] = {}
+        self.emit_header = emit_header
+    
+    def add(self, name: str, duration_ns: int) -> None:
+        """Add a duration to a named phase."""
+        phases = self.phases
+        phases[name] = phases.get(name, 0) + duration_ns
+    
+    def elapsed_ns(self) -> int:
+        """Get nanoseconds elapsed since the request started."""
+        return time.perf_counter_ns() - self.start_ns
+    
+    def to_header(self, total_ns: int) -> str:
+        """Render phases as a Server-Timing header value."""
+        parts = [f"{name};dur={duration / 1_000_000:.3f}" for name, duration in self.phases.items()]
+        parts.append(f"total;dur={total_ns / 1_000_000:.3f}")
+        return ", ".join(parts)
+
+
+# Context variable holding the timing of the current request. The object is
+# mutable so phases recorded by inner middleware are visible to outer ones.
+request_timing_context: contextvars.ContextVar[Optional[RequestTiming]] = contextvars.ContextVar(
+    'request_timing', default=None
+)
+
+
+def start_request_timing() -> RequestTiming:
+    """Start phase timing for the current request."""
+    emit_header = SERVER_TIMING_ENABLED or (
+        SERVER_TIMING_SAMPLE_RATE > 0 and random.random() < SERVER_TIMING_SAMPLE_RATE
+    )
+    timing = RequestTiming(emit_header)
+    request_timing_context.set(timing)
+    return timing
+
+
+def get_request_timing() -> Optional[RequestTiming]:
+    """Get timing for the current request, if any."""
+    return request_timing_context.get()
+
+
+def record_phase(name: str, duration_ns: int) -> None:
+    """Record a phase duration against the current request."""
+    timing = request_timing_context.get()
+    if timing is not None:
+        timing.add(name, duration_ns)
+
+
+class PhaseTimer:
+    """Context manager adding its elapsed time to a request phase.
+    
+    When a recorded trace is active the phase also becomes a child span.
+    """
+    
+    __slots__ = ("name", "start_ns", "scope")
+    
+    def __init__(self, name: str):
+        self.name = name
+        self.start_ns = 0
+        self.scope: Optional[SpanScope] = None
+    
+    def __enter__(self) -> "PhaseTimer":
+        span = tracer.start_child_span(self.name)
+        if span is not None:
+            self.scope = SpanScope(span)
+            self.scope.__enter__()
+        self.start_ns = time.perf_counter_ns()
+        return self
+    
+    def __exit__(self, exc_type, exc_val, exc_tb) -> bool:
+        record_phase(self.name, time.perf_counter_ns() - self.start_ns)
+        if self.scope is not None:
+            self.scope.__exit__(exc_type, exc_val, exc_tb)
+        return False
+
+
+def timed_phase(name: str) -> PhaseTimer:
+    """Time a block of code as a named phase of the current request."""
+    return PhaseTimer(name)
+
+
+class PhaseHistogram:
+    """Fixed-bucket latency histogram for one route phase."""
+    
+    __slots__ = ("counts", "count", "sum_ns")
+    
+    def __init__(self):
+        self.counts = [0] * (len(_PHASE_BUCKETS_NS) + 1)
+        self.count = 0
+        self.sum_ns = 0
+    
+    def observe(self, duration_ns: int) -> None:
+        """Record a single observation."""
+        self.counts[bisect.bisect_left(_PHASE_BUCKETS_NS, duration_ns)] += 1
+        self.count += 1
+        self.sum_ns += duration_ns
+    
+    def to_dict(self) -> dict:
+        """Export histogram as cumulative buckets."""
+        buckets = {}
+        cumulative = 0
+        for bound, bucket_count in zip(PHASE_BUCKETS_MS, self.counts):
+            cumulative += bucket_count
+            buckets[str(bound)] = cumulative
+        buckets["+Inf"] = self.count
+        return {
+            "count": self.count,
+            "sum_ms": self.sum_ns / 1_000_000,
+            "buckets": buckets
+        }
+
+
+class TimingAggregator:
+    """Aggregates request phase timings into per-route histograms."""
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms: Dict[Tuple[str, str], PhaseHistogram] = {}
+    
+    def _histogram(self, route: str, phase: str) -> PhaseHistogram:
+        key = (route, phase)
+        histogram = self._histograms.get(key)
+        if histogram is None:
+            histogram = self._histograms[key] = PhaseHistogram()
+        return histogram
+    
+    def record(self, route: str, timing: RequestTiming, total_ns: int) -> None:
+        """Record all phases of a finished request."""
+        with self._lock:
+            for phase, duration_ns in timing.phases.items():
+                self._histogram(route, phase).observe(duration_ns)
+            self._histogram(route, "total").observe(total_ns)
+    
+    def snapshot(self) -> Dict[str, Dict[str, dict]]:
+        """Get histograms grouped by route and phase."""
+        with self._lock:
+            result: Dict[str, Dict[str, dict]] = {}
+            for (route, phase), histogram in self._histograms.items():
+                result.setdefault(route, {})[phase] = histogram.to_dict()
+            return result
+    
+    def reset(self) -> None:
+        """Clear all aggregated timings."""
+        with self._lock:
+            self._histograms.clear()
+
+
+# Global timing aggregator
+timing_aggregator = TimingAggregator()
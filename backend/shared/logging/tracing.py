@@ -0,0 +1,575 @@
+"""
+Lightweight in-process distributed tracing with W3C trace context propagation.
+"""
+
+import atexit
+import contextvars
+import json
+import os
+import queue
+import random
+import re
+import threading
+import time
+import urllib.request
+from abc import ABC, abstractmethod
+from typing import Any, Dict, List, Optional
+
+
+# Tracing configuration
+TRACING_ENABLED = os.getenv("TRACING_ENABLED", "false").lower() == "true"
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0.1"))
+TRACE_TAIL_SAMPLING = os.getenv("TRACE_TAIL_SAMPLING", "true").lower() == "true"
+TRACE_TAIL_SLOW_MS = float(os.getenv("TRACE_TAIL_SLOW_MS", "1000"))
+TRACE_MAX_SPANS_PER_TRACE = int(os.getenv("TRACE_MAX_SPANS_PER_TRACE", "512"))
+
+# Export configuration
+TRACE_EXPORTER = os.getenv("TRACE_EXPORTER", "file").lower()  # "file", "otlp" or "none"
+TRACE_FILE_PATH = os.getenv("TRACE_FILE_PATH", "/var/log/aems/traces.jsonl")
+TRACE_OTLP_ENDPOINT = os.getenv("TRACE_OTLP_ENDPOINT", "http://otel-collector:4318/v1/traces")
+TRACE_EXPORT_QUEUE_SIZE = int(os.getenv("TRACE_EXPORT_QUEUE_SIZE", "2048"))
+TRACE_EXPORT_BATCH_SIZE = int(os.getenv("TRACE_EXPORT_BATCH_SIZE", "512"))
+TRACE_EXPORT_INTERVAL_SECONDS = float(os.getenv("TRACE_EXPORT_INTERVAL_SECONDS", "5.0"))
+
+TRACEPARENT_HEADER = "traceparent"
+
+_TRACEPARENT = re.compile(r"^([0-9a-f]{2})-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$")
+_INVALID_TRACE_ID = "0" * 32
+_INVALID_SPAN_ID = "0" * 16
+
+_STOP = object()
+
+
+class SpanContext:
+    """Identifiers of a span received from another process."""
+    
+    __slots__ = ("trace_id", "span_id", "sampled")
+    
+    def __init__(self, trace_id: str, span_id: str, sampled: bool):
+        self.trace_id = trace_id
+        self.span_id = span_id
+        self.sampled = sampled
+
+
+def parse_traceparent(header: Optional[str]) -> Optional[SpanContext]:
+    """Parse a W3C traceparent header, ignoring malformed values."""
+    if not header:
+        return None
+    
+    match = _TRACEPARENT.match(header.strip().lower())
+    if match is None:
+        return None
+    
+    version, trace_id, span_id, flags = match.groups()
+    if version == "ff" or trace_id == _INVALID_TRACE_ID or span_id == _INVALID_SPAN_ID:
+        return None
+    return SpanContext(trace_id, span_id, bool(int(flags, 16) & 0x01))
+
+
+def _new_trace_id() -> str:
+    return f"{random.getrandbits(128) or 1:032x}"
+
+
+def _new_span_id() -> str:
+    return f"{random.getrandbits(64) or 1:016x}"
+
+
+class _LocalTrace:
+    """Spans of one trace recorded in this process, kept until its local root ends."""
+    
+    __slots__ = ("trace_id", "sampled", "recording", "spans", "error", "dropped")
+    
+    def __init__(self, trace_id: str, sampled: bool, recording: bool):
+        self.trace_id = trace_id
+        self.sampled = sampled
+        self.recording = recording
+        self.spans: List["Span"] = []
+        self.error = False
+        self.dropped = 0
+
+
+class Span:
+    """A timed operation within a trace."""
+    
+    __slots__ = (
+        "tracer", "trace", "name", "kind", "span_id", "parent_id", "is_local_root",
+        "start_ns", "end_ns", "attributes", "status", "status_message"
+    )
+    
+    def __init__(self, tracer: "Tracer", trace: _LocalTrace, name: str, kind: str,
+                 parent_id: Optional[str], is_local_root: bool,
+                 attributes: Optional[Dict[str, Any]] = None):
+        self.tracer = tracer
+        self.trace = trace
+        self.name = name
+        self.kind = kind
+        self.span_id = _new_span_id()
+        self.parent_id = parent_id
+        self.is_local_root = is_local_root
+        self.start_ns = time.time_ns()
+        self.end_ns = 0
+        self.attributes = attributes if attributes is not None else {}
+        self.status = "ok"
+        self.status_message: Optional[str] = None
+    
+    @property
+    def trace_id(self) -> str:
+        return self.trace.trace_id
+    
+    def set_attribute(self, key: str, value: Any) -> None:
+        """Attach an attribute to the span."""
+        self.attributes[key] = value
+    
+    def set_error(self, message: Optional[str] = None) -> None:
+        """Mark the span (and so its trace) as failed."""
+        self.status = "error"
+        self.status_message = message
+        self.trace.error = True
+    
+    def record_exception(self, exc: BaseException) -> None:
+        """Mark the span failed because of an exception."""
+        self.attributes["exception.type"] = type(exc).__name__
+        self.set_error(str(exc))
+    
+    def traceparent(self) -> str:
+        """Render this span as a W3C traceparent header value."""
+        return f"00-{self.trace.trace_id}-{self.span_id}-{'01' if self.trace.sampled else '00'}"
+    
+    def end(self) -> None:
+        """Finish the span; ending twice is a no-op."""
+        if self.end_ns:
+            return
+        self.end_ns = time.time_ns()
+        self.tracer._on_end(self)
+    
+    def duration_ms(self) -> float:
+        """Get span duration in milliseconds."""
+        return ((self.end_ns or time.time_ns()) - self.start_ns) / 1_000_000
+    
+    def to_dict(self) -> Dict[str, Any]:
+        """Export span as a JSON-serializable dict."""
+        return {
+            "trace_id": self.trace.trace_id,
+            "span_id": self.span_id,
+            "parent_span_id": self.parent_id,
+            "name": self.name,
+            "kind": self.kind,
+            "start_time_unix_nano": self.start_ns,
+            "end_time_unix_nano": self.end_ns,
+            "duration_ms": self.duration_ms(),
+            "status": self.status,
+            "status_message": self.status_message,
+            "attributes": self.attributes
+        }
+
+
+# Context variable holding the active span of the current task
+current_span_context: contextvars.ContextVar[Optional[Span]] = contextvars.ContextVar(
+    'current_span', default=None
+)
+
+
+def get_current_span() -> Optional[Span]:
+    """Get the active span, if any."""
+    return current_span_context.get()
+
+
+class SpanScope:
+    """Context manager making a span current for the enclosed block."""
+    
+    __slots__ = ("span", "_token")
+    
+    def __init__(self, span: Span):
+        self.span = span
+        self._token = None
+    
+    def __enter__(self) -> Span:
+        self._token = current_span_context.set(self.span)
+        return self.span
+    
+    def __exit__(self, exc_type, exc_val, exc_tb) -> bool:
+        if exc_val is not None:
+            self.span.record_exception(exc_val)
+        current_span_context.reset(self._token)
+        self.span.end()
+        return False
+
+
+class Tracer:
+    """Creates spans and applies head and tail sampling per trace.
+    
+    The head decision is taken when a trace starts here (or inherited from
+    the incoming traceparent) and propagated downstream. Traces not
+    head-sampled are still recorded in memory when tail sampling is on,
+    and exported anyway if they turn out to contain an error or to be
+    slow once their local root span ends.
+    """
+    
+    def __init__(self, processor: Optional["BatchSpanProcessor"] = None,
+                 sample_rate: float = TRACE_SAMPLE_RATE,
+                 tail_sampling: bool = TRACE_TAIL_SAMPLING,
+                 tail_slow_ms: float = TRACE_TAIL_SLOW_MS,
+                 max_spans_per_trace: int = TRACE_MAX_SPANS_PER_TRACE):
+        self.processor = processor
+        self.sample_rate = sample_rate
+        self.tail_sampling = tail_sampling
+        self.tail_slow_ms = tail_slow_ms
+        self.max_spans_per_trace = max_spans_per_trace
+        
+        # Counters (diagnostic only, updated without locking)
+        self.counters: Dict[str, int] = {}
+    
+    def _count(self, key: str) -> None:
+        self.counters[key] = self.counters.get(key, 0) + 1
+    
+    def start_span(self, name: str, kind: str = "internal",
+                   attributes: Optional[Dict[str, Any]] = None,
+                   parent: Optional[SpanContext] = None) -> Span:
+        """Start a span under the remote parent, the current span, or a new trace."""
+        if parent is not None:
+            trace = _LocalTrace(parent.trace_id, parent.sampled, parent.sampled or self.tail_sampling)
+            return Span(self, trace, name, kind, parent.span_id, True, attributes)
+        
+        current = current_span_context.get()
+        if current is not None:
+            return Span(self, current.trace, name, kind, current.span_id, False, attributes)
+        
+        sampled = self._head_sampled()
+        trace = _LocalTrace(_new_trace_id(), sampled, sampled or self.tail_sampling)
+        return Span(self, trace, name, kind, None, True, attributes)
+    
+    def _head_sampled(self) -> bool:
+        """Head sampling decision for a trace this process decides on."""
+        return self.sample_rate >= 1.0 or (self.sample_rate > 0 and random.random() < self.sample_rate)
+    
+    def resample(self, parent: SpanContext) -> SpanContext:
+        """Keep a remote parent's IDs but replace its sampled flag with our own decision.
+        
+        Edge services use this so clients cannot force sampling with
+        traceparent flags.
+        """
+        return SpanContext(parent.trace_id, parent.span_id, self._head_sampled())
+    
+    def start_child_span(self, name: str, kind: str = "internal",
+                         attributes: Optional[Dict[str, Any]] = None) -> Optional[Span]:
+        """Start a child of the current span only if a recorded trace is active."""
+        current = current_span_context.get()
+        if current is None or not current.trace.recording:
+            return None
+        return Span(self, current.trace, name, kind, current.span_id, False, attributes)
+    
+    def span(self, name: str, kind: str = "internal",
+             attributes: Optional[Dict[str, Any]] = None,
+             parent: Optional[SpanContext] = None) -> SpanScope:
+        """Start a span and make it current for a with block."""
+        return SpanScope(self.start_span(name, kind, attributes, parent))
+    
+    def _on_end(self, span: Span) -> None:
+        """Buffer a finished span and export its trace once the local root ends."""
+        trace = span.trace
+        if not trace.recording:
+            return
+        
+        if len(trace.spans) < self.max_spans_per_trace:
+            trace.spans.append(span)
+        else:
+            trace.dropped += 1
+        
+        if not span.is_local_root:
+            return
+        
+        if trace.sampled:
+            self._count("exported:head")
+        elif trace.error:
+            self._count("exported:tail_error")
+        elif span.duration_ms() >= self.tail_slow_ms:
+            self._count("exported:tail_slow")
+        else:
+            self._count("discarded")
+            return
+        
+        if trace.dropped:
+            span.attributes["trace.dropped_spans"] = trace.dropped
+        if self.processor is not None:
+            self.processor.on_trace_end(trace.spans)
+    
+    def stats(self) -> Dict[str, int]:
+        """Get sampling counters keyed by outcome."""
+        stats = dict(self.counters)
+        if self.processor is not None:
+            stats.update(self.processor.stats())
+        return stats
+
+
+class SpanExporter(ABC):
+    """Destination for batches of finished spans."""
+    
+    @abstractmethod
+    def export(self, spans: List[Dict[str, Any]]) -> None:
+        """Send a batch of finished spans."""
+    
+    def shutdown(self) -> None:
+        pass
+
+
+class FileSpanExporter(SpanExporter):
+    """Append spans to a local file as JSON lines."""
+    
+    def __init__(self, path: str = TRACE_FILE_PATH):
+        self.path = path
+        self._file = None
+    
+    def export(self, spans: List[Dict[str, Any]]) -> None:
+        if self._file is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            self._file = open(self.path, "a", encoding="utf-8")
+        self._file.write("".join(json.dumps(span, default=str) + "\n" for span in spans))
+        self._file.flush()
+    
+    def shutdown(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+def _otlp_value(value: Any) -> Dict[str, Any]:
+    """Encode an attribute value as an OTLP AnyValue."""
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+_OTLP_SPAN_KINDS = {"internal": 1, "server": 2, "client": 3}
+
+
+class OTLPHttpSpanExporter(SpanExporter):
+    """Post spans as OTLP/HTTP JSON to a collector."""
+    
+    def __init__(self, endpoint: str = TRACE_OTLP_ENDPOINT, timeout: float = 5.0):
+        self.endpoint = endpoint
+        self.timeout = timeout
+        self.service_name = os.getenv("SERVICE_NAME", "unknown")
+    
+    def _encode(self, spans: List[Dict[str, Any]]) -> bytes:
+        otlp_spans = []
+        for span in spans:
+            otlp_span = {
+                "traceId": span["trace_id"],
+                "spanId": span["span_id"],
+                "name": span["name"],
+                "kind": _OTLP_SPAN_KINDS.get(span["kind"], 1),
+                "startTimeUnixNano": str(span["start_time_unix_nano"]),
+                "endTimeUnixNano": str(span["end_time_unix_nano"]),
+                "attributes": [
+                    {"key": key, "value": _otlp_value(value)}
+                    for key, value in span["attributes"].items()
+                ],
+                "status": {"code": 2 if span["status"] == "error" else 1}
+            }
+            if span["parent_span_id"]:
+                otlp_span["parentSpanId"] = span["parent_span_id"]
+            if span["status_message"]:
+                otlp_span["status"]["message"] = span["status_message"]
+            otlp_spans.append(otlp_span)
+        
+        payload = {
+            "resourceSpans": [{
+                "resource": {"attributes": [
+                    {"key": "service.name", "value": {"stringValue": self.service_name}}
+                ]},
+                "scopeSpans": [{"scope": {"name": "aems.tracing"}, "spans": otlp_spans}]
+            }]
+        }
+        return json.dumps(payload).encode("utf-8")
+    
+    def export(self, spans: List[Dict[str, Any]]) -> None:
+        request = urllib.request.Request(
+            self.endpoint,
+            data=self._encode(spans),
+            headers={"Content-Type": "application/json"},
+            method="POST"
+        )
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            response.read()
+
+
+class BatchSpanProcessor:
+    """Bounded queue of finished traces exported in batches by a background thread."""
+    
+    def __init__(self, exporter: SpanExporter, maxsize: int = TRACE_EXPORT_QUEUE_SIZE,
+                 batch_size: int = TRACE_EXPORT_BATCH_SIZE,
+                 interval: float = TRACE_EXPORT_INTERVAL_SECONDS):
+        self.exporter = exporter
+        self.maxsize = maxsize
+        self.batch_size = batch_size
+        self.interval = interval
+        self._queue: queue.Queue = queue.Queue(maxsize)
+        self._thread: Optional[threading.Thread] = None
+        self._start_lock = threading.Lock()
+        self._stopped = False
+        
+        # Counters (diagnostic only, updated without locking)
+        self.exported = 0
+        self.dropped = 0
+        self.failed = 0
+    
+    def _ensure_started(self) -> None:
+        """Start the export thread on first use."""
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self._run, name="aems-trace-exporter", daemon=True
+                )
+                self._thread.start()
+    
+    def on_trace_end(self, spans: List[Span]) -> None:
+        """Queue a finished trace for export without doing any I/O."""
+        if self._stopped:
+            return
+        if self._thread is None:
+            self._ensure_started()
+        try:
+            self._queue.put_nowait(spans)
+        except queue.Full:
+            self.dropped += len(spans)
+    
+    def _run(self) -> None:
+        """Export thread main loop: flush when a batch fills or the interval passes."""
+        pending: List[Span] = []
+        deadline = time.monotonic() + self.interval
+        while True:
+            try:
+                item = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Empty:
+                item = None
+            
+            if item is _STOP:
+                self._export(pending)
+                return
+            if item is not None:
+                pending.extend(item)
+            
+            if len(pending) >= self.batch_size or time.monotonic() >= deadline:
+                self._export(pending)
+                pending = []
+                deadline = time.monotonic() + self.interval
+    
+    def _export(self, spans: List[Span]) -> None:
+        """Serialize and export spans, never raising into the export thread."""
+        for start in range(0, len(spans), self.batch_size):
+            batch = [span.to_dict() for span in spans[start:start + self.batch_size]]
+            try:
+                self.exporter.export(batch)
+                self.exported += len(batch)
+            except Exception:
+                self.failed += len(batch)
+    
+    def shutdown(self, timeout: float = 5.0) -> None:
+        """Export queued spans and stop the export thread."""
+        if self._stopped:
+            return
+        
+        thread = self._thread
+        if thread is not None and thread.is_alive():
+            try:
+                self._queue.put(_STOP, timeout=timeout)
+                thread.join(timeout)
+            except queue.Full:
+                pass
+        self._stopped = True
+        self.exporter.shutdown()
+    
+    def _reset_after_fork(self) -> None:
+        """Start fresh in a forked child; the export thread does not survive fork."""
+        self._queue = queue.Queue(self.maxsize)
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._stopped = False
+    
+    def stats(self) -> Dict[str, int]:
+        """Get export counters."""
+        return {
+            "spans_exported": self.exported,
+            "spans_dropped": self.dropped,
+            "spans_failed": self.failed,
+            "queue_depth": self._queue.qsize()
+        }
+
+
+def _create_exporter(name: str = TRACE_EXPORTER) -> Optional[SpanExporter]:
+    """Build the exporter selected by configuration."""
+    if name == "file":
+        return FileSpanExporter()
+    if name == "otlp":
+        return OTLPHttpSpanExporter()
+    if name == "none":
+        return None
+    raise ValueError(f"Unknown trace exporter: {name}")
+
+
+# Global span processor and tracer
+_exporter = _create_exporter() if TRACING_ENABLED else None
+span_processor = BatchSpanProcessor(_exporter) if _exporter is not None else None
+tracer = Tracer(span_processor)
+
+if span_processor is not None:
+    if hasattr(os, "register_at_fork"):
+        os.register_at_fork(after_in_child=span_processor._reset_after_fork)
+    atexit.register(span_processor.shutdown)
+
+
+def shutdown_tracing(timeout: float = 5.0) -> None:
+    """Export pending spans and stop the exporter (call from application shutdown)."""
+    if span_processor is not None:
+        span_processor.shutdown(timeout)
+
+
+def inject_traceparent(headers: Dict[str, str]) -> None:
+    """Set the traceparent header for the current span, if any."""
+    span = current_span_context.get()
+    if span is not None:
+        headers[TRACEPARENT_HEADER] = span.traceparent()
+
+
+async def start_client_span(request) -> None:
+    """httpx request hook opening a client span and propagating it."""
+    span = tracer.start_child_span(
+        f"HTTP {request.method}",
+        kind="client",
+        # Without the query string, which may carry tokens or personal data
+        attributes={"http.method": request.method, "http.url": str(request.url).split("?", 1)[0]}
+    )
+    if span is None:
+        # Not recording: still pass the trace (and its sampling flag) along
+        inject_traceparent(request.headers)
+        return
+    request.headers[TRACEPARENT_HEADER] = span.traceparent()
+    request.extensions["aems_span"] = span
+
+
+async def end_client_span(response) -> None:
+    """httpx response hook closing the span opened by start_client_span."""
+    span = response.request.extensions.pop("aems_span", None)
+    if span is None:
+        return
+    span.set_attribute("http.status_code", response.status_code)
+    if response.status_code >= 500:
+        span.set_error(f"HTTP {response.status_code}")
+    span.end()
+
+
+def close_client_span(request) -> None:
+    """End a client span the response hook did not end (call in a finally block).
+    
+    httpx skips response hooks when the transport raises, so without
+    this the span of a failed request would never be exported.
+    """
+    span = request.extensions.pop("aems_span", None)
+    if span is None:
+        return
+    span.set_error("No response received")
+    span.end()
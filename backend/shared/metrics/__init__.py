@@ -0,0 +1,516 @@
+"""
+Prometheus-compatible metrics for A-EMS microservices.
+"""
+
+import atexit
+import bisect
+import glob
+import hmac
+import ipaddress
+import json
+import os
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+
+# Multi-process aggregation: each worker writes snapshots to this directory
+METRICS_MULTIPROC_DIR = os.getenv("METRICS_MULTIPROC_DIR", "")
+METRICS_FLUSH_INTERVAL_SECONDS = float(os.getenv("METRICS_FLUSH_INTERVAL_SECONDS", "5.0"))
+
+CONTENT_TYPE_LATEST = "text/plain; version=0.0.4; charset=utf-8"
+
+# Request latency buckets in seconds
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# (sample name, labels, value)
+Sample = Tuple[str, Dict[str, str], float]
+
+
+def metric_family(name: str, metric_type: str, documentation: str,
+                  samples: List[Sample], mode: str = "sum") -> Dict[str, Any]:
+    """Build a metric family as produced by metrics and collectors."""
+    return {"name": name, "type": metric_type, "help": documentation, "mode": mode, "samples": samples}
+
+
+class _Shards:
+    """Per-thread value dicts, merged only when metrics are collected.
+    
+    Each thread updates its own dict, so the hot path takes no lock; the
+    registry lock is only taken once per thread to register its shard.
+    """
+    
+    def __init__(self):
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._shards: List[dict] = []
+    
+    def get(self) -> dict:
+        """Get the calling thread's shard."""
+        try:
+            return self._local.values
+        except AttributeError:
+            values = self._local.values = {}
+            with self._lock:
+                self._shards.append(values)
+            return values
+    
+    def all(self) -> List[dict]:
+        """Get every shard (copied, so threads may keep writing)."""
+        with self._lock:
+            return list(self._shards)
+    
+    def reset_after_fork(self) -> None:
+        """Drop the parent's values in a forked child."""
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._shards = []
+
+
+class Metric(ABC):
+    """Base class for labelled metrics."""
+    
+    metric_type = "untyped"
+    
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+    
+    def _labels(self, values: Tuple) -> Dict[str, str]:
+        return {name: str(value) for name, value in zip(self.labelnames, values)}
+    
+    @abstractmethod
+    def collect(self) -> Dict[str, Any]:
+        """Current samples as a metric family (see metric_family)."""
+    
+    def reset_after_fork(self) -> None:
+        pass
+
+
+class Counter(Metric):
+    """Monotonically increasing counter."""
+    
+    metric_type = "counter"
+    
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._shards = _Shards()
+    
+    def inc(self, labels: Tuple = (), amount: float = 1) -> None:
+        """Increment the counter for a label value tuple."""
+        values = self._shards.get()
+        values[labels] = values.get(labels, 0) + amount
+    
+    def collect(self) -> Dict[str, Any]:
+        totals: Dict[Tuple, float] = {}
+        for values in self._shards.all():
+            for labels, value in list(values.items()):
+                totals[labels] = totals.get(labels, 0) + value
+        samples = [(self.name, self._labels(labels), value) for labels, value in totals.items()]
+        return metric_family(self.name, self.metric_type, self.documentation, samples)
+    
+    def reset_after_fork(self) -> None:
+        self._shards.reset_after_fork()
+
+
+class Gauge(Metric):
+    """Value that can go up and down, or be read from a callback at collection time."""
+    
+    metric_type = "gauge"
+    
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (),
+                 function: Optional[Callable[[], float]] = None, mode: str = "sum"):
+        super().__init__(name, documentation, labelnames)
+        self.function = function
+        self.mode = mode
+        self._values: Dict[Tuple, float] = {}
+    
+    def set(self, value: float, labels: Tuple = ()) -> None:
+        """Set the gauge for a label value tuple."""
+        self._values[labels] = value
+    
+    def inc(self, labels: Tuple = (), amount: float = 1) -> None:
+        """Increase the gauge (single-threaded callers, e.g. the event loop)."""
+        self._values[labels] = self._values.get(labels, 0) + amount
+    
+    def dec(self, labels: Tuple = (), amount: float = 1) -> None:
+        """Decrease the gauge."""
+        self.inc(labels, -amount)
+    
+    def collect(self) -> Dict[str, Any]:
+        if self.function is not None:
+            try:
+                samples = [(self.name, {}, float(self.function()))]
+            except Exception:
+                samples = []
+        else:
+            samples = [(self.name, self._labels(labels), value) for labels, value in list(self._values.items())]
+        return metric_family(self.name, self.metric_type, self.documentation, samples, self.mode)
+    
+    def reset_after_fork(self) -> None:
+        self._values = {}
+
+
+class Histogram(Metric):
+    """Fixed-bucket histogram."""
+    
+    metric_type = "histogram"
+    
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._shards = _Shards()
+    
+    def observe(self, value: float, labels: Tuple = ()) -> None:
+        """Record an observation for a label value tuple."""
+        values = self._shards.get()
+        state = values.get(labels)
+        if state is None:
+            # Per-bucket (non-cumulative) counts, +Inf count, then the sum
+            state = values[labels] = [0] * (len(self.buckets) + 2)
+        state[bisect.bisect_left(self.buckets, value)] += 1
+        state[-1] += value
+    
+    def collect(self) -> Dict[str, Any]:
+        totals: Dict[Tuple, List[float]] = {}
+        for values in self._shards.all():
+            for labels, state in list(values.items()):
+                total = totals.get(labels)
+                if total is None:
+                    totals[labels] = list(state)
+                else:
+                    for index, value in enumerate(state):
+                        total[index] += value
+        
+        samples: List[Sample] = []
+        for labels, state in totals.items():
+            label_dict = self._labels(labels)
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), state):
+                cumulative += count
+                samples.append((f"{self.name}_bucket", {**label_dict, "le": _format_bound(bound)}, cumulative))
+            samples.append((f"{self.name}_count", label_dict, cumulative))
+            samples.append((f"{self.name}_sum", label_dict, state[-1]))
+        return metric_family(self.name, self.metric_type, self.documentation, samples)
+    
+    def reset_after_fork(self) -> None:
+        self._shards.reset_after_fork()
+
+
+def _format_bound(bound: float) -> str:
+    """Format a bucket bound the way Prometheus clients do."""
+    if bound == float("inf"):
+        return "+Inf"
+    return repr(float(bound))
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class MetricsRegistry:
+    """Holds metrics and collectors and renders the Prometheus text format.
+    
+    With METRICS_MULTIPROC_DIR set, every worker periodically writes a
+    snapshot of its metrics there and rendering merges all snapshots:
+    counters and histograms are summed across all workers that ever
+    wrote one, gauges only across live workers (summed or maxed). A
+    worker removes its snapshot when it exits and remove_dead_snapshots()
+    clears those left by crashed workers, so the directory stays bounded;
+    counters of exited workers drop out of the totals, which Prometheus
+    treats as a counter reset.
+    """
+    
+    def __init__(self, multiproc_dir: str = METRICS_MULTIPROC_DIR,
+                 flush_interval: float = METRICS_FLUSH_INTERVAL_SECONDS):
+        self.multiproc_dir = multiproc_dir
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._metrics: Dict[str, Metric] = {}
+        self._collectors: List[Callable[[], List[Dict[str, Any]]]] = []
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+    
+    def _register(self, metric: Metric) -> Metric:
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                return existing
+            self._metrics[metric.name] = metric
+        if self.multiproc_dir and self._thread is None:
+            self._start_flusher()
+        return metric
+    
+    def counter(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()) -> Counter:
+        """Get or create a counter."""
+        return self._register(Counter(name, documentation, labelnames))
+    
+    def gauge(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (),
+              function: Optional[Callable[[], float]] = None, mode: str = "sum") -> Gauge:
+        """Get or create a gauge."""
+        return self._register(Gauge(name, documentation, labelnames, function, mode))
+    
+    def histogram(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (),
+                  buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+        """Get or create a histogram."""
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+    
+    def register_collector(self, collector: Callable[[], List[Dict[str, Any]]]) -> None:
+        """Add a callable returning metric families at collection time."""
+        with self._lock:
+            self._collectors.append(collector)
+    
+    def collect(self) -> List[Dict[str, Any]]:
+        """Collect all metric families of this process."""
+        with self._lock:
+            metrics = list(self._metrics.values())
+            collectors = list(self._collectors)
+        
+        families = [metric.collect() for metric in metrics]
+        for collector in collectors:
+            try:
+                families.extend(collector())
+            except Exception:
+                # A broken collector must not break the scrape
+                continue
+        return families
+    
+    def _snapshot_path(self, pid: int) -> str:
+        return os.path.join(self.multiproc_dir, f"metrics-{pid}.json")
+    
+    def write_snapshot(self) -> None:
+        """Write this process's metrics for other workers to merge."""
+        os.makedirs(self.multiproc_dir, exist_ok=True)
+        path = self._snapshot_path(os.getpid())
+        temp_path = path + ".tmp"
+        with open(temp_path, "w", encoding="utf-8") as snapshot_file:
+            json.dump({"pid": os.getpid(), "time": time.time(), "families": self.collect()}, snapshot_file)
+        os.replace(temp_path, path)
+    
+    def remove_dead_snapshots(self) -> int:
+        """Delete snapshots (and temp files) of workers that are no longer running."""
+        if not self.multiproc_dir:
+            return 0
+        removed = 0
+        for path in glob.glob(os.path.join(self.multiproc_dir, "metrics-*.json*")):
+            pid_text = os.path.basename(path)[len("metrics-"):].split(".", 1)[0]
+            try:
+                pid = int(pid_text)
+            except ValueError:
+                continue
+            if pid == os.getpid() or _pid_alive(pid):
+                continue
+            try:
+                os.remove(path)
+                removed += 1
+            except FileNotFoundError:
+                pass
+        return removed
+    
+    def _read_snapshots(self) -> List[Tuple[bool, List[Dict[str, Any]]]]:
+        """Read every worker snapshot as (alive, families)."""
+        snapshots = []
+        for path in glob.glob(os.path.join(self.multiproc_dir, "metrics-*.json")):
+            try:
+                with open(path, "r", encoding="utf-8") as snapshot_file:
+                    snapshot = json.load(snapshot_file)
+            except (OSError, ValueError):
+                continue
+            snapshots.append((_pid_alive(snapshot["pid"]), snapshot["families"]))
+        return snapshots
+    
+    def _merge(self, snapshots: List[Tuple[bool, List[Dict[str, Any]]]]) -> List[Dict[str, Any]]:
+        """Merge families from all workers."""
+        merged: Dict[str, Dict[str, Any]] = {}
+        values: Dict[str, Dict[Tuple, Tuple[str, Dict[str, str], float]]] = {}
+        
+        for alive, families in snapshots:
+            for family in families:
+                if family["type"] == "gauge" and not alive:
+                    continue
+                name = family["name"]
+                if name not in merged:
+                    merged[name] = {**family, "samples": []}
+                    values[name] = {}
+                family_values = values[name]
+                maximum = family["type"] == "gauge" and family.get("mode") == "max"
+                for sample_name, labels, value in family["samples"]:
+                    key = (sample_name, tuple(sorted(labels.items())))
+                    previous = family_values.get(key)
+                    if previous is None:
+                        family_values[key] = (sample_name, labels, value)
+                    elif maximum:
+                        family_values[key] = (sample_name, labels, max(previous[2], value))
+                    else:
+                        family_values[key] = (sample_name, labels, previous[2] + value)
+        
+        for name, family in merged.items():
+            family["samples"] = list(values[name].values())
+        return list(merged.values())
+    
+    def render(self) -> str:
+        """Render metrics (merged across workers when configured) as Prometheus text."""
+        if self.multiproc_dir:
+            self.write_snapshot()
+            families = self._merge(self._read_snapshots())
+        else:
+            families = self.collect()
+        
+        lines = []
+        for family in sorted(families, key=lambda item: item["name"]):
+            lines.append(f"# HELP {family['name']} {_escape(family['help'])}")
+            lines.append(f"# TYPE {family['name']} {family['type']}")
+            for sample_name, labels, value in family["samples"]:
+                if labels:
+                    label_text = ",".join(f'{key}="{_escape(str(item))}"' for key, item in labels.items())
+                    lines.append(f"{sample_name}{{{label_text}}} {float(value)!r}")
+                else:
+                    lines.append(f"{sample_name} {float(value)!r}")
+        return "\n".join(lines) + "\n"
+    
+    def _start_flusher(self) -> None:
+        """Start the snapshot writer thread."""
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stop = threading.Event()
+            self._thread = threading.Thread(target=self._run_flusher, name="aems-metrics-flusher", daemon=True)
+            self._thread.start()
+    
+    def _run_flusher(self) -> None:
+        while not self._stop.wait(self.flush_interval):
+            try:
+                self.write_snapshot()
+            except Exception:
+                pass
+    
+    def shutdown(self) -> None:
+        """Stop the writer thread and remove this worker's snapshot."""
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join(self.flush_interval)
+        self._thread = None
+        try:
+            os.remove(self._snapshot_path(os.getpid()))
+        except OSError:
+            pass
+    
+    def _reset_after_fork(self) -> None:
+        """Start a forked worker with empty metrics and its own writer thread."""
+        self._lock = threading.Lock()
+        self._thread = None
+        for metric in self._metrics.values():
+            metric.reset_after_fork()
+        if self.multiproc_dir and self._metrics:
+            self._start_flusher()
+
+
+# Global metrics registry
+registry = MetricsRegistry()
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=registry._reset_after_fork)
+
+atexit.register(registry.shutdown)
+
+
+class MetricsAccess:
+    """Who may scrape /metrics: clients in allowed networks or holding the scrape token.
+    
+    The peer address is used as-is (never X-Forwarded-For), so a client
+    cannot claim to be inside an allowed network.
+    """
+    
+    def __init__(self, allowed_networks: List[str], token: str = ""):
+        self.networks = [ipaddress.ip_network(network, strict=False) for network in allowed_networks]
+        self.token = token
+    
+    def allows(self, request) -> bool:
+        """Check the request's peer address, then its bearer token."""
+        if request.client is not None:
+            try:
+                address = ipaddress.ip_address(request.client.host)
+            except ValueError:
+                address = None
+            if address is not None and any(address in network for network in self.networks):
+                return True
+        if self.token:
+            authorization = request.headers.get("Authorization", "")
+            return authorization.startswith("Bearer ") and hmac.compare_digest(authorization[7:], self.token)
+        return False
+
+
+def render_metrics() -> str:
+    """Render all metrics in the Prometheus text exposition format."""
+    return registry.render()
+
+
+# RED metrics recorded by the shared middleware and the gateway proxy
+http_requests_total = registry.counter(
+    "http_requests_total", "HTTP requests handled", ("method", "route", "status")
+)
+http_request_duration_seconds = registry.histogram(
+    "http_request_duration_seconds", "HTTP request latency", ("method", "route")
+)
+upstream_requests_total = registry.counter(
+    "upstream_requests_total", "Requests proxied to upstream services", ("service", "outcome")
+)
+upstream_request_duration_seconds = registry.histogram(
+    "upstream_request_duration_seconds", "Upstream request latency", ("service",)
+)
+
+
+def _collect_logging_stats() -> List[Dict[str, Any]]:
+    """Export request phase timings and log pipeline/sampler counters."""
+    from ..logging.pipeline import log_pipeline
+    from ..logging.sampling import request_log_sampler
+    from ..logging.timing import PHASE_BUCKETS_MS, timing_aggregator
+    
+    phase_samples: List[Sample] = []
+    for route, phases in timing_aggregator.snapshot().items():
+        for phase, histogram in phases.items():
+            labels = {"route": route, "phase": phase}
+            for bound in PHASE_BUCKETS_MS:
+                phase_samples.append((
+                    "request_phase_duration_seconds_bucket",
+                    {**labels, "le": repr(bound / 1000)},
+                    histogram["buckets"][str(bound)]
+                ))
+            phase_samples.append(("request_phase_duration_seconds_bucket", {**labels, "le": "+Inf"}, histogram["count"]))
+            phase_samples.append(("request_phase_duration_seconds_count", labels, histogram["count"]))
+            phase_samples.append(("request_phase_duration_seconds_sum", labels, histogram["sum_ms"] / 1000))
+    
+    pipeline = log_pipeline.stats()
+    sampler_samples = []
+    for key, count in request_log_sampler.stats().items():
+        outcome, status_class = key.split(":", 1)
+        sampler_samples.append(("request_log_decisions_total", {"outcome": outcome, "status_class": status_class}, count))
+    
+    return [
+        metric_family("request_phase_duration_seconds", "histogram", "Request time by middleware phase", phase_samples),
+        metric_family("log_pipeline_records_total", "counter", "Log records by pipeline outcome", [
+            ("log_pipeline_records_total", {"outcome": outcome}, pipeline[outcome])
+            for outcome in ("enqueued", "dropped", "written")
+        ]),
+        metric_family("log_pipeline_queue_depth", "gauge", "Log records waiting to be written", [
+            ("log_pipeline_queue_depth", {}, pipeline["queue_depth"])
+        ]),
+        metric_family("request_log_decisions_total", "counter", "Request log sampling decisions", sampler_samples),
+    ]
+
+
+registry.register_collector(_collect_logging_stats)
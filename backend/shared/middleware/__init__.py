@@ -7,11 +7,22 @@ from typing import Callable
 from fastapi import Request, Response, HTTPException
 from fastapi.responses import JSONResponse
 from starlette.middleware.base import BaseHTTPMiddleware
+from ..auth.internal_claims import INTERNAL_CLAIMS_HEADER, internal_claims_handler
+from ..auth.jwt_handler import jwt_handler
+from ..auth.session_store import is_session_id, session_store
+from ..exceptions import ServiceOverloadedError
 from ..logging.logger import get_logger
 from ..logging.correlation import correlation_manager
+from ..logging.timing import start_request_timing, timed_phase, timing_aggregator
+from ..logging.tracing import TRACING_ENABLED, TRACEPARENT_HEADER, parse_traceparent, tracer
+from ..metrics import http_request_duration_seconds, http_requests_total, registry
 
 logger = get_logger(__name__)
 
+# Rate limiter metrics
+rate_limit_rejections_total = registry.counter("rate_limit_rejections_total", "Requests rejected by the rate limiter")
+rate_limit_tracked_clients = registry.gauge("rate_limit_tracked_clients", "Client IPs tracked by the rate limiter")
+
 
 class CORSMiddleware(BaseHTTPMiddleware):
     """Custom CORS middleware."""
@@ -52,19 +63,30 @@ class RateLimitMiddleware(BaseHTTPMiddleware):
     async def dispatch(self, request: Request, call_next: Callable) -> Response:
         """Apply rate limiting."""
         client_ip = request.client.host if request.client else "unknown"
-        current_time = time.time()
-        
-        # Clean old entries
-        minute_ago = current_time - 60
-        self.client_requests = {
-            ip: [req_time for req_time in times if req_time > minute_ago]
-            for ip, times in self.client_requests.items()
-        }
         
-        # Check current client rate
-        client_times = self.client_requests.get(client_ip, [])
+        with timed_phase("rate_limit"):
+            current_time = time.time()
+            
+            # Clean old entries
+            minute_ago = current_time - 60
+            self.client_requests = {
+                ip: [req_time for req_time in times if req_time > minute_ago]
+                for ip, times in self.client_requests.items()
+            }
+            
+            # Check current client rate
+            client_times = self.client_requests.get(client_ip, [])
+            limited = len(client_times) >= self.requests_per_minute
+            
+            if not limited:
+                # Record request
+                client_times.append(current_time)
+                self.client_requests[client_ip] = client_times
+            
+            rate_limit_tracked_clients.set(len(self.client_requests))
         
-        if len(client_times) >= self.requests_per_minute:
+        if limited:
+            rate_limit_rejections_total.inc()
             logger.warning(
                 f"Rate limit exceeded for IP: {client_ip}",
                 extra_data={
@@ -82,19 +104,49 @@ class RateLimitMiddleware(BaseHTTPMiddleware):
                 }
             )
         
-        # Record request
-        client_times.append(current_time)
-        self.client_requests[client_ip] = client_times
-        
         return await call_next(request)
 
 
 class AuthenticationMiddleware(BaseHTTPMiddleware):
-    """Authentication middleware for protected routes."""
+    """Authentication middleware for protected routes.
     
-    def __init__(self, app, excluded_paths: list = None):
+    Bearer tokens are fully verified and the user is stored on
+    request.state.user. Services behind the gateway trust its signed
+    X-Internal-Claims header instead, skipping the JWT decode. With
+    validate_sessions, the token's session must also still be active
+    (served from the session store's cache), which slides its expiry.
+    """
+    
+    def __init__(self, app, excluded_paths: list = None, trust_internal_claims: bool = None,
+                 validate_sessions: bool = False):
         super().__init__(app)
         self.excluded_paths = excluded_paths or ["/health", "/docs", "/openapi.json"]
+        # Trusted by default only when INTERNAL_CLAIMS_SECRET is configured
+        if trust_internal_claims is None:
+            trust_internal_claims = internal_claims_handler.enabled
+        self.trust_internal_claims = trust_internal_claims
+        self.validate_sessions = validate_sessions
+    
+    @staticmethod
+    async def _session_active(user: dict) -> bool:
+        """Whether the user's stored session is still active (tokens without one pass)."""
+        session_id = user.get("session_id")
+        if not is_session_id(session_id):
+            return True
+        with timed_phase("auth"):
+            session = await session_store.validate_async(session_id)
+        return session is not None and session.user_id == str(user.get("id"))
+    
+    @staticmethod
+    def _session_ended() -> JSONResponse:
+        return JSONResponse(
+            status_code=401,
+            content={
+                "error": "Authentication failed",
+                "message": "Session has expired or was revoked"
+            },
+            headers={"WWW-Authenticate": "Bearer"}
+        )
     
     async def dispatch(self, request: Request, call_next: Callable) -> Response:
         """Validate authentication for protected routes."""
@@ -106,6 +158,16 @@ class AuthenticationMiddleware(BaseHTTPMiddleware):
         if request.method == "OPTIONS":
             return await call_next(request)
         
+        # Claims already verified at the gateway
+        if self.trust_internal_claims:
+            with timed_phase("auth"):
+                user = internal_claims_handler.verify(request.headers.get(INTERNAL_CLAIMS_HEADER))
+            if user is not None:
+                if self.validate_sessions and not await self._session_active(user):
+                    return self._session_ended()
+                request.state.user = user
+                return await call_next(request)
+        
         # Get authorization header
         auth_header = request.headers.get("Authorization")
         
@@ -127,14 +189,34 @@ class AuthenticationMiddleware(BaseHTTPMiddleware):
             )
         
         try:
-            # Extract token
-            token = auth_header.split(" ")[1]
+            with timed_phase("auth"):
+                # Extract and verify token
+                token = auth_header.split(" ")[1]
+                payload = jwt_handler.verify_access_token(token)
+            
+            if payload is None or not payload.get("sub"):
+                return JSONResponse(
+                    status_code=401,
+                    content={
+                        "error": "Authentication failed",
+                        "message": "Invalid or expired token"
+                    },
+                    headers={"WWW-Authenticate": "Bearer"}
+                )
             
-            # Validate token (implement token validation logic)
-            # For now, we'll add the token to request state
             request.state.token = token
+            request.state.token_expires_at = payload.get("exp")
+            request.state.user = {
+                "id": payload.get("sub"),
+                "email": payload.get("email"),
+                "role": payload.get("role"),
+                "tenant_id": payload.get("tenant_id"),
+                "roles_version": payload.get("roles_version"),
+                "session_id": payload.get("sid")
+            }
             
-            return await call_next(request)
+            if self.validate_sessions and not await self._session_active(request.state.user):
+                return self._session_ended()
             
         except Exception as e:
             logger.error(
@@ -152,6 +234,8 @@ class AuthenticationMiddleware(BaseHTTPMiddleware):
                     "message": "Invalid or expired token"
                 }
             )
+        
+        return await call_next(request)
 
 
 class ErrorHandlingMiddleware(BaseHTTPMiddleware):
@@ -175,6 +259,27 @@ class ErrorHandlingMiddleware(BaseHTTPMiddleware):
             )
             raise
             
+        except ServiceOverloadedError as e:
+            # Shed load quickly; clients retry after the hinted delay
+            logger.warning(
+                f"Request rejected: {e.message}",
+                extra_data={
+                    "path": request.url.path,
+                    "code": e.code,
+                    "type": "overloaded"
+                }
+            )
+            retry_after = e.details.get("retry_after")
+            return JSONResponse(
+                status_code=503,
+                content={
+                    "error": "Service overloaded",
+                    "message": e.message,
+                    "correlation_id": correlation_manager.get_current_id()
+                },
+                headers={"Retry-After": str(retry_after)} if retry_after else None
+            )
+            
         except Exception as e:
             # Log unexpected errors
             logger.error(
@@ -197,6 +302,83 @@ class ErrorHandlingMiddleware(BaseHTTPMiddleware):
             )
 
 
+class ServerTimingMiddleware(BaseHTTPMiddleware):
+    """Per-request phase timing and RED metrics, with an optional Server-Timing header."""
+    
+    async def dispatch(self, request: Request, call_next: Callable) -> Response:
+        """Start phase timing and report it once the response is ready."""
+        timing = start_request_timing()
+        
+        response = await call_next(request)
+        
+        total_ns = timing.elapsed_ns()
+        
+        # Aggregate by route template to keep cardinality bounded
+        route = getattr(request.scope.get("route"), "path", "unmatched")
+        timing_aggregator.record(route, timing, total_ns)
+        http_requests_total.inc((request.method, route, response.status_code))
+        http_request_duration_seconds.observe(total_ns / 1e9, (request.method, route))
+        
+        if timing.emit_header:
+            response.headers["Server-Timing"] = timing.to_header(total_ns)
+        
+        return response
+
+
+class TracingMiddleware(BaseHTTPMiddleware):
+    """Open a server span per request, continuing any incoming W3C trace.
+    
+    Behind the gateway the incoming sampling flag is honoured. At the
+    edge (trust_incoming_sampling=False) the client's trace and span IDs
+    are kept but sampling is decided here, so clients cannot force it.
+    """
+    
+    def __init__(self, app, trust_incoming_sampling: bool = True):
+        super().__init__(app)
+        self.trust_incoming_sampling = trust_incoming_sampling
+    
+    async def dispatch(self, request: Request, call_next: Callable) -> Response:
+        """Run the request inside a server span."""
+        parent = parse_traceparent(request.headers.get(TRACEPARENT_HEADER))
+        if parent is not None and not self.trust_incoming_sampling:
+            parent = tracer.resample(parent)
+        attributes = {
+            "http.method": request.method,
+            "http.target": request.url.path,
+            "correlation_id": correlation_manager.get_current_id()
+        }
+        
+        with tracer.span(f"{request.method} {request.url.path}", "server", attributes, parent) as span:
+            response = await call_next(request)
+            
+            # Name by route template to keep span names low-cardinality
+            route = request.scope.get("route")
+            if route is not None:
+                span.name = f"{request.method} {route.path}"
+            span.set_attribute("http.status_code", response.status_code)
+            if response.status_code >= 500:
+                span.set_error(f"HTTP {response.status_code}")
+        
+        return response
+
+
+class CorrelationIDMiddleware(BaseHTTPMiddleware):
+    """Establish the request correlation ID before any other layer runs."""
+    
+    async def dispatch(self, request: Request, call_next: Callable) -> Response:
+        """Set correlation ID context and echo it on the response."""
+        correlation_id = correlation_manager.start_request(request)
+        
+        try:
+            response = await call_next(request)
+        finally:
+            correlation_manager.clear_context()
+        
+        response.headers["X-Correlation-ID"] = correlation_id
+        response.headers["X-Request-ID"] = correlation_id
+        return response
+
+
 def add_middleware(app, config: dict = None):
     """Add all middleware to FastAPI app."""
     config = config or {}
@@ -220,5 +402,20 @@ def add_middleware(app, config: dict = None):
     # Add authentication middleware
     app.add_middleware(
         AuthenticationMiddleware,
-        excluded_paths=config.get("excluded_paths", ["/health", "/docs", "/openapi.json"])
-    )
\ No newline at end of file
+        excluded_paths=config.get("excluded_paths", ["/health", "/docs", "/openapi.json"]),
+        trust_internal_claims=config.get("trust_internal_claims"),
+        validate_sessions=config.get("validate_sessions", False)
+    )
+    
+    # Add server timing middleware
+    app.add_middleware(ServerTimingMiddleware)
+    
+    # Add tracing middleware
+    if TRACING_ENABLED:
+        app.add_middleware(
+            TracingMiddleware,
+            trust_incoming_sampling=config.get("trust_incoming_sampling", True)
+        )
+    
+    # Add correlation ID middleware (added last so it wraps every other layer)
+    app.add_middleware(CorrelationIDMiddleware)
\ No newline at end of file
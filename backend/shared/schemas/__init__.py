@@ -31,6 +31,12 @@ class TenantSchema(BaseSchema):
     slug: str = Field(..., min_length=1, max_length=100)
 
 
+class TenantRoleSchema(BaseSchema):
+    """Tenant-defined role: granted permissions plus inherited roles."""
+    permissions: List[str] = Field(default_factory=list)
+    inherits: List[str] = Field(default_factory=list)
+
+
 class UserBaseSchema(BaseSchema):
     """Base user schema."""
     email: EmailStr
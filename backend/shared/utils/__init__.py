@@ -8,6 +8,7 @@ import secrets
 import string
 import uuid
 from datetime import datetime, timezone
+from functools import lru_cache
 from typing import Dict, Any, Optional, List
 import json
 import re
@@ -76,21 +77,26 @@ def validate_phone(phone: str) -> bool:
     return re.match(pattern, phone.replace(' ', '')) is not None
 
 
+@lru_cache(maxsize=32)
+def _compile_field_pattern(fields: tuple) -> "re.Pattern":
+    """Compile sensitive field names into a single case-insensitive pattern."""
+    return re.compile("|".join(re.escape(field) for field in fields), re.IGNORECASE)
+
+
 def mask_sensitive_data(data: Dict[str, Any], fields: List[str] = None) -> Dict[str, Any]:
     """Mask sensitive fields in data dictionary."""
     if fields is None:
         fields = ['password', 'token', 'secret', 'key', 'api_key', 'auth']
     
+    pattern = _compile_field_pattern(tuple(fields))
     masked_data = data.copy()
     
-    for field in fields:
-        for key in masked_data:
-            if field.lower() in key.lower():
-                value = masked_data[key]
-                if isinstance(value, str) and len(value) > 4:
-                    masked_data[key] = f"{value[:2]}{'*' * (len(value) - 4)}{value[-2:]}"
-                else:
-                    masked_data[key] = "***"
+    for key, value in data.items():
+        if pattern.search(key):
+            if isinstance(value, str) and len(value) > 4:
+                masked_data[key] = f"{value[:2]}{'*' * (len(value) - 4)}{value[-2:]}"
+            else:
+                masked_data[key] = "***"
     
     return masked_data
 
@@ -0,0 +1,76 @@
+"""
+Regression tests for top-level field extraction in the log indexer.
+"""
+
+import logging
+import sys
+from pathlib import Path
+
+# Make shared modules importable when run from the backend directory
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from shared.logging.indexer import LogIndex, _line_tenant
+from shared.logging.logger import JSONFormatter
+
+
+def _format(formatter, message, tenant_id, extra):
+    """Format one line the way LoggingMiddleware writes request logs."""
+    record = logging.LogRecord("test", logging.INFO, __file__, 1, message, None, None)
+    record.correlation_id = None
+    record.user_id = None
+    record.tenant_id = tenant_id
+    record.extra_data = extra
+    return formatter.format(record)
+
+
+def _write_log(path, lines):
+    """Write formatted lines as a log file."""
+    with open(path, "w", encoding="utf-8") as log_file:
+        log_file.write("\n".join(lines) + "\n")
+
+
+def test_null_top_level_tenant_does_not_match_nested_tenant():
+    formatter = JSONFormatter(backend="json")
+    line = _format(formatter, "request", None, {"query_params": {"tenant_id": "t9"}})
+    
+    assert _line_tenant(line.encode("utf-8")) is None
+
+
+def test_nested_ids_are_not_indexed(tmp_path):
+    formatter = JSONFormatter(backend="json")
+    lines = []
+    for number in range(500):
+        tenant_id = None if number % 2 else "t1"
+        extra = {"tenant_id": "t9", "user_id": "u9", "correlation_id": "c9"}
+        lines.append(_format(formatter, f"request {number}", tenant_id, extra))
+    log_path = tmp_path / "aems.log"
+    _write_log(log_path, lines)
+    
+    index = LogIndex(str(log_path), str(tmp_path / "index"))
+    try:
+        index.update()
+        assert index.lookup("tenant_id", "t9") == []
+        assert index.lookup("user_id", "u9") == []
+        assert index.lookup("correlation_id", "c9") == []
+        assert len(index.lookup("tenant_id", "t1")) == 250
+    finally:
+        index.close()
+
+
+def test_tenant_filter_uses_top_level_tenant(tmp_path):
+    formatter = JSONFormatter(backend="json")
+    lines = [
+        _format(formatter, "own", "t1", {"tenant_id": "t9"}),
+        _format(formatter, "anonymous", None, {"tenant_id": "t9"}),
+        _format(formatter, "other", "t9", {}),
+    ]
+    log_path = tmp_path / "aems.log"
+    _write_log(log_path, lines)
+    
+    index = LogIndex(str(log_path), str(tmp_path / "index"))
+    try:
+        index.update()
+        messages = [entry["message"] for entry in index.lookup("tenant_id", "t9", tenant_id="t9")]
+        assert messages == ["other"]
+    finally:
+        index.close()